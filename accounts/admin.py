@@ -1,6 +1,44 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.utils.decorators import method_decorator
+from core.pagination import CappedCountPaginator
+from django_bank.routers import read_from_replica
 from .models import UserBankAccount, UserAddress
 
 # Register your models here.
-admin.site.register(UserBankAccount)
-admin.site.register(UserAddress)
\ No newline at end of file
+admin.site.register(UserAddress)
+
+
+def account_search(term, prefix=''):
+    # an exact account number or a username prefix. both are served by unique indexes, unlike django's default search that casts account_no to text and runs icontains on the username.
+    query = Q(**{f'{prefix}user__username__startswith': term})
+    if term.isdigit():
+        query |= Q(**{f'{prefix}account_no': int(term)})
+    return query
+
+
+@admin.register(UserBankAccount)
+class UserBankAccountAdmin(admin.ModelAdmin):
+    list_display = ['account_no', 'user', 'account_type', 'balance']
+    list_select_related = ['user']
+    # the account_no unique index gives the changelist and the autocomplete pages a stable order without sorting the table.
+    ordering = ['account_no']
+    # also used by the account autocomplete of the transaction form.
+    search_fields = ['user__username']
+    search_help_text = 'Account number or the start of a username.'
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+
+    @method_decorator(read_from_replica)
+    def changelist_view(self, request, extra_context=None):
+        return super().changelist_view(request, extra_context)
+
+    def get_queryset(self, request):
+        # __str__ shows the username. the autocomplete doesn't use list_select_related, so join the user here.
+        return super().get_queryset(request).select_related('user')
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(account_search(term)), False
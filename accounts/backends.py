@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class AccountBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's bank account and address together with
+    the user, so ``request.user.account`` and ``request.user.address`` don't
+    cost a query each on every request.
+    """
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            # users without an account (staff) just get an empty relation, no extra query either.
+            user = UserModel._default_manager.select_related(
+                'account', 'address').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        # request.auser() in async views. ModelBackend's version wouldn't join the account.
+        UserModel = get_user_model()
+        try:
+            user = await UserModel._default_manager.select_related(
+                'account', 'address').aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,45 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from .models import UserBankAccount
+
+# account_no -> who owns it, for transfers. the entries live in the cache framework (a bounded LRU in each process with the default LocMemCache, shared with redis or memcached) for ACCOUNT_DIRECTORY_TIMEOUT seconds. accounts/signals.py drops an entry when its account or user changes. a local cache only hears about changes made by its own process, so other processes can serve an old name or email until the entry expires.
+
+DirectoryEntry = namedtuple(
+    'DirectoryEntry', 'account_id account_no user_id username email first_name last_name')
+
+
+def cache_key(account_no):
+    return f'account-directory:{account_no}'
+
+
+def lookup(account_no):
+    """The DirectoryEntry of an account number, or None if there is no such account."""
+    entry = cache.get(cache_key(account_no))
+    if entry is None:
+        row = UserBankAccount.objects.filter(account_no=account_no).values_list(
+            'pk', 'account_no', 'user_id', 'user__username', 'user__email', 'user__first_name', 'user__last_name').first()
+        if row is None:
+            return None
+        entry = DirectoryEntry(*row)
+        cache.set(cache_key(account_no), entry, settings.ACCOUNT_DIRECTORY_TIMEOUT)
+    return entry
+
+
+def invalidate(account_no):
+    cache.delete(cache_key(account_no))
+
+
+def as_account(entry):
+    """
+    An account with its user attached, built from a directory entry without a
+    query. It has no balance: enough to post a transfer to and to address the
+    emails, not to show the balance before the transfer.
+    """
+    account = UserBankAccount(pk=entry.account_id, account_no=entry.account_no)
+    account.user = User(pk=entry.user_id, username=entry.username, email=entry.email,
+                        first_name=entry.first_name, last_name=entry.last_name)
+    return account
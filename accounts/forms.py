@@ -2,7 +2,7 @@
 
 from django.contrib.auth.forms import UserCreationForm
 from django import forms
-from django_bank.constants import ACCOUNT_TYPE, GENDER_TYPE
+from django_bank.constants import ACCOUNT_NO_START, ACCOUNT_TYPE, GENDER_TYPE
 from django.contrib.auth.models import User
 from .models import UserBankAccount, UserAddress
 
@@ -53,7 +53,7 @@ class UserRegistrationForm(UserCreationForm):
 
             UserBankAccount.objects.create(
                 user=customer,
-                account_no=2024000 + customer.id,
+                account_no=ACCOUNT_NO_START + customer.id,
                 account_type=account_type,
                 gender=gender,
                 birth_date=birth_date
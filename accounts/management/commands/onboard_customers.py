@@ -0,0 +1,180 @@
+import csv
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from accounts.models import UserAddress, UserBankAccount
+from accounts.passwords import hash_passwords, init_worker
+from django_bank.constants import ACCOUNT_NO_START, ACCOUNT_TYPE, GENDER_TYPE
+
+COLUMNS = ['username', 'first_name', 'last_name', 'email', 'password', 'account_type',
+           'gender', 'birth_date', 'street_address', 'city', 'postal_code', 'country']
+ACCOUNT_TYPES = {value for value, _ in ACCOUNT_TYPE}
+GENDERS = {value for value, _ in GENDER_TYPE}
+# checked while parsing: postgres and mysql refuse longer values with a DataError that would abort the whole chunk.
+MAX_LENGTHS = {
+    name: model._meta.get_field(name).max_length
+    for model, names in ((User, ['username', 'first_name', 'last_name', 'email']),
+                         (UserAddress, ['street_address', 'city', 'country']))
+    for name in names
+}
+# a chunk whose insert hits a username that was taken after the check (a signup at the same time) is checked and inserted again.
+INSERT_ATTEMPTS = 3
+
+
+def parse_row(row):
+    # returns (customer dict, None) or (None, reason).
+    if len(row) != len(COLUMNS):
+        return None, f'expected {len(COLUMNS)} columns'
+    customer = dict(zip(COLUMNS, (value.strip() for value in row)))
+    if not customer['username'] or not customer['password']:
+        return None, 'username and password are required'
+    for name, max_length in MAX_LENGTHS.items():
+        if len(customer[name]) > max_length:
+            return None, f'{name} is longer than {max_length} characters'
+    if customer['account_type'] not in ACCOUNT_TYPES:
+        return None, f"unknown account type {customer['account_type']!r}"
+    if customer['gender'] not in GENDERS:
+        return None, f"unknown gender {customer['gender']!r}"
+    try:
+        customer['birth_date'] = date.fromisoformat(customer['birth_date'])
+        customer['postal_code'] = int(customer['postal_code'])
+    except ValueError:
+        return None, 'invalid birth date or postal code'
+    return customer, None
+
+
+class Command(BaseCommand):
+    help = 'Create customers (user, address and bank account) in bulk from a CSV file, hashing passwords in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help=f'CSV with the columns: {",".join(COLUMNS)}')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Customers created per database transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes used for password hashing.')
+
+    def handle(self, *args, **options):
+        self.timings = dict.fromkeys(
+            ['parse', 'hash (waiting)', 'hash (cpu)', 'users', 'addresses and accounts'], 0.0)
+        self.created = 0
+        self.rejected = []
+        chunk_size = options['chunk_size']
+
+        started = time.perf_counter()
+        # spawn instead of fork: the workers only hash, and must not inherit our open database connection.
+        pool = ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_worker)
+        with open(options['path'], newline='', encoding='utf-8-sig') as customer_file, pool:
+            chunks = self.read_chunks(csv.reader(customer_file), chunk_size)
+            # keep every worker busy: hashing of the next chunks runs while the current one is inserted.
+            pending = []
+            for customers in chunks:
+                pending.append((customers, pool.submit(
+                    hash_passwords, [c['password'] for c in customers])))
+                if len(pending) > options['workers']:
+                    self.insert(*pending.pop(0))
+            for customers, future in pending:
+                self.insert(customers, future)
+        elapsed = time.perf_counter() - started
+
+        for line_no, reason in self.rejected:
+            self.stdout.write(f'line {line_no}: {reason}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {self.created} customer(s) in {elapsed:.1f}s '
+            f'({self.created / elapsed if elapsed else 0:.0f}/s). Rejected {len(self.rejected)} line(s).'))
+        for stage, seconds in self.timings.items():
+            rate = self.created / seconds if seconds else 0
+            self.stdout.write(f'  {stage:<24} {seconds:8.2f}s  {rate:10.0f} customers/s')
+
+    def read_chunks(self, reader, chunk_size):
+        line_no = 0
+        while True:
+            started = time.perf_counter()
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            customers = []
+            for row in rows:
+                line_no += 1
+                if line_no == 1 and row and row[0].strip().lower() == 'username':
+                    continue
+                customer, reason = parse_row(row)
+                if customer is None:
+                    self.rejected.append((line_no, reason))
+                else:
+                    customer['line_no'] = line_no
+                    customers.append(customer)
+            self.timings['parse'] += time.perf_counter() - started
+            if customers:
+                yield customers
+
+    def insert(self, customers, future):
+        started = time.perf_counter()
+        hashes, cpu_time = future.result()
+        self.timings['hash (waiting)'] += time.perf_counter() - started
+        self.timings['hash (cpu)'] += cpu_time
+
+        for _ in range(INSERT_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    created, rejected = self.create_customers(customers, hashes)
+            except IntegrityError as error:
+                # rolled back, nothing of the chunk was created.
+                last_error = error
+                continue
+            self.created += created
+            self.rejected += rejected
+            return
+        self.rejected += [(c['line_no'], f'not created, the chunk failed: {last_error}') for c in customers]
+
+    def create_customers(self, customers, hashes):
+        # returns (customers created, rejected lines). runs inside the chunk's transaction.
+        # one query for the whole chunk instead of an IntegrityError per duplicate.
+        taken = set(User.objects.filter(
+            username__in=[c['username'] for c in customers]).values_list('username', flat=True))
+        users = []
+        accepted = []
+        rejected = []
+        for customer, password in zip(customers, hashes):
+            if customer['username'] in taken:
+                rejected.append(
+                    (customer['line_no'], f"username {customer['username']!r} already exists"))
+                continue
+            taken.add(customer['username'])
+            users.append(User(username=customer['username'], first_name=customer['first_name'],
+                              last_name=customer['last_name'], email=customer['email'], password=password))
+            accepted.append(customer)
+        if not users:
+            return 0, rejected
+
+        started = time.perf_counter()
+        users = User.objects.bulk_create(users)
+        if users[0].pk is None:
+            # backends that can't return ids from a bulk insert: read them back by username.
+            ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+        self.timings['users'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        # the ids of the bulk insert are a block the database reserved for us, so the account numbers derived from them (like in UserRegistrationForm) are already unique.
+        UserAddress.objects.bulk_create([
+            UserAddress(user=user, street_address=c['street_address'], city=c['city'],
+                        postal_code=c['postal_code'], country=c['country'])
+            for user, c in zip(users, accepted)
+        ])
+        UserBankAccount.objects.bulk_create([
+            UserBankAccount(user=user, account_no=ACCOUNT_NO_START + user.pk, account_type=c['account_type'],
+                            gender=c['gender'], birth_date=c['birth_date'])
+            for user, c in zip(users, accepted)
+        ])
+        self.timings['addresses and accounts'] += time.perf_counter() - started
+        return len(users), rejected
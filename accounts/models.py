@@ -17,6 +17,10 @@ class UserBankAccount(models.Model):
     gender = models.CharField(max_length=10, choices=GENDER_TYPE)
     balance = models.DecimalField(default=0, max_digits=12, decimal_places=2)
     initial_deposit_date = models.DateField(auto_now_add=True)
+    # loan counters, kept in sync by transactions.services so the loan limit doesn't need a count query. open_loans counts every loan that isn't repaid (pending too), outstanding_loan_amount only the approved ones. reconcile_loan_counters rebuilds both from the ledger.
+    open_loans = models.PositiveIntegerField(default=0)
+    outstanding_loan_amount = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
 
     def __str__(self):
         return f"{self.account_no} - {self.user.username} - {self.account_type}"
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import directory
+from .models import UserBankAccount
+
+# the user fields that are copied into the account directory.
+DIRECTORY_USER_FIELDS = {'username', 'email', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=UserBankAccount)
+@receiver(post_delete, sender=UserBankAccount)
+def drop_account_from_directory(sender, instance, **kwargs):
+    directory.invalidate(instance.account_no)
+
+
+@receiver(post_save, sender=User)
+def drop_user_from_directory(sender, instance, created, update_fields=None, **kwargs):
+    # a new user has no account yet, and every login saves last_login alone. neither needs a query for the account number. deleting a user deletes the account, which has its own signal.
+    if created or update_fields is not None and not DIRECTORY_USER_FIELDS & set(update_fields):
+        return
+    for account_no in UserBankAccount.objects.filter(user_id=instance.pk).values_list('account_no', flat=True):
+        directory.invalidate(account_no)
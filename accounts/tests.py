@@ -1,3 +1,145 @@
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
+from django.urls import reverse
+
+from accounts import directory
+from accounts.management.commands.onboard_customers import Command as OnboardCommand
+from accounts.models import UserAddress, UserBankAccount
+from django_bank.constants import ACCOUNT_NO_START
 
 # Create your tests here.
+
+HEADER = 'username,first_name,last_name,email,password,account_type,gender,birth_date,street_address,city,postal_code,country\n'
+
+
+class OnboardCustomersTests(TestCase):
+    def run_command(self, lines):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as customer_file:
+            customer_file.write(HEADER + ''.join(lines))
+            customer_file.flush()
+            out = StringIO()
+            call_command('onboard_customers', customer_file.name,
+                         workers=1, chunk_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_creates_user_address_and_account(self):
+        self.run_command([
+            'alice,Alice,A,alice@example.com,secret-1,Saving,Female,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+        ])
+        user = User.objects.select_related('account', 'address').get(username='alice')
+        self.assertTrue(user.check_password('secret-1'))
+        self.assertEqual(user.account.account_no, ACCOUNT_NO_START + user.pk)
+        self.assertEqual(user.address.postal_code, 1200)
+
+    def test_rejects_bad_lines_and_existing_usernames(self):
+        User.objects.create_user('bob', password='x')
+        output = self.run_command([
+            'bob,Bob,B,bob@example.com,secret-2,Saving,Male,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+            'carol,Carol,C,carol@example.com,secret-3,Current,Female,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+            'dave,Dave,D,dave@example.com,secret-4,Checking,Male,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+            'eve,broken\n',
+        ])
+        self.assertIn("line 2: username 'bob' already exists", output)
+        self.assertIn("line 4: unknown account type 'Checking'", output)
+        self.assertIn('line 5: expected 12 columns', output)
+        self.assertIn('Created 1 customer(s)', output)
+        self.assertTrue(User.objects.filter(username='carol', account__isnull=False).exists())
+
+    def test_rejects_values_longer_than_their_field(self):
+        output = self.run_command([
+            f'frank,{"F" * 151},F,frank@example.com,secret-5,Saving,Male,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+            f'grace,Grace,G,grace@example.com,secret-6,Saving,Female,1990-01-02,1 Road,{"D" * 51},1200,Bangladesh\n',
+        ])
+        self.assertIn('line 2: first_name is longer than 150 characters', output)
+        self.assertIn('line 3: city is longer than 50 characters', output)
+        self.assertFalse(User.objects.exists())
+
+    def test_username_taken_during_the_insert_is_reported(self):
+        create_customers = OnboardCommand.create_customers
+        User.objects.create_user('heidi')
+        attempts = []
+
+        def signup_meanwhile(command, customers, hashes):
+            # the first attempt runs into a signup that took the name after the check.
+            attempts.append([c['username'] for c in customers])
+            if len(attempts) == 1:
+                raise IntegrityError('UNIQUE constraint failed: auth_user.username')
+            return create_customers(command, customers, hashes)
+
+        with mock.patch.object(OnboardCommand, 'create_customers', autospec=True, side_effect=signup_meanwhile):
+            output = self.run_command([
+                'heidi,Heidi,H,heidi@example.com,secret-7,Saving,Female,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+                'ivan,Ivan,I,ivan@example.com,secret-8,Saving,Male,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+            ])
+        self.assertEqual(attempts, [['heidi'], ['heidi'], ['ivan']])
+        self.assertIn("line 2: username 'heidi' already exists", output)
+        self.assertIn('Created 1 customer(s)', output)
+
+    def test_chunk_that_keeps_failing_is_reported(self):
+        with mock.patch.object(OnboardCommand, 'create_customers', side_effect=IntegrityError('boom')):
+            output = self.run_command([
+                'judy,Judy,J,judy@example.com,secret-9,Saving,Female,1990-01-02,1 Road,Dhaka,1200,Bangladesh\n',
+            ])
+        self.assertIn('line 2: not created, the chunk failed: boom', output)
+        self.assertIn('Created 0 customer(s)', output)
+
+
+class QueryCountTests(TestCase):
+    # AccountBackend joins the account and address into the user query, so the profile pages don't fetch them again.
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret-pass-123')
+        UserBankAccount.objects.create(user=self.user, account_no=ACCOUNT_NO_START + self.user.pk,
+                                       account_type='Saving', gender='Female')
+        UserAddress.objects.create(user=self.user, street_address='1 Road',
+                                   city='Dhaka', postal_code=1200, country='Bangladesh')
+
+    def assertQueries(self, url, num, method='get', status_code=200):
+        with self.assertNumQueries(num):
+            response = getattr(self.client, method)(url)
+        self.assertEqual(response.status_code, status_code)
+
+    def test_anonymous_pages(self):
+        self.assertQueries(reverse('register'), 0)
+        self.assertQueries(reverse('login'), 0)
+
+    def test_customer_pages(self):
+        self.client.force_login(self.user)
+        self.assertQueries(reverse('profile'), 2)
+        self.assertQueries(reverse('change_password'), 2)
+        self.assertQueries(reverse('logout'), 4, method='post', status_code=302)
+
+
+class AccountDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', email='alice@example.com')
+        self.account = UserBankAccount.objects.create(user=self.user, account_no=ACCOUNT_NO_START + self.user.pk,
+                                                      account_type='Saving', gender='Female')
+
+    def test_lookup_is_cached(self):
+        with self.assertNumQueries(1):
+            directory.lookup(self.account.account_no)
+        with self.assertNumQueries(0):
+            entry = directory.lookup(self.account.account_no)
+        self.assertEqual((entry.account_id, entry.email), (self.account.pk, 'alice@example.com'))
+        self.assertIsNone(directory.lookup(1))
+
+    def test_changes_drop_the_entry(self):
+        directory.lookup(self.account.account_no)
+        self.user.email = 'alice@example.org'
+        self.user.save()
+        self.assertEqual(directory.lookup(self.account.account_no).email, 'alice@example.org')
+
+        # last_login alone doesn't touch the directory.
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
+
+        self.account.delete()
+        self.assertIsNone(directory.lookup(self.account.account_no))
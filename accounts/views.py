@@ -10,8 +10,9 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib.auth.views import PasswordChangeView
 from django.contrib.auth.forms import PasswordChangeForm
-from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
 from django.template.loader import render_to_string
+from core.outbox import queue_email
 
 
 class UserRegistration(FormView):
@@ -69,6 +70,7 @@ class UserPasswordChange(PasswordChangeView):
     form_class = PasswordChangeForm
     success_url = reverse_lazy('profile')
 
+    @transaction.atomic
     def form_valid(self, form):
         messages.success(self.request, 'Password Changed Successfully!')
 
@@ -81,11 +83,7 @@ class UserPasswordChange(PasswordChangeView):
         message = render_to_string(html_template, {
             'user': user,
         })
-        send_email = EmailMultiAlternatives(
-            mail_subject, message, to=[email]
-        )
-        send_email.attach_alternative(message, "text/html")
-        send_email.send()
+        queue_email(mail_subject, email, html_body=message, body=message)
 
         return super().form_valid(form)
 
@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import OutboxEmail
 
 # Register your models here.
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['to', 'subject', 'status',
+                    'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
@@ -0,0 +1,189 @@
+import asyncio
+import io
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from accounts.models import UserBankAccount
+from transactions.models import Transaction
+
+BENCH_USERNAME = 'bench_asgi'
+
+
+class Command(BaseCommand):
+    help = ('Serve the same requests through the WSGI handler (a pool of server threads, sync views) and the '
+            'ASGI handler (one event loop, ASYNC_VIEWS) with the same number of clients in flight, and compare '
+            'throughput and latency. --latency adds a wait to every query, like a database over the network.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=['both', 'wsgi', 'asgi'], default='both',
+                            help='both runs each interface in a process of its own, with ASYNC_VIEWS set to match.')
+        parser.add_argument('--url-name', default='transaction-report',
+                            help='transaction-report, loan-list or home.')
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Clients with a request in flight at any time.')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='WSGI server threads, e.g. gunicorn --threads.')
+        parser.add_argument('--latency', type=float, default=0.01,
+                            help='Seconds added to every query.')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the benchmark account afterwards.")
+
+    def handle(self, *args, **options):
+        created = not User.objects.filter(username=BENCH_USERNAME).exists()
+        user = self.seed() if created else User.objects.get(username=BENCH_USERNAME)
+        try:
+            if options['interface'] == 'both':
+                for interface in ('wsgi', 'asgi'):
+                    self.spawn(interface, options)
+            else:
+                self.run(options['interface'], user, options)
+        finally:
+            if created and not options['keep']:
+                user.delete()
+
+    def spawn(self, interface, options):
+        # the urls pick the sync or the async views when they are imported, so each interface gets a fresh process.
+        command = [sys.executable, '-m', 'django', 'bench_asgi', '--interface', interface, '--keep',
+                   '--url-name', options['url_name'], '--requests', str(options['requests']),
+                   '--concurrency', str(options['concurrency']), '--threads', str(options['threads']),
+                   '--latency', str(options['latency'])]
+        env = {**os.environ, 'ASYNC_VIEWS': '1' if interface == 'asgi' else '0'}
+        if subprocess.run(command, env=env).returncode:
+            raise CommandError(f'The {interface} run failed.')
+
+    def run(self, interface, user, options):
+        if (interface == 'asgi') != settings.ASYNC_VIEWS:
+            self.stderr.write(f'ASYNC_VIEWS is {"on" if settings.ASYNC_VIEWS else "off"} for the {interface} run, '
+                              f'use --interface both to compare the intended setups.')
+        client = Client()
+        client.force_login(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        path = reverse(options['url_name'])
+
+        latency = options['latency']
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(delay)
+
+        # every request opens its own connection (CONN_MAX_AGE), in whichever thread runs its queries.
+        if latency:
+            connection_created.connect(add_latency)
+        self.threads = threading.active_count()
+        started = time.perf_counter()
+        if interface == 'wsgi':
+            results = self.run_wsgi(path, cookie, options)
+        else:
+            results = asyncio.run(self.run_asgi(path, cookie, options))
+        elapsed = time.perf_counter() - started
+        connection_created.disconnect(add_latency)
+
+        timings = sorted(seconds for seconds, _ in results)
+        failed = sum(status != 200 for _, status in results)
+        workers = f'{options["threads"]} server threads' if interface == 'wsgi' else 'one event loop'
+        self.stdout.write(
+            f'{interface.upper()} ({workers}), {path} x{len(results)}, {options["concurrency"]} in flight, '
+            f'{latency * 1000:.0f} ms per query')
+        self.stdout.write(
+            f'  {len(results) / elapsed:8.1f} requests/s  p50 {statistics.median(timings) * 1000:7.1f} ms  '
+            f'p95 {timings[int(len(timings) * 0.95) - 1] * 1000:7.1f} ms  '
+            f'{self.threads} threads at most  {failed} failed')
+
+    def count_threads(self):
+        self.threads = max(self.threads, threading.active_count())
+
+    def run_wsgi(self, path, cookie, options):
+        application = get_wsgi_application()
+
+        def serve():
+            status = []
+            body = application({
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost', 'HTTP_COOKIE': cookie,
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }, lambda status_line, headers, exc_info=None: status.append(int(status_line[:3])))
+            for _ in body:
+                pass
+            # closing the response sends request_finished, which closes the connection.
+            body.close()
+            self.count_threads()
+            return status[0]
+
+        # the server's threads, and the clients queueing for them. a request's time includes the wait for a thread.
+        with ThreadPoolExecutor(options['threads']) as server, \
+                ThreadPoolExecutor(options['concurrency']) as clients:
+            def request(_):
+                started = time.perf_counter()
+                status = server.submit(serve).result()
+                return time.perf_counter() - started, status
+            return list(clients.map(request, range(options['requests'])))
+
+    async def run_asgi(self, path, cookie, options):
+        application = get_asgi_application()
+        in_flight = asyncio.Semaphore(options['concurrency'])
+
+        async def request():
+            async with in_flight:
+                started = time.perf_counter()
+                sent = []
+                scope = {
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+                    'query_string': b'', 'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+                    'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+                }
+
+                async def receive():
+                    if not sent:
+                        sent.append(None)
+                        return {'type': 'http.request', 'body': b'', 'more_body': False}
+                    # the client stays connected, django stops listening once the response is sent.
+                    await asyncio.Event().wait()
+
+                status = []
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        status.append(message['status'])
+
+                await application(scope, receive, send)
+                self.count_threads()
+                return time.perf_counter() - started, status[0]
+
+        return await asyncio.gather(*(request() for _ in range(options['requests'])))
+
+    def seed(self):
+        user = User.objects.create_user(username=BENCH_USERNAME, first_name='Bench')
+        account = UserBankAccount.objects.create(
+            user=user, account_no=940000000, account_type='Saving', gender='Male')
+        balance = Decimal(0)
+        rows = []
+        for _ in range(100):
+            balance += 10
+            rows.append(Transaction(account=account, amount=Decimal(10),
+                                    balance_after_transaction=balance, transaction_type='Deposit'))
+        Transaction.objects.bulk_create(rows)
+        UserBankAccount.objects.filter(pk=account.pk).update(balance=balance)
+        return user
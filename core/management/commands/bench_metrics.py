@@ -0,0 +1,87 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, modify_settings
+from django.urls import reverse
+
+from accounts.models import UserBankAccount
+from core import metrics
+from transactions.models import Transaction
+
+BENCH_USERNAME = 'bench_metrics'
+MIDDLEWARE = 'core.middleware.MetricsMiddleware'
+
+
+class Command(BaseCommand):
+    help = 'Measure the overhead of MetricsMiddleware on the transaction report, with and without the middleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per round and configuration.')
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the benchmark account afterwards.")
+
+    def handle(self, *args, **options):
+        account = self.seed()
+        url = reverse('transaction-report')
+        timings = {'without': [], 'with': []}
+
+        # the configurations take turns, so drift on the machine (cache, cpu frequency) hits both.
+        for _ in range(options['rounds']):
+            for name in timings:
+                timings[name].append(self.run(
+                    account.user, url, options['requests'], with_metrics=name == 'with'))
+
+        without = statistics.median(timings['without'])
+        with_metrics = statistics.median(timings['with'])
+        self.stdout.write(
+            f'{url}  x{options["requests"]} per round, {options["rounds"]} rounds (median of rounds)')
+        self.stdout.write(
+            f'  without metrics  {without * 1000:8.3f} ms/request')
+        self.stdout.write(
+            f'  with metrics     {with_metrics * 1000:8.3f} ms/request')
+        self.stdout.write(
+            f'  overhead         {(with_metrics / without - 1) * 100:+7.2f} %')
+
+        # the cost of one observation on its own, without the request around it.
+        histogram = metrics.Histogram('bench_seconds', 'bench', labels=('view',))
+        count = 100000
+        started = time.perf_counter()
+        for i in range(count):
+            histogram.observe(0.01, 'transaction-report')
+        self.stdout.write(
+            f'  histogram.observe {(time.perf_counter() - started) / count * 1e6:7.3f} us/call')
+
+        if not options['keep']:
+            account.user.delete()
+
+    def run(self, user, url, requests, with_metrics):
+        settings = {} if with_metrics else {'remove': MIDDLEWARE}
+        with modify_settings(MIDDLEWARE=settings):
+            # a new client builds its middleware chain on the first request, from the settings in effect then.
+            client = Client()
+            client.force_login(user)
+            client.get(url)
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get(url)
+            return (time.perf_counter() - started) / requests
+
+    def seed(self):
+        User.objects.filter(username=BENCH_USERNAME).delete()
+        user = User.objects.create_user(username=BENCH_USERNAME)
+        account = UserBankAccount.objects.create(
+            user=user, account_no=920000000, account_type='Saving', gender='Male')
+        balance = Decimal(0)
+        rows = []
+        for _ in range(100):
+            balance += 10
+            rows.append(Transaction(account=account, amount=Decimal(10),
+                                    balance_after_transaction=balance, transaction_type='Deposit'))
+        Transaction.objects.bulk_create(rows)
+        UserBankAccount.objects.filter(pk=account.pk).update(balance=balance)
+        return account
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import deliver_pending, get_batch_size, queue_depth
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox in batches over one mail connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=get_batch_size(),
+                            help='Number of emails sent per mail connection.')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox instead of exiting when it is empty.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to sleep between polls in --loop mode.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total_sent = total_failed = 0
+
+        while True:
+            sent, failed = deliver_pending(batch_size)
+            total_sent += sent
+            total_failed += failed
+
+            # a full batch means there is probably more waiting, so don't sleep.
+            if sent + failed >= batch_size:
+                continue
+            if not options['loop']:
+                break
+
+            self.stdout.write(
+                f'outbox_queue_depth {queue_depth()} sent {total_sent} failed {total_failed}')
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {total_sent} email(s), {total_failed} failed attempt(s). '
+            f'Queue depth: {queue_depth()}'))
@@ -0,0 +1,129 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# in-process metrics in the prometheus text format. every worker process keeps its own numbers, so the scraper has to reach each process (or sum them up).
+
+# seconds. the prometheus client's default buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1,
+                   0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(
+                label_values, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            yield f'{self.name}{format_labels(self.labels, label_values)} {format_value(value)}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (+Inf last), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # counts are kept per bucket and only made cumulative when rendering, so an observation is one increment.
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self.lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self.values.items())
+        labels = self.labels + ('le',)
+        for label_values, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(labels, label_values + (bound,))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, label_values)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labels, label_values)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, extra=()):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        lines.extend(extra)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+request_duration = REGISTRY.register(Histogram(
+    'django_bank_request_duration_seconds', 'Time spent in the view and middleware, by URL name.',
+    labels=('view', 'method')))
+responses = REGISTRY.register(Counter(
+    'django_bank_responses_total', 'Responses by URL name and status code.',
+    labels=('view', 'status')))
+request_queries = REGISTRY.register(Histogram(
+    'django_bank_request_db_queries', 'SQL queries per request, by URL name.',
+    labels=('view',), buckets=QUERY_COUNT_BUCKETS))
+request_query_seconds = REGISTRY.register(Counter(
+    'django_bank_request_db_seconds_total', 'Time spent in SQL queries, by URL name.',
+    labels=('view',)))
+email_queue_duration = REGISTRY.register(Histogram(
+    'django_bank_email_queue_seconds', 'Time a request spends rendering and queueing a notification email.'))
+email_send_duration = REGISTRY.register(Histogram(
+    'django_bank_email_send_seconds', 'Time the outbox spends handing one email to the mail server.',
+    labels=('result',)))
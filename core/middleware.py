@@ -0,0 +1,257 @@
+import collections
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+from django_bank import routers
+from . import metrics
+
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class QueryStats:
+    # a database execute_wrapper that counts the queries of one request and adds up their time.
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Record latency, status, query count and query time per URL name for the
+    /metrics endpoint. Put it first in MIDDLEWARE so the session and user
+    lookups are counted too. The body of a streaming response is produced
+    after this returns, so its rows aren't included.
+    """
+
+    # sync and async: under ASGI the async views (ASYNC_VIEWS) don't get pushed back into a thread by this middleware.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        self.record(request, response, queries, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        queries = QueryStats()
+        started = time.perf_counter()
+        # the async ORM runs the queries in a thread, but with the same (context local) connections, so the wrapper sees them.
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = await self.get_response(request)
+        self.record(request, response, queries, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, queries, elapsed):
+        # the URL name (not the path) keeps the number of label values small: /loan-repayment/<id>/ is one series.
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        method = request.method if request.method in KNOWN_METHODS else 'other'
+        metrics.request_duration.observe(elapsed, view, method)
+        metrics.responses.inc(view, response.status_code)
+        metrics.request_queries.observe(queries.count, view)
+        metrics.request_query_seconds.inc(view, amount=queries.seconds)
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Read-your-writes for the replica: a request that wrote anything sets a
+    short lived cookie, and while it's there the user's requests read from the
+    primary, so they don't see a replica that hasn't caught up with their own
+    posting yet. Put it before SessionMiddleware so a login (a session write)
+    counts too. Without a replica django drops it from the chain.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if routers.REPLICA not in settings.DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with ExitStack() as stack:
+            written = self.enter(stack, request)
+            response = self.get_response(request)
+        return self.pin(response, written)
+
+    async def __acall__(self, request):
+        with ExitStack() as stack:
+            written = self.enter(stack, request)
+            response = await self.get_response(request)
+        return self.pin(response, written)
+
+    def enter(self, stack, request):
+        written = stack.enter_context(routers.track_writes())
+        if request.COOKIES.get(settings.REPLICA_STICKY_COOKIE):
+            stack.enter_context(routers.primary_reads())
+        return written
+
+    def pin(self, response, written):
+        if written:
+            response.set_cookie(settings.REPLICA_STICKY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample the call stack of one thread every ``interval`` seconds and count
+    the collapsed stacks (``outer;inner;leaf``), the input format of
+    flamegraph.pl and speedscope. ``root`` is the frame to stop at, so the
+    server frames above the middleware aren't repeated in every sample.
+    """
+
+    def __init__(self, thread_id, root, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None and frame is not self.root:
+                code = frame.f_code
+                names.append(
+                    f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class SQLRecorder:
+    # a database execute_wrapper that keeps every statement of the request with its duration.
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (time.perf_counter() - started, sql, params, many))
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests on demand. A staff user adds ``?profile=1`` or an
+    ``X-Profile: 1`` header and, if the request is sampled
+    (PROFILING_SAMPLE_RATE), the view runs under cProfile and a stack sampler.
+    A cProfile dump, collapsed stacks and the executed SQL are written to
+    PROFILING_DIR, which keeps the newest PROFILING_MAX_PROFILES requests.
+
+    Put it after AuthenticationMiddleware. With PROFILING_ENABLED off django
+    drops it from the chain at startup, so it costs nothing.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        sql = SQLRecorder()
+        sampler = StackSampler(threading.get_ident(), sys._getframe(),
+                               settings.PROFILING_INTERVAL)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sql))
+            sampler.start()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+                sampler.stop()
+        elapsed = time.perf_counter() - started
+
+        self.write_profile(request, profiler, sampler, sql, elapsed)
+        return response
+
+    def should_profile(self, request):
+        flagged = request.GET.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+        return (flagged and request.user.is_staff
+                and random.random() < settings.PROFILING_SAMPLE_RATE)
+
+    def write_profile(self, request, profiler, sampler, sql, elapsed):
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        # the timestamp first, so the names sort oldest first for the rotation.
+        stem = '{}-{}-{}'.format(
+            timezone.now().strftime('%Y%m%dT%H%M%S.%f'),
+            re.sub(r'[^\w.-]', '_', view),
+            re.sub(r'[^\w.-]', '_', request.user.get_username()),
+        )
+
+        profiler.dump_stats(directory / f'{stem}.prof')
+        (directory / f'{stem}.collapsed').write_text(''.join(
+            f'{stack} {count}\n' for stack, count in sampler.stacks.most_common()))
+        lines = [f'-- {request.method} {request.get_full_path()} ({view}) by {request.user.get_username()}: '
+                 f'{elapsed * 1000:.1f} ms, {len(sql.queries)} queries, '
+                 f'{sum(q[0] for q in sql.queries) * 1000:.1f} ms in SQL']
+        for seconds, statement, params, many in sql.queries:
+            lines.append(f'\n-- {seconds * 1000:.2f} ms{" (executemany)" if many else ""}, params: {params!r}\n{statement};')
+        (directory / f'{stem}.sql').write_text('\n'.join(lines) + '\n')
+
+        self.rotate(directory)
+
+    def rotate(self, directory):
+        stems = sorted({path.stem for path in directory.glob('*.prof')})
+        for stem in stems[:-settings.PROFILING_MAX_PROFILES]:
+            for suffix in ('.prof', '.collapsed', '.sql'):
+                (directory / f'{stem}{suffix}').unlink(missing_ok=True)
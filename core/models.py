@@ -1,3 +1,39 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
+
+
+class OutboxEmail(models.Model):
+    # emails are not sent inside the request anymore. views write a row here (inside the same db transaction as the money movement) and the send_outbox management command delivers them in batches.
+    PENDING = 'Pending'
+    SENT = 'Sent'
+    FAILED = 'Failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    to = models.EmailField(max_length=254)
+    body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.to} - {self.subject} - {self.status}"
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            # the worker only ever asks for "pending and due", so this index covers its query.
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='outbox_status_due_idx'),
+        ]
@@ -0,0 +1,151 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+
+def get_batch_size():
+    return getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+
+
+def get_max_attempts():
+    return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def get_retry_backoff():
+    return getattr(settings, 'OUTBOX_RETRY_BACKOFF', 30)
+
+
+# the share of OUTBOX_LEASE a worker spends sending before it hands the rest of its batch back.
+LEASE_SHARE = 0.8
+
+
+def get_lease():
+    return getattr(settings, 'OUTBOX_LEASE', 300)
+
+
+def queue_email(subject, to, html_body='', body=''):
+    # only writes a row. if the caller is inside transaction.atomic() the email is committed (or rolled back) together with the caller's data.
+    return OutboxEmail.objects.create(
+        subject=subject, to=to, body=body, html_body=html_body)
+
+
+def queue_emails(emails):
+    # queue_email for a batch of unsaved OutboxEmail rows, written with one INSERT per batch.
+    return OutboxEmail.objects.bulk_create(emails, batch_size=get_batch_size())
+
+
+def queue_depth():
+    return OutboxEmail.objects.filter(status=OutboxEmail.PENDING).count()
+
+
+def retry_delay(attempts):
+    # exponential backoff: 30s, 60s, 120s, ... for the default settings.
+    return timedelta(seconds=get_retry_backoff() * 2 ** max(attempts - 1, 0))
+
+
+def build_message(email, mail_connection=None):
+    message = EmailMultiAlternatives(
+        email.subject, email.body, to=[email.to], connection=mail_connection)
+    if email.html_body:
+        message.attach_alternative(email.html_body, "text/html")
+    return message
+
+
+def mark_failed_attempt(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= get_max_attempts():
+        email.status = OutboxEmail.FAILED
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+
+
+def claim_batch(batch_size, now):
+    # a short transaction that leases the due rows: their next_attempt_at moves past the lease, so other workers skip them. if this worker dies mid-batch they come due again when the lease runs out.
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(
+            status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+        # skip_locked lets several workers claim from the same table without waiting for each other.
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        batch = list(due[:batch_size])
+        if batch:
+            lease_until = now + timedelta(seconds=get_lease())
+            OutboxEmail.objects.filter(
+                pk__in=[email.pk for email in batch]).update(next_attempt_at=lease_until)
+            for email in batch:
+                email.next_attempt_at = lease_until
+    return batch
+
+
+def deliver_pending(batch_size=None):
+    """
+    Send one batch of due emails over a single mail connection.
+
+    The batch is claimed in one short transaction and every email is marked
+    right after its own send. Nothing is locked while the mail server is
+    talked to. Delivery is at least once, see OUTBOX_LEASE in settings.py.
+    Returns a ``(sent, failed)`` tuple for the batch.
+    """
+    batch_size = batch_size or get_batch_size()
+    now = timezone.now()
+    sent = failed = 0
+
+    batch = claim_batch(batch_size, now)
+    if not batch:
+        return sent, failed
+
+    mail_connection = get_connection()
+    try:
+        mail_connection.open()
+    except Exception as error:
+        logger.warning('Could not open mail connection: %s', error)
+        for email in batch:
+            mark_failed_attempt(email, error, now)
+        OutboxEmail.objects.bulk_update(
+            batch, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+        return sent, len(batch)
+
+    # past this point another worker could claim the rest of the batch, so it is handed back instead of sent.
+    deadline = time.monotonic() + get_lease() * LEASE_SHARE
+    try:
+        for index, email in enumerate(batch):
+            if time.monotonic() >= deadline:
+                logger.warning('Outbox lease running out, %s email(s) handed back', len(batch) - index)
+                OutboxEmail.objects.filter(
+                    pk__in=[rest.pk for rest in batch[index:]]).update(next_attempt_at=timezone.now())
+                break
+            started = time.perf_counter()
+            try:
+                build_message(email, mail_connection).send()
+            except Exception as error:
+                metrics.email_send_duration.observe(
+                    time.perf_counter() - started, 'failed')
+                logger.warning('Could not send outbox email %s: %s',
+                               email.pk, error)
+                mark_failed_attempt(email, error, now)
+                failed += 1
+            else:
+                metrics.email_send_duration.observe(
+                    time.perf_counter() - started, 'sent')
+                email.attempts += 1
+                email.status = OutboxEmail.SENT
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                sent += 1
+            # saved at once, so a worker dying later in the batch only repeats the email it was sending.
+            email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at', 'sent_at'])
+    finally:
+        mail_connection.close()
+
+    return sent, failed
@@ -0,0 +1,36 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class CappedCountPaginator(Paginator):
+    """
+    Paginator for the admin changelists of big tables: the count stops at
+    ``max_count`` instead of scanning the whole table.
+
+    On postgres an unfiltered count uses the planner's row estimate. Past the
+    cap the exact number doesn't matter, it only decides how many page links
+    are shown.
+    """
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate_rows(queryset)
+            if estimate is not None and estimate > self.max_count:
+                return estimate
+        # SELECT COUNT(*) FROM (SELECT ... LIMIT max_count + 1), so at most that many index entries are read.
+        return queryset[:self.max_count + 1].count()
+
+    def estimate_rows(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 (never analyzed) or no row at all means there is no estimate yet.
+        return row[0] if row and row[0] >= 0 else None
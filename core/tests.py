@@ -1,3 +1,277 @@
-from django.test import TestCase
+import tempfile
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.conf import settings
+from django.db import connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from django_bank import routers
+from . import metrics
+from .middleware import ProfilingMiddleware
+from .models import OutboxEmail
+from .outbox import deliver_pending, queue_depth, queue_email
 
 # Create your tests here.
+
+
+class OutboxTests(TestCase):
+    def test_queue_email_does_not_send(self):
+        queue_email('Deposit Confirmation', 'user@example.com', html_body='<p>hi</p>')
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(queue_depth(), 1)
+
+    def test_deliver_pending_sends_batch(self):
+        for i in range(3):
+            queue_email(f'Subject {i}', f'user{i}@example.com', html_body='<p>hi</p>')
+
+        sent, failed = deliver_pending(batch_size=2)
+
+        self.assertEqual((sent, failed), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertEqual(queue_depth(), 1)
+
+    def test_batch_is_sent_outside_a_transaction(self):
+        email = queue_email('Leased', 'user@example.com')
+        # TestCase already wraps the test in atomic blocks. deliver_pending mustn't add one while it sends.
+        outside = len(connections['default'].atomic_blocks)
+        seen = []
+
+        def send(message):
+            seen.append(len(connections['default'].atomic_blocks))
+            # another worker polling meanwhile finds the leased row not due.
+            seen.append(deliver_pending())
+            return 1
+
+        with mock.patch('django.core.mail.EmailMessage.send', autospec=True, side_effect=send):
+            self.assertEqual(deliver_pending(), (1, 0))
+
+        self.assertEqual(seen, [outside, (0, 0)])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.SENT)
+
+    def test_each_email_is_marked_after_its_send(self):
+        first = queue_email('First', 'one@example.com')
+        queue_email('Second', 'two@example.com')
+        statuses = []
+
+        def send(message):
+            first.refresh_from_db()
+            statuses.append(first.status)
+            return 1
+
+        with mock.patch('django.core.mail.EmailMessage.send', autospec=True, side_effect=send):
+            deliver_pending()
+
+        # the second send already finds the first one marked, a crash there wouldn't send it again.
+        self.assertEqual(statuses, [OutboxEmail.PENDING, OutboxEmail.SENT])
+
+    @override_settings(OUTBOX_LEASE=0)
+    def test_batch_is_handed_back_before_the_lease_runs_out(self):
+        email = queue_email('Later', 'user@example.com')
+
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        self.assertEqual(len(mail.outbox), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.PENDING, 0))
+        self.assertLessEqual(email.next_attempt_at, timezone.now())
+
+    def test_emails_not_due_are_skipped(self):
+        email = queue_email('Later', 'user@example.com')
+        email.next_attempt_at = timezone.now() + timedelta(minutes=5)
+        email.save()
+
+        self.assertEqual(deliver_pending(), (0, 0))
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_BACKOFF=10)
+    def test_failed_send_is_retried_with_backoff(self):
+        email = queue_email('Retry', 'user@example.com')
+
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('smtp down')):
+            self.assertEqual(deliver_pending(), (0, 1))
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, 'smtp down')
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        email.next_attempt_at = timezone.now()
+        email.save()
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=OSError('smtp down')):
+            deliver_pending()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.FAILED)
+        self.assertEqual(queue_depth(), 0)
+
+    def test_send_outbox_command_drains_queue(self):
+        for i in range(5):
+            queue_email(f'Subject {i}', f'user{i}@example.com')
+
+        call_command('send_outbox', batch_size=2, stdout=mock.MagicMock())
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(OutboxEmail.objects.filter(
+            status=OutboxEmail.SENT).count(), 5)
+
+
+class MetricsTests(TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', labels=('view',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'home')
+        histogram.observe(0.5, 'home')
+        histogram.observe(5, 'home')
+
+        self.assertEqual(list(histogram.collect())[2:], [
+            'test_seconds_bucket{view="home",le="0.1"} 1',
+            'test_seconds_bucket{view="home",le="1"} 2',
+            'test_seconds_bucket{view="home",le="+Inf"} 3',
+            'test_seconds_sum{view="home"} 5.55',
+            'test_seconds_count{view="home"} 3',
+        ])
+
+    def test_middleware_records_view_and_queries(self):
+        before = metrics.request_queries.values.get(('home',), [[], 0])[1]
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+
+        self.client.get(reverse('home'))
+
+        # the session and the user.
+        self.assertEqual(metrics.request_queries.values[('home',)][1] - before, 2)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('django_bank_request_duration_seconds_count{view="home",method="GET"}', body)
+        self.assertIn('django_bank_responses_total{view="home",status="200"}', body)
+        self.assertIn('django_bank_outbox_pending 0', body)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_metrics_needs_the_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(
+            reverse('metrics'), headers={'authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.enabled = override_settings(
+            PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_DIR=self.directory.name)
+        self.enabled.enable()
+        self.addCleanup(self.enabled.disable)
+
+    def files(self):
+        return sorted(path.suffix for path in Path(self.directory.name).iterdir())
+
+    def test_staff_request_with_flag_is_profiled(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+        self.client.get(reverse('home'))
+        self.assertEqual(self.files(), [])
+        self.client.get(reverse('home'), {'profile': '1'})
+
+        self.assertEqual(self.files(), ['.collapsed', '.prof', '.sql'])
+        sql = next(Path(self.directory.name).glob('*-home-staff.sql')).read_text()
+        self.assertIn('GET /?profile=1 (home) by staff', sql)
+
+    def test_customers_and_unsampled_requests_are_not_profiled(self):
+        self.client.force_login(User.objects.create_user('alice'))
+        self.client.get(reverse('home'), headers={'x-profile': '1'})
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        with override_settings(PROFILING_SAMPLE_RATE=0):
+            self.client.get(reverse('home'), headers={'x-profile': '1'})
+
+        self.assertEqual(self.files(), [])
+
+    @override_settings(PROFILING_MAX_PROFILES=2)
+    def test_old_profiles_are_rotated(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        for _ in range(3):
+            self.client.get(reverse('home'), {'profile': '1'})
+
+        self.assertEqual(len(self.files()), 6)
+
+    def test_disabled_middleware_is_not_used(self):
+        with override_settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: None)
+
+
+REPLICA_SETTINGS = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.sqlite3'}
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    router = routers.ReplicaRouter()
+
+    def test_reads_use_the_replica_only_when_asked(self):
+        with mock.patch.dict(settings.DATABASES, {'replica': REPLICA_SETTINGS}):
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            with routers.replica_reads():
+                self.assertEqual(self.router.db_for_read(User), 'replica')
+                # pinned after a write.
+                with routers.primary_reads():
+                    self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+        with mock.patch.dict(settings.DATABASES), routers.replica_reads():
+            settings.DATABASES.pop('replica', None)
+            self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_decorator_only_moves_safe_requests(self):
+        seen = []
+
+        @routers.read_from_replica
+        def view(request):
+            seen.append(routers.use_replica.get())
+
+        view(RequestFactory().get('/'))
+        view(RequestFactory().post('/'))
+        self.assertEqual(seen, [True, False])
+
+
+class ReplicaTransactionTests(TestCase):
+    def test_transactions_stay_on_the_primary(self):
+        # every TestCase runs in a transaction on the primary.
+        with mock.patch.dict(settings.DATABASES, {'replica': REPLICA_SETTINGS}), routers.replica_reads():
+            self.assertEqual(routers.ReplicaRouter().db_for_read(User), 'default')
+
+    def test_writes_are_tracked(self):
+        with routers.track_writes() as written:
+            User.objects.create_user('alice')
+        self.assertIn('auth.User', written)
+
+
+# run with REPLICA_DATABASE_URL=sqlite:///replica.sqlite3 (any value works, the test database mirrors default).
+@unittest.skipUnless('replica' in settings.DATABASES, 'no replica configured')
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = '__all__'
+
+    def test_reports_read_the_replica_until_the_user_posts(self):
+        user = User.objects.create_user('alice')
+        UserBankAccount.objects.create(user=user, account_no=2024000 + user.pk, account_type='Saving', gender='Female')
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get(reverse('transaction-report')).status_code, 200)
+        self.assertTrue(replica.captured_queries)
+
+        response = self.client.post(reverse('deposit'), {'amount': 500, 'transaction_type': 'Deposit'})
+        self.assertEqual(response.cookies[settings.REPLICA_STICKY_COOKIE]['max-age'], settings.REPLICA_STICKY_SECONDS)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.assertContains(self.client.get(reverse('transaction-report')), '500')
+        self.assertEqual(replica.captured_queries, [])
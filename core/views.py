@@ -1,6 +1,57 @@
+import hmac
+from inspect import isawaitable
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.views import View
 from django.views.generic import TemplateView
 
+from .metrics import REGISTRY
+from .outbox import queue_depth
+
 # Create your views here.
+
+
+class AsyncUserMixin:
+    """
+    For async views (ASYNC_VIEWS): load ``request.user``, with the account, with
+    the async ORM before dispatching. The mixins after it (LoginRequiredMixin)
+    and the navbar then read it without a query from the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        response = super().dispatch(request, *args, **kwargs)
+        # LoginRequiredMixin answers with a redirect itself, the handler is a coroutine.
+        if isawaitable(response):
+            response = await response
+        return response
+
+
 class HomePageView(TemplateView):
     template_name = 'home.html'
+
+
+class AsyncHomePageView(AsyncUserMixin, HomePageView):
+    async def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class MetricsView(View):
+    # prometheus scrape endpoint. with METRICS_TOKEN set the scraper sends it as a bearer token, otherwise only staff can look.
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        if token:
+            authorization = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(authorization, f'Bearer {token}'):
+                return HttpResponseForbidden()
+        elif not request.user.is_staff:
+            return HttpResponseForbidden()
+
+        extra = [
+            '# HELP django_bank_outbox_pending Emails waiting in the outbox.',
+            '# TYPE django_bank_outbox_pending gauge',
+            f'django_bank_outbox_pending {queue_depth()}',
+        ]
+        return HttpResponse(REGISTRY.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
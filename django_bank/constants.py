@@ -5,6 +5,9 @@ ACCOUNT_TYPE = (
     ('Fixed', 'Fixed'),
 )
 
+# account numbers are ACCOUNT_NO_START + the user's id, so they never collide and need no extra lookup.
+ACCOUNT_NO_START = 2024000
+
 GENDER_TYPE = (
     ('Male', 'Male'),
     ('Female', 'Female'),
@@ -18,3 +21,10 @@ TRANSACTION_TYPE = (
     ('Loan', 'Loan'),
     ('Repayment', 'Repayment'),
 )
+
+# transaction types that add money to an account. the rest of TRANSACTION_TYPE takes money out.
+CREDIT_TRANSACTION_TYPES = ('Deposit', 'Receive', 'Loan')
+DEBIT_TRANSACTION_TYPES = ('Withdraw', 'Transfer', 'Repayment')
+
+# a customer can't request another loan while this many are not repaid yet (pending ones included).
+MAX_OPEN_LOANS = 3
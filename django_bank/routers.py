@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# the replica alias is only in DATABASES when REPLICA_DATABASE_URL is set. without it every query goes to the primary (default).
+REPLICA = 'replica'
+
+# reads go to the primary unless a view opted in with replica_reads(). pinned wins over both: set for a few seconds after the user wrote something, so they see their own postings.
+use_replica = ContextVar('use_replica', default=False)
+pinned = ContextVar('pinned', default=False)
+# per request: whether anything was written, so the next requests can be pinned (see core.middleware.ReplicaStickinessMiddleware).
+writes = ContextVar('writes', default=None)
+
+
+@contextmanager
+def replica_reads():
+    token = use_replica.set(True)
+    try:
+        yield
+    finally:
+        use_replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = pinned.set(True)
+    try:
+        yield
+    finally:
+        pinned.reset(token)
+
+
+@contextmanager
+def track_writes():
+    # yields a set that collects the models written to while the block runs.
+    written = set()
+    token = writes.set(written)
+    try:
+        yield written
+    finally:
+        writes.reset(token)
+
+
+def read_from_replica(view):
+    """
+    View decorator: GET and HEAD requests read from the replica. Anything
+    else, and anything inside a transaction, stays on the primary.
+    """
+    if iscoroutinefunction(view):
+        # the context var has to stay set while the view is awaited, not only while the coroutine is created.
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await view(request, *args, **kwargs)
+            with replica_reads():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # a transaction on the primary (a posting, or a TestCase) must read what it's about to write.
+        if (use_replica.get() and not pinned.get() and REPLICA in settings.DATABASES
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        written = writes.get()
+        if written is not None:
+            written.add(model._meta.label)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica has the same rows, so objects from both databases can point at each other.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica gets its schema through replication.
+        return db != REPLICA
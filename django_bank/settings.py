@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import django
 import environ
 import dj_database_url
 
@@ -52,7 +53,17 @@ INSTALLED_APPS = [
 # LOGIN_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
 
+# AccountBackend is tried first, so new logins use it. ModelBackend stays to keep sessions from before the switch valid.
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.AccountBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 MIDDLEWARE = [
+    # first, so the time and queries of every other middleware are counted too.
+    'core.middleware.MetricsMiddleware',
+    # before the session middleware, so a login pins the user to the primary too. removed from the chain without a replica.
+    'core.middleware.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +71,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # last, so only the view is profiled. removed from the chain when PROFILING_ENABLED is off.
+    'core.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'django_bank.urls'
@@ -91,8 +104,26 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # concurrent postings wait for the write lock instead of failing straight away.
+        'OPTIONS': {'timeout': 20},
+        # the concurrency tests post from several threads. sqlite's shared in-memory test database only has table locks, so the tests use a file.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
+# the postings read before they write (the session, the loan being repaid, ...). in sqlite's default deferred mode such a transaction can't wait for the write lock when another writer holds it and fails straight away with "database is locked". BEGIN IMMEDIATE takes the write lock when the transaction starts, so writers queue up on the timeout instead. the price: every atomic block holds the lock for its whole length, even the parts that only read, so nothing slow (emails, http calls) may run inside one; the outbox sends outside of transactions for that reason. the option exists since django 5.1, set SQLITE_TRANSACTION_MODE=DEFERRED to go back to sqlite's default.
+if django.VERSION >= (5, 1):
+    DATABASES['default']['OPTIONS']['transaction_mode'] = env('SQLITE_TRANSACTION_MODE', default='IMMEDIATE')
+
+# read replica for the report, list and export views and the admin changelists, e.g. REPLICA_DATABASE_URL=sqlite:///replica.sqlite3 (a copy of db.sqlite3) to try it locally. see django_bank/routers.py.
+REPLICA_DATABASE_URL = env('REPLICA_DATABASE_URL', default='')
+if REPLICA_DATABASE_URL:
+    DATABASES['replica'] = dj_database_url.parse(REPLICA_DATABASE_URL)
+    # the tests read the replica through the primary's test database.
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['django_bank.routers.ReplicaRouter']
+# after a write the user reads from the primary for this long, so they see their own postings.
+REPLICA_STICKY_SECONDS = 5
+REPLICA_STICKY_COOKIE = 'use_primary'
 
 # PostgreSQL
 # local
@@ -114,6 +145,17 @@ DATABASES = {
 #     )
 # }
 
+# Cache
+# one LocMemCache per process (least recently used entries are dropped past MAX_ENTRIES). point it at redis or memcached to share it between processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+# seconds a receiver stays in the account directory (accounts/directory.py)
+ACCOUNT_DIRECTORY_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -162,3 +204,33 @@ EMAIL_USE_TLS = True
 EMAIL_PORT = env('EMAIL_PORT')
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASS')
+
+# Outbox settings (emails are queued by the views and delivered by `python manage.py send_outbox`)
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BACKOFF = 30  # seconds, doubled after every failed attempt
+# seconds a worker has to send its batch before another worker may pick it up. delivery is at least once: an email is marked sent right after the mail server accepted it, so a worker that dies in between (or an smtp call that hangs past the lease) means the email is sent again. workers hand back what they haven't sent after 80% of the lease.
+OUTBOX_LEASE = 300
+
+# Transaction report pagination
+TRANSACTION_REPORT_PAGE_SIZE = 25
+TRANSACTION_REPORT_MAX_PAGE_SIZE = 100
+TRANSACTION_REPORT_CACHE_TIMEOUT = 3600  # seconds a rendered page of rows is kept in the cache
+
+# Rows fetched per round trip when streaming a statement export
+STATEMENT_EXPORT_CHUNK_SIZE = 2000
+
+# Bearer token the Prometheus scraper sends to /metrics. Without one only staff users can read it.
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Serve the transaction report, the loan list and the home page with async views and the async ORM. Only
+# worth it under an ASGI server (django_bank/asgi.py, e.g. uvicorn django_bank.asgi:application): under WSGI
+# every async view gets an event loop of its own. Needs django 5.0+ (request.auser()).
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
+# On-demand profiling (staff add ?profile=1 or an X-Profile: 1 header)
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+PROFILING_SAMPLE_RATE = 1.0  # share of the flagged requests that are profiled
+PROFILING_INTERVAL = 0.001  # seconds between stack samples
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_PROFILES = 50
@@ -15,12 +15,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.conf import settings
 from django.urls import path, include
-from core.views import HomePageView
+from core.views import AsyncHomePageView, HomePageView, MetricsView
+
+HomeView = AsyncHomePageView if settings.ASYNC_VIEWS else HomePageView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', HomePageView.as_view(), name='home'),
+    path('', HomeView.as_view(), name='home'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     # path('accounts/', include(('accounts.urls', 'accounts'), namespace='accounts')),
     path('accounts/', include('accounts.urls')),
     path('transactions/', include('transactions.urls')),
@@ -1,39 +1,154 @@
-from django.contrib import admin
-from transactions.views import send_transaction_email
+from django import forms
+from django.contrib import admin, messages
+from django.db import transaction
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from accounts.admin import account_search
+from accounts.models import UserBankAccount
+from core.models import OutboxEmail
+from core.outbox import queue_emails
+from core.pagination import CappedCountPaginator
+from django_bank.constants import DEBIT_TRANSACTION_TYPES
+from django_bank.routers import read_from_replica
+from transactions.views import render_transaction_email, send_transaction_email
 from .models import Transaction
+from .services import AccountNotFound, InsufficientBalance, adjust_loan_counters, approve_loan, approve_loans, post_transaction
 
 # Register your models here.
 # admin.site.register(Transaction)
 
 
+class RejectedChange(ValueError):
+    pass
+
+
+class TransactionAdminForm(forms.ModelForm):
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.instance.pk is not None:
+            return cleaned_data
+        # the checks post_transaction makes again when the row is saved, as form errors instead of a server error.
+        account = cleaned_data.get('account')
+        amount = cleaned_data.get('amount')
+        transaction_type = cleaned_data.get('transaction_type')
+        if transaction_type == 'Loan' and not cleaned_data.get('loan_approved'):
+            raise forms.ValidationError('Loan transaction is not approved.')
+        if account is not None and amount is not None and transaction_type in DEBIT_TRANSACTION_TYPES \
+                and account.balance < amount:
+            raise forms.ValidationError(
+                f'Insufficient account balance. The balance is ${account.balance:,.2f}')
+        return cleaned_data
+
+
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ['account', 'amount', 'transaction_type',
                     'balance_after_transaction', 'timestamp', 'loan_approved']
+    # account's __str__ shows the username, so both are joined into the page query instead of two queries per row.
+    list_select_related = ['account__user']
+    # the date filters are half-open timestamp ranges (txn_timestamp_idx), the other two come from choices and need no query.
+    list_filter = ['timestamp', 'transaction_type', 'loan_approved']
+    search_fields = ['account__user__username']
+    search_help_text = 'Account number or the start of a username.'
+    paginator = CappedCountPaginator
+    # skip the second COUNT(*) over the whole table that the changelist runs when a filter is active.
+    show_full_result_count = False
+    # a search box (UserBankAccountAdmin's search) instead of a <select> with every account in it.
+    autocomplete_fields = ['account']
+    actions = ['approve_selected_loans']
+    form = TransactionAdminForm
+
+    @method_decorator(read_from_replica)
+    def changelist_view(self, request, extra_context=None):
+        # browsing the ledger reads from the replica. the actions are POSTs and stay on the primary.
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(account_search(term, prefix='account__')), False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'account':
+            # the widget only loads the selected account, and shows it with the username.
+            kwargs['queryset'] = UserBankAccount.objects.select_related('user')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_readonly_fields(self, request, obj=None):
+        # filled in by the posting services. loan_repayment is only set by repay_loan, which posts the Repayment and updates the loan counters.
+        readonly = [*super().get_readonly_fields(request, obj), 'balance_after_transaction', 'approved_at', 'loan_repayment']
+        if obj is not None:
+            # a posted transaction already moved money, the balances, rollups and loan counters follow from these. editing them would only change the row.
+            readonly += ['account', 'amount', 'transaction_type']
+            # an approved loan was credited. unticking it wouldn't take the money back.
+            if obj.transaction_type == 'Loan' and obj.loan_approved:
+                readonly.append('loan_approved')
+        return readonly
 
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except (InsufficientBalance, AccountNotFound, RejectedChange) as error:
+            # the form checked the balance, but another posting can get in before the save. the admin's transaction was rolled back.
+            self.message_user(request, str(error), messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+    @transaction.atomic
     def save_model(self, request, obj, form, change):
-        if obj.transaction_type == 'Deposit':
-            obj.account.balance += obj.amount
-        elif obj.transaction_type == 'Withdraw':
-            if obj.account.balance >= obj.amount:
-                obj.account.balance -= obj.amount
+        if change:
+            if obj.transaction_type == 'Loan' and not obj.loan_approved and 'loan_approved' in form.changed_data:
+                raise RejectedChange("An approved loan can't be unapproved.")
+            # a posted transaction already moved money. the only change that moves money again is approving a pending loan.
+            if obj.transaction_type == 'Loan' and obj.loan_approved and 'loan_approved' in form.changed_data:
+                # loan_approved is flipped by approve_loan itself with a conditional update, so it isn't saved here.
+                other_fields = [
+                    name for name in form.changed_data if name != 'loan_approved']
+                if other_fields:
+                    obj.save(update_fields=other_fields)
+                if approve_loan(obj):
+                    self.send_loan_approved_email(obj)
             else:
-                raise ValueError('Insufficient account balance.')
-        elif obj.transaction_type == 'Loan':
-            if obj.loan_approved:
-                obj.account.balance += obj.amount
-                obj.balance_after_transaction += obj.amount
-                send_transaction_email(
-                    obj.account.user, obj.account.user.email, obj.amount, 'Loan Approval', 'email/loan_approved_email.html'
+                super().save_model(request, obj, form, change)
+            return
+
+        if obj.transaction_type == 'Loan' and not obj.loan_approved:
+            raise RejectedChange('Loan transaction is not approved.')
+
+        if obj.transaction_type == 'Loan':
+            obj.approved_at = timezone.now()
+        # deposits, loans and receives are credited, everything else is debited. InsufficientBalance is a ValueError like before.
+        post_transaction(obj)
+        if obj.transaction_type == 'Loan':
+            adjust_loan_counters(
+                obj.account_id, open_loans=1, outstanding=obj.amount)
+            self.send_loan_approved_email(obj)
+
+    def send_loan_approved_email(self, obj):
+        user = obj.account.user
+        send_transaction_email(
+            user, None, user.email, obj.amount, 'Loan Approval', 'email/loan_approved_email.html'
+        )
+
+    @admin.action(description='Approve selected loans')
+    def approve_selected_loans(self, request, queryset):
+        # one transaction for the whole selection: the credits, rollups and approval emails are written in batches.
+        with transaction.atomic():
+            approved, failed = approve_loans(
+                queryset.values_list('pk', flat=True))
+            queue_emails([
+                OutboxEmail(
+                    subject='Loan Approval', to=loan.account.user.email,
+                    html_body=render_transaction_email(
+                        loan.account.user, None, loan.amount, 'email/loan_approved_email.html'),
                 )
-            else:
-                raise ValueError('Loan transaction is not approved.')
-        elif obj.transaction_type == 'Repayment':
-            if obj.account.balance >= obj.amount:
-                obj.account.balance -= obj.amount
-            else:
-                raise ValueError('Insufficient account balance for repayment.')
+                for loan in approved
+            ])
 
-        obj.balance_after_transaction = obj.account.balance
-        obj.account.save()
-        super().save_model(request, obj, form, change)
+        if approved:
+            self.message_user(
+                request, f'Approved {len(approved)} loan(s).', messages.SUCCESS)
+        for loan_id, reason in failed:
+            self.message_user(
+                request, f'Loan #{loan_id} was not approved: {reason}', messages.WARNING)
@@ -0,0 +1,148 @@
+import csv
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from accounts.models import UserBankAccount
+from .models import Transaction
+from .rollups import record_postings
+from .services import credit_accounts
+
+CreditLine = namedtuple('CreditLine', 'line_no account_no amount reference')
+RejectedLine = namedtuple('RejectedLine', 'line_no content reason')
+
+MAX_CREDIT = Decimal('9999999999.99')
+HEADER = ['account_no', 'amount', 'reference']
+
+
+def parse_line(line_no, row):
+    # returns a CreditLine, or a RejectedLine explaining what is wrong with the row.
+    if len(row) not in (2, 3):
+        return RejectedLine(line_no, ','.join(row), 'Expected account_no,amount[,reference]')
+    try:
+        account_no = int(row[0])
+    except ValueError:
+        return RejectedLine(line_no, ','.join(row), 'Invalid account number')
+    try:
+        amount = Decimal(row[1].strip())
+    except InvalidOperation:
+        return RejectedLine(line_no, ','.join(row), 'Invalid amount')
+    if not amount.is_finite() or amount <= 0 or amount > MAX_CREDIT or amount != amount.quantize(Decimal('0.01')):
+        return RejectedLine(line_no, ','.join(row), 'Amount must be positive with at most 2 decimal places')
+    reference = row[2].strip() if len(row) == 3 else ''
+    if len(reference) > 100:
+        return RejectedLine(line_no, ','.join(row), 'Reference is longer than 100 characters')
+    return CreditLine(line_no, account_no, amount, reference)
+
+
+class UnreadableFile(ValueError):
+    pass
+
+
+def check_file(text_lines):
+    """
+    Decode and split the whole stream without touching the database, so a
+    file that breaks half way is refused before any line of it is credited.
+    Raises ``UnreadableFile`` naming the line.
+    """
+    reader = csv.reader(text_lines)
+    try:
+        for _ in reader:
+            pass
+    except UnicodeDecodeError:
+        raise UnreadableFile(f'Line {reader.line_num + 1} is not UTF-8 encoded text.')
+    except csv.Error as error:
+        raise UnreadableFile(f'Line {reader.line_num} is not valid CSV: {error}.')
+
+
+def reject(line, reason):
+    return RejectedLine(line.line_no, f'{line.account_no},{line.amount},{line.reference}', reason)
+
+
+def apply_chunk(lines):
+    """
+    Credit one chunk of parsed lines. Account numbers are resolved with one
+    ``account_no__in`` query; balances change with one set-based UPDATE and the
+    Deposit rows go in with one bulk_create. Returns the rejected lines.
+    """
+    with transaction.atomic():
+        account_ids = dict(UserBankAccount.objects.filter(
+            account_no__in={line.account_no for line in lines}).values_list('account_no', 'pk'))
+
+        rejected = []
+        accepted = []
+        amounts = {}
+        for line in lines:
+            account_id = account_ids.get(line.account_no)
+            if account_id is None:
+                rejected.append(reject(line, "Account doesn't exist"))
+                continue
+            accepted.append((account_id, line))
+            amounts[account_id] = amounts.get(account_id, 0) + line.amount
+
+        if not accepted:
+            return rejected
+
+        balances = credit_accounts(amounts)
+        # an account deleted since the lookup wasn't credited, so its lines are rejected like unknown accounts.
+        rejected += [reject(line, "Account doesn't exist") for account_id, line in accepted if account_id not in balances]
+        accepted = [(account_id, line) for account_id, line in accepted if account_id in balances]
+
+        # walk each account's lines in file order to give every row its own balance_after_transaction.
+        running = {pk: balances[pk] - total for pk, total in amounts.items() if pk in balances}
+        rows = []
+        postings = []
+        for account_id, line in accepted:
+            running[account_id] += line.amount
+            rows.append(Transaction(account_id=account_id, amount=line.amount, balance_after_transaction=running[account_id],
+                                    transaction_type='Deposit', reference=line.reference))
+            postings.append(
+                (account_id, 'Deposit', line.amount, running[account_id]))
+        Transaction.objects.bulk_create(rows)
+        record_postings(postings)
+
+    return rejected
+
+
+def ingest_credits(text_lines, chunk_size=1000):
+    """
+    Credit accounts from CSV lines of ``account_no,amount[,reference]``.
+
+    The input is read as a stream and applied in chunks of ``chunk_size``
+    lines, each in its own transaction, so run ``check_file`` over it first.
+    Returns ``(credited, total, rejected)``
+    where rejected is a list of ``RejectedLine``.
+    """
+    credited = 0
+    total = Decimal(0)
+    rejected = []
+    chunk = []
+
+    def flush():
+        nonlocal credited, total
+        chunk_rejected = apply_chunk(chunk)
+        rejected.extend(chunk_rejected)
+        bad_lines = {line.line_no for line in chunk_rejected}
+        for line in chunk:
+            if line.line_no not in bad_lines:
+                credited += 1
+                total += line.amount
+        chunk.clear()
+
+    for line_no, row in enumerate(csv.reader(text_lines), start=1):
+        if not row or (line_no == 1 and [cell.strip().lower() for cell in row[:3]] == HEADER[:len(row)]):
+            continue
+        parsed = parse_line(line_no, row)
+        if isinstance(parsed, RejectedLine):
+            rejected.append(parsed)
+            continue
+        chunk.append(parsed)
+        if len(chunk) >= chunk_size:
+            flush()
+
+    if chunk:
+        flush()
+
+    rejected.sort(key=lambda line: line.line_no)
+    return credited, total, rejected
@@ -1,7 +1,7 @@
 from django import forms
 from .models import Transaction
 from decimal import Decimal
-from accounts.models import UserBankAccount
+from accounts import directory
 
 
 class TransactionForm(forms.ModelForm):
@@ -57,21 +57,23 @@ class TransferForm(TransactionForm):
         if receiver_account_no == self.account.account_no:
             raise forms.ValidationError(
                 "You can't transfer to your own account!")
-        try:
-            receiver_account = UserBankAccount.objects.get(
-                account_no=receiver_account_no)
-        except UserBankAccount.DoesNotExist:
+        # popular payees are looked up all the time, so the owner comes from the cached account directory. the returned account has its user attached but no balance.
+        entry = directory.lookup(receiver_account_no)
+        if entry is None:
             raise forms.ValidationError("Account doesn't Exist!")
-        return receiver_account
+        return directory.as_account(entry)
 
 
 class WithdrawForm(TransactionForm):
+    # the view passes this to the posting service as well, so it is a class attribute instead of a local variable.
+    required_balance = 500
+
     def clean_amount(self):
         account = self.account
         balance = account.balance
         min_withdraw = 100
         max_withdraw = 100000
-        required_balance = 500
+        required_balance = self.required_balance
         amount = self.cleaned_data.get('amount')
         if amount < min_withdraw:
             raise forms.ValidationError(
@@ -102,3 +104,8 @@ class LoanRequestForm(TransactionForm):
             raise forms.ValidationError(
                 f"You can take maximum ${max_loan:,.2f} loan")
         return amount
+
+
+class BulkCreditForm(forms.Form):
+    credit_file = forms.FileField(
+        help_text='CSV with one account_no,amount[,reference] line per credit.')
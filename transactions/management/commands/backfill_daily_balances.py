@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from transactions.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-account DailyBalance rollup from the transaction ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='Only rebuild this account id (can be repeated).')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # one transaction, so the report never sees a half rebuilt rollup.
+        with transaction.atomic():
+            written = rebuild(options['accounts'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} daily balance row(s).'))
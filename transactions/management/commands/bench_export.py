@@ -0,0 +1,75 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from accounts.models import UserBankAccount
+from transactions.models import Transaction
+from transactions.views import StatementExport
+
+BENCH_USERNAME = 'bench_export'
+
+
+class Command(BaseCommand):
+    help = 'Stream a statement export for one large account and report peak memory as the export progresses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='bulk_create batch size used to seed the account.')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the benchmark account afterwards.")
+
+    def handle(self, *args, **options):
+        account = self.seed(options['rows'], options['chunk_size'])
+        request = RequestFactory().get('/', {'format': options['format']})
+        request.user = account.user
+
+        response = StatementExport.as_view()(request)
+        checkpoints = {int(options['rows'] * share) for share in (0.01, 0.1, 0.5, 1)}
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        lines = size = 0
+        for chunk in response.streaming_content:
+            lines += 1
+            size += len(chunk)
+            # csv has a header line, ndjson doesn't.
+            if lines - (options['format'] == 'csv') in checkpoints:
+                current, peak = tracemalloc.get_traced_memory()
+                self.stdout.write(
+                    f'{lines:>10} lines  peak {peak / 1024 / 1024:7.2f} MiB  current {current / 1024 / 1024:7.2f} MiB')
+        elapsed = time.perf_counter() - started
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f'Streamed {lines} lines ({size / 1024 / 1024:.1f} MiB) in {elapsed:.1f}s, '
+            f'{lines / elapsed:.0f} lines/s (under tracemalloc)')
+
+        if not options['keep']:
+            account.user.delete()
+
+    def seed(self, rows, chunk_size):
+        User.objects.filter(username=BENCH_USERNAME).delete()
+        user = User.objects.create_user(username=BENCH_USERNAME)
+        account = UserBankAccount.objects.create(
+            user=user, account_no=910000000, account_type='Saving', gender='Male')
+
+        # a consistent ledger of small deposits. the export doesn't care what the rows are, only how many.
+        balance = Decimal(0)
+        created = 0
+        while created < rows:
+            batch = []
+            for _ in range(min(chunk_size, rows - created)):
+                balance += 10
+                batch.append(Transaction(account=account, amount=Decimal(10),
+                                         balance_after_transaction=balance, transaction_type='Deposit'))
+            Transaction.objects.bulk_create(batch)
+            created += len(batch)
+        UserBankAccount.objects.filter(pk=account.pk).update(balance=balance)
+        self.stdout.write(f'Seeded {created} transactions')
+        return account
@@ -0,0 +1,62 @@
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from accounts.models import UserBankAccount
+from transactions.models import LedgerRow, Transaction
+
+BENCH_USERNAME = 'bench_ledger_rows'
+
+
+class Command(BaseCommand):
+    help = ('Fetch one account\'s ledger as Transaction instances and as LedgerRow tuples '
+            '(what the report and the loan list use) and compare time and memory.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Fetches per mode, the fastest one is shown.')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the benchmark account afterwards.")
+
+    def handle(self, *args, **options):
+        account = self.seed(options['rows'])
+        queryset = Transaction.objects.filter(account=account).order_by('-timestamp', '-id')
+        modes = {
+            'instances': lambda: list(queryset.all()),
+            'ledger rows': lambda: [LedgerRow._make(row) for row in queryset.values_list(*LedgerRow._fields)],
+        }
+
+        for name, fetch in modes.items():
+            seconds = min(self.time(fetch) for _ in range(options['repeat']))
+            tracemalloc.start()
+            rows = fetch()
+            kept, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(
+                f'{name:<12} {len(rows)} rows  {seconds * 1000:7.1f} ms  {seconds / len(rows) * 1e6:5.1f} us/row  '
+                f'kept {kept / 1024 / 1024:6.2f} MiB  peak {peak / 1024 / 1024:6.2f} MiB')
+            del rows
+
+        if not options['keep']:
+            account.user.delete()
+
+    def time(self, fetch):
+        started = time.perf_counter()
+        fetch()
+        return time.perf_counter() - started
+
+    def seed(self, rows):
+        User.objects.filter(username=BENCH_USERNAME).delete()
+        user = User.objects.create_user(username=BENCH_USERNAME)
+        account = UserBankAccount.objects.create(
+            user=user, account_no=930000000, account_type='Saving', gender='Male')
+        Transaction.objects.bulk_create(
+            [Transaction(account=account, amount=Decimal(10), balance_after_transaction=Decimal(10 * (i + 1)),
+                         transaction_type='Deposit') for i in range(rows)],
+            batch_size=1000)
+        UserBankAccount.objects.filter(pk=account.pk).update(balance=Decimal(10 * rows))
+        return account
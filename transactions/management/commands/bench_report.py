@@ -0,0 +1,77 @@
+import random
+import re
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from django_bank.constants import TRANSACTION_TYPE
+from transactions.models import Transaction
+from transactions.views import report_rows_key
+
+
+class Command(BaseCommand):
+    help = ('Render the transaction report template for one large page of rows, once with an empty '
+            'fragment cache and then from the cache. Nothing is written to the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Cached renders to average.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        # unsaved objects with ids: the template only reads attributes, and the query isn't what's measured here.
+        rng = random.Random(options['seed'])
+        user = User(pk=0, username='bench_report', first_name='Bench')
+        account = UserBankAccount(pk=0, user=user, account_no=0, balance=Decimal(0))
+        user.account = account
+        types = [value for value, _ in TRANSACTION_TYPE]
+        now = timezone.now()
+        transactions = [
+            Transaction(pk=options['rows'] - i, account=account, transaction_type=rng.choice(types),
+                        amount=Decimal(rng.randrange(1, 10 ** 7)) / 100,
+                        balance_after_transaction=Decimal(rng.randrange(1, 10 ** 9)) / 100,
+                        timestamp=now - timedelta(minutes=i), loan_approved=rng.random() < 0.5)
+            for i in range(options['rows'])
+        ]
+        request = RequestFactory().get('/')
+        request.user = user
+
+        def render():
+            started = time.perf_counter()
+            context = {
+                'transactions': transactions, 'account': account,
+                'rows_key': report_rows_key(transactions),
+                'rows_timeout': settings.TRANSACTION_REPORT_CACHE_TIMEOUT,
+            }
+            html = render_to_string('transactions/transaction_report.html', context, request)
+            # the csrf token in the navbar is masked differently on every render.
+            return time.perf_counter() - started, re.sub(r'name="csrfmiddlewaretoken" value="\w+"', '', html)
+
+        key = make_template_fragment_key('transaction_report_rows', [account.pk, report_rows_key(transactions)])
+        cache.delete(key)
+        cold, expected = render()
+        warm = []
+        for _ in range(options['repeat']):
+            elapsed, html = render()
+            if html != expected:
+                self.stderr.write('The cached render differs from the first one, is the cache configured?')
+            warm.append(elapsed)
+        warm = sum(warm) / len(warm)
+        cache.delete(key)
+
+        rows = options['rows']
+        self.stdout.write(f'{rows} rows, {len(expected) / 1024:.0f} KiB of html')
+        self.stdout.write(f'  rendered   {cold * 1000:8.1f} ms  {cold / rows * 1e6:6.1f} us/row')
+        self.stdout.write(f'  cached     {warm * 1000:8.1f} ms  {warm / rows * 1e6:6.1f} us/row  '
+                          f'({cold / warm if warm else 0:.1f}x)')
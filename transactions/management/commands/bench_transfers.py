@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum
+
+from accounts.models import UserBankAccount
+from transactions.services import InsufficientBalance, transfer
+
+BENCH_PREFIX = 'bench_transfer_'
+
+
+class Command(BaseCommand):
+    help = 'Measure how many transfers per second the transfer engine sustains on the configured database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=10,
+                            help='Number of accounts to transfer between. Fewer accounts means more contention.')
+        parser.add_argument('--transfers', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the benchmark accounts afterwards.")
+
+    def handle(self, *args, **options):
+        accounts = self.create_accounts(options['accounts'])
+        total_before = self.total_balance(accounts)
+        per_thread = options['transfers'] // options['threads']
+        failures = []
+        insufficient = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(per_thread):
+                    sender, receiver = rng.sample(accounts, 2)
+                    try:
+                        transfer(UserBankAccount(pk=sender.pk, account_no=sender.account_no),
+                                 UserBankAccount(
+                                     pk=receiver.pk, account_no=receiver.account_no),
+                                 Decimal(rng.randint(1, 100)))
+                    except InsufficientBalance:
+                        insufficient.append(1)
+                    except Exception as error:
+                        failures.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        completed = per_thread * options['threads'] - \
+            len(failures) - len(insufficient)
+        total_after = self.total_balance(accounts)
+
+        self.stdout.write(
+            f'{completed} transfers in {elapsed:.2f}s '
+            f'({completed / elapsed:.0f} transfers/s) on {connections["default"].vendor}, '
+            f'{options["threads"]} threads, {options["accounts"]} accounts')
+        self.stdout.write(
+            f'{len(insufficient)} rejected for balance, {len(failures)} failed')
+
+        if not options['keep']:
+            User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+
+        if failures:
+            raise CommandError(f'First failure: {failures[0]!r}')
+        if total_before != total_after:
+            raise CommandError(
+                f'Money was not conserved: {total_before} before, {total_after} after')
+
+    def create_accounts(self, count):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        users = User.objects.bulk_create(
+            [User(username=f'{BENCH_PREFIX}{i}') for i in range(count)])
+        if users[0].pk is None:
+            users = list(User.objects.filter(
+                username__startswith=BENCH_PREFIX).order_by('pk'))
+        return UserBankAccount.objects.bulk_create([
+            UserBankAccount(user=user, account_no=900000000 + i, account_type='Saving',
+                            gender='Male', balance=Decimal('100000'))
+            for i, user in enumerate(users)
+        ])
+
+    def total_balance(self, accounts):
+        return UserBankAccount.objects.filter(
+            pk__in=[account.pk for account in accounts]).aggregate(Sum('balance'))['balance__sum']
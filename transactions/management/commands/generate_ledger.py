@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from django_bank.constants import ACCOUNT_TYPE, TRANSACTION_TYPE
+from transactions.synthetic import generate_chunk
+
+DEFAULT_ACCOUNT_TYPES = 'Saving=60,Current=30,Fixed=10'
+DEFAULT_TRANSACTION_TYPES = 'Deposit=30,Withdraw=25,Transfer=15,Receive=15,Loan=8,Repayment=7'
+
+
+def parse_weights(value, choices):
+    known = [choice for choice, _ in choices]
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in known:
+            raise CommandError(f'Unknown type {name!r}, expected one of {", ".join(known)}')
+        try:
+            weights[name] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid weight {weight!r} for {name}')
+    return weights
+
+
+class Command(BaseCommand):
+    help = ('Create synthetic customers with realistic ledgers for benchmarks and capacity planning. '
+            'Every ledger has a consistent balance_after_transaction chain, and the balances, loan counters '
+            'and daily balances match it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=1000)
+        parser.add_argument('--transactions-per-account', type=int, default=50,
+                            help='Average number of postings per account.')
+        parser.add_argument('--skew', type=float, default=1.5,
+                            help='Shape of the pareto distribution of postings per account, > 1. '
+                                 'Closer to 1 means a few very busy accounts.')
+        parser.add_argument('--account-types', default=DEFAULT_ACCOUNT_TYPES,
+                            help=f'Relative weight of each account type (default: {DEFAULT_ACCOUNT_TYPES}).')
+        parser.add_argument('--transaction-types', default=DEFAULT_TRANSACTION_TYPES,
+                            help=f'Relative weight of each transaction type (default: {DEFAULT_TRANSACTION_TYPES}).')
+        parser.add_argument('--days', type=int, default=365,
+                            help='History length, ending now.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Accounts generated and inserted per database transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes generating and inserting chunks. 1 runs everything in this process.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--prefix', default='synthetic_',
+                            help='Username prefix of the generated customers.')
+
+    def handle(self, *args, **options):
+        if options['skew'] <= 1:
+            raise CommandError('--skew must be greater than 1.')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f'There are already users named {options["prefix"]}*, pick another --prefix.')
+        spec = {
+            'accounts': options['accounts'],
+            'transactions_per_account': options['transactions_per_account'],
+            'skew': options['skew'],
+            'account_types': parse_weights(options['account_types'], ACCOUNT_TYPE),
+            'transaction_types': parse_weights(options['transaction_types'], TRANSACTION_TYPE),
+            'days': options['days'],
+            'chunk_size': options['chunk_size'],
+            'seed': options['seed'],
+            'prefix': options['prefix'],
+            'end': timezone.now(),
+        }
+        chunks = range((options['accounts'] + options['chunk_size'] - 1) // options['chunk_size'])
+
+        self.verbosity = options['verbosity']
+        self.accounts = self.transactions = 0
+        self.timings = {'generate (cpu)': 0.0, 'insert': 0.0}
+        started = time.perf_counter()
+        if options['workers'] <= 1:
+            for chunk in chunks:
+                self.add_result(generate_chunk(spec, chunk), started)
+        else:
+            # spawn: the workers open their own database connections instead of sharing ours. django.setup is their initializer because they start from scratch.
+            with ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=django.setup) as pool:
+                futures = [pool.submit(generate_chunk, spec, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    self.add_result(future.result(), started)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {self.accounts} account(s) and {self.transactions} transaction(s) in {elapsed:.1f}s '
+            f'({self.transactions / elapsed if elapsed else 0:.0f} transactions/s).'))
+        for stage, seconds in self.timings.items():
+            self.stdout.write(f'  {stage:<16} {seconds:8.2f}s')
+
+    def add_result(self, result, started):
+        accounts, transactions, generate_seconds, insert_seconds = result
+        self.accounts += accounts
+        self.transactions += transactions
+        self.timings['generate (cpu)'] += generate_seconds
+        self.timings['insert'] += insert_seconds
+        if self.verbosity > 1:
+            self.stdout.write(f'{self.accounts} accounts, {self.transactions} transactions '
+                              f'after {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,246 @@
+import json
+import random
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from accounts.models import UserBankAccount
+from core.models import OutboxEmail
+from core.middleware import QueryStats
+from django_bank.constants import ACCOUNT_NO_START
+from transactions.models import Transaction
+from transactions.services import approve_loan, request_loan
+
+USERNAME_PREFIX = 'loadtest_'
+FLOWS = ['deposit', 'withdraw', 'transfer', 'loan-request', 'repayment', 'report']
+DEFAULT_MIX = 'deposit=30,withdraw=20,transfer=25,loan-request=5,repayment=5,report=15'
+STARTING_BALANCE = Decimal('100000')
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        flow, _, weight = part.partition('=')
+        if flow not in FLOWS:
+            raise CommandError(f'Unknown flow {flow!r}, expected one of {", ".join(FLOWS)}')
+        mix[flow] = int(weight)
+    return mix
+
+
+def percentile(values, share):
+    # nearest rank on the sorted values.
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+class Worker(threading.Thread):
+    # one simulated customer session after another, each request through the full middleware stack of the app.
+    def __init__(self, command, accounts, requests, mix, seed):
+        super().__init__()
+        self.command = command
+        self.accounts = accounts
+        self.requests = requests
+        self.flows = list(mix)
+        self.weights = list(mix.values())
+        self.random = random.Random(seed)
+        self.samples = {flow: [] for flow in FLOWS}
+        self.failures = []
+
+    def run(self):
+        clients = {}
+        try:
+            for _ in range(self.requests):
+                account = self.random.choice(self.accounts)
+                flow = self.random.choices(self.flows, self.weights)[0]
+                client = clients.get(account.pk)
+                if client is None:
+                    client = clients[account.pk] = Client()
+                    client.force_login(account.user)
+                self.run_flow(flow, client, account)
+        finally:
+            connections.close_all()
+
+    def run_flow(self, flow, client, account):
+        method, url, data = getattr(self, f'prepare_{flow.replace("-", "_")}')(account)
+        queries = QueryStats()
+        started = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(queries):
+                response = getattr(client, method)(url, data)
+            status = response.status_code
+        except Exception as error:
+            status = None
+            self.failures.append(f'{flow}: {error!r}')
+        elapsed = time.perf_counter() - started
+        if status is not None and status >= 400:
+            self.failures.append(f'{flow}: HTTP {status}')
+        self.samples[flow].append((elapsed, queries.count, status is not None and status < 400))
+
+    # each prepare_* returns (method, url, data). anything done here isn't part of the measured request.
+
+    def prepare_deposit(self, account):
+        return 'post', reverse('deposit'), {'amount': self.random.randint(100, 2000), 'transaction_type': 'Deposit'}
+
+    def prepare_withdraw(self, account):
+        return 'post', reverse('withdraw'), {'amount': self.random.randint(100, 1000), 'transaction_type': 'Withdraw'}
+
+    def prepare_transfer(self, account):
+        receiver = self.random.choice([other for other in self.accounts if other.pk != account.pk])
+        return 'post', reverse('transfer'), {
+            'amount': self.random.randint(50, 500), 'transaction_type': 'Transfer',
+            'receiver_account_no': receiver.account_no,
+        }
+
+    def prepare_loan_request(self, account):
+        # the form allows 10% to 50% of the current balance.
+        balance = UserBankAccount.objects.values_list('balance', flat=True).get(pk=account.pk)
+        return 'post', reverse('loan-request'), {
+            'amount': (balance * Decimal('0.2')).quantize(Decimal('1')), 'transaction_type': 'Loan'}
+
+    def prepare_repayment(self, account):
+        # the back office's part: make sure there is an approved loan to repay.
+        loan = Transaction.objects.filter(
+            account=account, transaction_type='Loan', loan_approved=True, loan_repayment=False).first()
+        if loan is None:
+            loan = Transaction.objects.filter(
+                account=account, transaction_type='Loan', loan_approved=False).first()
+            if loan is None:
+                account.refresh_from_db()
+                loan = request_loan(Transaction(account=account, amount=Decimal('100')))
+            approve_loan(loan)
+        return 'get', reverse('loan-repayment', args=[loan.pk]), None
+
+    def prepare_report(self, account):
+        return 'get', reverse('transaction-report'), None
+
+
+class Command(BaseCommand):
+    help = ('Seed accounts and drive the banking flows concurrently through the app, reporting throughput, '
+            'latency percentiles and queries per request. Results can be saved as JSON and compared with a baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Concurrent sessions (threads).')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per worker.')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f'Relative weight of each flow (default: {DEFAULT_MIX}).')
+        parser.add_argument('--seed', type=int, default=1,
+                            help='Seed of the random flow and account choices, for reproducible runs.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare with.')
+        parser.add_argument('--max-regression', type=float, default=20.0,
+                            help='Fail when a p95 latency grows or the throughput drops by more than this percentage.')
+        parser.add_argument('--keep', action='store_true',
+                            help="Don't delete the load test accounts afterwards. Their queued emails are deleted anyway.")
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        accounts = self.seed(options['accounts'])
+        try:
+            results = self.run(accounts, options, mix)
+        finally:
+            self.cleanup(keep_accounts=options['keep'])
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['max_regression'])
+
+    def cleanup(self, keep_accounts=False):
+        # the flows queue real notification emails to the made up addresses. send_outbox would try to deliver them, so they go even with --keep.
+        OutboxEmail.objects.filter(to__startswith=USERNAME_PREFIX, to__endswith='@example.com').delete()
+        if not keep_accounts:
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def seed(self, count):
+        self.cleanup()
+        users = [User(username=f'{USERNAME_PREFIX}{i}', email=f'{USERNAME_PREFIX}{i}@example.com')
+                 for i in range(count)]
+        for user in users:
+            # the sessions are created with force_login, nobody logs in with a password.
+            user.set_unusable_password()
+        User.objects.bulk_create(users)
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk'))
+        UserBankAccount.objects.bulk_create([
+            UserBankAccount(user=user, account_no=ACCOUNT_NO_START + user.pk, account_type='Saving',
+                            gender='Male', balance=STARTING_BALANCE)
+            for user in users
+        ])
+        return list(UserBankAccount.objects.select_related('user').filter(user__in=users))
+
+    def run(self, accounts, options, mix):
+        workers = [Worker(self, accounts, options['requests'], mix, options['seed'] * 1000 + i)
+                   for i in range(options['workers'])]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        flows = {}
+        for flow in FLOWS:
+            samples = [sample for worker in workers for sample in worker.samples[flow]]
+            if not samples:
+                continue
+            latencies = [sample[0] for sample in samples]
+            flows[flow] = {
+                'requests': len(samples),
+                'errors': sum(1 for sample in samples if not sample[2]),
+                'p50_ms': percentile(latencies, 0.50) * 1000,
+                'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'queries_per_request': statistics.mean(sample[1] for sample in samples),
+            }
+        total = sum(flow['requests'] for flow in flows.values())
+        return {
+            'settings': {key: options[key] for key in ('accounts', 'workers', 'requests', 'mix', 'seed')},
+            'database': connections['default'].vendor,
+            'elapsed_s': elapsed,
+            'throughput_rps': total / elapsed,
+            'flows': flows,
+            'failures': [failure for worker in workers for failure in worker.failures][:20],
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f'{results["database"]}: {sum(f["requests"] for f in results["flows"].values())} requests '
+            f'in {results["elapsed_s"]:.1f}s, {results["throughput_rps"]:.1f} requests/s')
+        self.stdout.write(f'  {"flow":<13}{"requests":>9}{"errors":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}')
+        for flow, stats in results['flows'].items():
+            self.stdout.write(
+                f'  {flow:<13}{stats["requests"]:>9}{stats["errors"]:>8}{stats["p50_ms"]:>9.1f}'
+                f'{stats["p95_ms"]:>9.1f}{stats["p99_ms"]:>9.1f}{stats["queries_per_request"]:>9.1f}')
+        for failure in results['failures']:
+            self.stdout.write(self.style.WARNING(f'  {failure}'))
+
+    def compare(self, results, path, max_regression):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        limit = 1 + max_regression / 100
+        regressions = []
+        if results['throughput_rps'] * limit < baseline['throughput_rps']:
+            regressions.append(
+                f'throughput {baseline["throughput_rps"]:.1f} -> {results["throughput_rps"]:.1f} requests/s')
+        for flow, stats in results['flows'].items():
+            before = baseline['flows'].get(flow)
+            if before and stats['p95_ms'] > before['p95_ms'] * limit:
+                regressions.append(f'{flow} p95 {before["p95_ms"]:.1f} -> {stats["p95_ms"]:.1f} ms')
+            # retries after lock timeouts move the average a little, a real N+1 moves it by whole queries.
+            if before and stats['queries_per_request'] > before['queries_per_request'] + 0.5:
+                regressions.append(
+                    f'{flow} queries/request {before["queries_per_request"]:.1f} -> {stats["queries_per_request"]:.1f}')
+        if regressions:
+            raise CommandError('Regressed against the baseline: ' + '; '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'No regression against {path}.'))
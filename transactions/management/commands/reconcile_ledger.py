@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from accounts.models import UserBankAccount
+from transactions.reconciliation import reconcile_range
+
+
+class Command(BaseCommand):
+    help = ("Check that every account's balance equals the sum of its postings and that each "
+            "balance_after_transaction follows from the postings before it. Accounts are split into "
+            "shards of id ranges that are checked in parallel.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='Only check this account id (can be repeated).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Processes checking shards. 1 runs everything in this process.')
+        parser.add_argument('--shards', type=int,
+                            help='Number of account id ranges (default: 4 per worker).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Accounts read per ledger query.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Transactions fetched per database round trip.')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Mismatches shown.')
+
+    def handle(self, *args, **options):
+        bounds = UserBankAccount.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write('There are no accounts.')
+            return
+        workers = options['workers']
+        shards = max(1, options['shards'] or workers * 4)
+        # equal id ranges. with many shards per worker, a range full of busy accounts doesn't hold up the others.
+        step = (bounds['high'] + 1 - bounds['low'] + shards - 1) // shards
+        ranges = [(low, min(low + step, bounds['high'] + 1)) for low in range(bounds['low'], bounds['high'] + 1, step)]
+        kwargs = {'account_ids': options['accounts'], 'batch_size': options['batch_size'],
+                  'chunk_size': options['chunk_size'], 'limit': options['limit']}
+
+        self.verbosity = options['verbosity']
+        self.accounts = self.rows = self.count = 0
+        self.mismatches = []
+        started = time.perf_counter()
+        if workers <= 1:
+            for low, high in ranges:
+                self.add_result(reconcile_range(low, high, **kwargs))
+        else:
+            # spawn: each worker opens its own database connection. django.setup is their initializer because they start from scratch.
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=django.setup) as pool:
+                futures = [pool.submit(reconcile_range, low, high, **kwargs) for low, high in ranges]
+                for future in as_completed(futures):
+                    self.add_result(future.result())
+        elapsed = time.perf_counter() - started
+
+        for mismatch in sorted(self.mismatches)[:options['limit']]:
+            line = f'account {mismatch.account_no} (id {mismatch.account_id}):'
+            if mismatch.balance != mismatch.ledger_balance:
+                line += f' balance {mismatch.balance}, the postings add up to {mismatch.ledger_balance}.'
+            if mismatch.transaction_id is not None:
+                line += (f' first bad transaction {mismatch.transaction_id}: balance_after_transaction '
+                         f'{mismatch.recorded}, expected {mismatch.expected}.')
+            self.stdout.write(self.style.WARNING(line))
+        self.stdout.write(
+            f'Checked {self.accounts} account(s) and {self.rows} transaction(s) in {elapsed:.1f}s '
+            f'({self.rows / elapsed if elapsed else 0:.0f} transactions/s) with {workers} worker(s), {len(ranges)} shard(s).')
+        if self.count:
+            raise CommandError(f"{self.count} account(s) don't reconcile.")
+        self.stdout.write(self.style.SUCCESS('Every account reconciles.'))
+
+    def add_result(self, result):
+        accounts, rows, (mismatches, count), seconds = result
+        self.accounts += accounts
+        self.rows += rows
+        self.count += count
+        self.mismatches.extend(mismatches)
+        if self.verbosity > 1:
+            self.stdout.write(f'  shard: {accounts} account(s), {rows} transaction(s) in {seconds:.1f}s')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from transactions.services import rebuild_loan_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the open loan count and outstanding loan amount of each account from the transaction ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='Only reconcile this account id (can be repeated).')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = rebuild_loan_counters(options['accounts'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Fixed the loan counters of {fixed} account(s).'))
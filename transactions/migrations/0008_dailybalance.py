@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_remove_useraddress_state_alter_useraddress_country'),
+        ('transactions', '0006_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('deposit_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('receive_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('loan_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('withdraw_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('transfer_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('repayment_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='daily_balance_account_date_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:50
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_loan_counters(apps, schema_editor):
+    # same counting as services.rebuild_loan_counters, with the historical models.
+    Transaction = apps.get_model('transactions', 'Transaction')
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    open_loans = Transaction.objects.filter(
+        account=OuterRef('pk'), transaction_type='Loan', loan_repayment=False).order_by().values('account')
+    UserBankAccount.objects.update(
+        open_loans=Coalesce(Subquery(open_loans.annotate(
+            count=Count('pk')).values('count')), 0),
+        outstanding_loan_amount=Coalesce(
+            Subquery(open_loans.filter(loan_approved=True).annotate(
+                total=Sum('amount')).values('total')),
+            Value(Decimal(0)), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_loan_counters'),
+        ('transactions', '0009_transaction_reference'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_loan_counters, migrations.RunPython.noop),
+    ]
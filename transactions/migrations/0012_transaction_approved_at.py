@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0011_transaction_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='approved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,28 @@
+from collections import namedtuple
+
 from django.db import models
 from accounts.models import UserBankAccount
 from django_bank.constants import TRANSACTION_TYPE
 
 # Create your models here.
 
+# badge colours in the transaction report: credits green, debits red, loans waiting for approval yellow. built once here, css_classes is called for every row.
+CSS_CLASSES = {
+    'Deposit': 'text-green-700 bg-green-100',
+    'Receive': 'text-green-700 bg-green-100',
+    'Withdraw': 'text-red-700 bg-red-100',
+    'Transfer': 'text-red-700 bg-red-100',
+    'Loan': 'text-green-700 bg-green-100',
+    'Repayment': 'text-red-700 bg-red-100',
+}
+PENDING_LOAN_CSS_CLASSES = 'text-yellow-700 bg-yellow-100'
+
+
+def css_classes(transaction_type, loan_approved):
+    if transaction_type == 'Loan' and not loan_approved:
+        return PENDING_LOAN_CSS_CLASSES
+    return CSS_CLASSES.get(transaction_type, '')
+
 
 class Transaction(models.Model):
     # one user can have many transactions. so i use ForeignKey. related_name is used to access transactions from user model. on_delete=models.CASCADE means if a user is deleted, all transactions of that user will also be deleted.
@@ -17,21 +36,86 @@ class Transaction(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     loan_approved = models.BooleanField(default=False)
     loan_repayment = models.BooleanField(default=False)
+    # when a loan was credited. its balance_after_transaction is from then, and the daily rollups count it on that day. empty for loans approved before this was recorded.
+    approved_at = models.DateTimeField(null=True, blank=True)
+    # free text from the sender, e.g. the payroll reference of a bulk credit.
+    reference = models.CharField(max_length=100, blank=True)
 
     def __str__(self):
         return f"{self.account.account_no} - {self.transaction_type} - {self.amount}"
 
     @property
     def css_classes(self):
-        css_classes = {
-            'Deposit': 'text-green-700 bg-green-100',
-            'Receive': 'text-green-700 bg-green-100',
-            'Withdraw': 'text-red-700 bg-red-100',
-            'Transfer': 'text-red-700 bg-red-100',
-            'Loan': 'text-green-700 bg-green-100' if self.loan_approved else 'text-yellow-700 bg-yellow-100',
-            'Repayment': 'text-red-700 bg-red-100'
-        }
-        return css_classes.get(self.transaction_type, '')
+        return css_classes(self.transaction_type, self.loan_approved)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # transaction report: one account's rows, newest first by (timestamp, id) for keyset pagination, optionally limited to a date range.
+            models.Index(fields=['account', '-timestamp', '-id'],
+                         name='txn_account_timestamp_idx'),
+            # loan request count (account, type, repaid) and loan list (account, type) share this one.
+            models.Index(fields=['account', 'transaction_type', 'loan_repayment'],
+                         name='txn_account_type_repaid_idx'),
+            # admin changelist: the whole ledger newest first (ordering + pk tiebreak), and the date filters.
+            models.Index(fields=['-timestamp', '-id'],
+                         name='txn_timestamp_idx'),
+        ]
+
+
+class LedgerRow(namedtuple('LedgerRow', 'id timestamp transaction_type amount balance_after_transaction loan_approved loan_repayment')):
+    """
+    The columns of a transaction that the report and the loan list show,
+    fetched with ``values_list(*LedgerRow._fields)``. A tuple instead of a
+    model instance: no ``__dict__``, no model state, no unused columns.
+    """
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def css_classes(self):
+        return css_classes(self.transaction_type, self.loan_approved)
+
+
+class DailyBalance(models.Model):
+    # one row per account per day, kept up to date by every posting (see transactions/rollups.py). a date range summary reads these rows instead of the whole ledger.
+    account = models.ForeignKey(
+        UserBankAccount, related_name='daily_balances', on_delete=models.CASCADE)
+    date = models.DateField()
+    opening_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    # credits
+    deposit_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
+    receive_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
+    loan_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
+    # debits
+    withdraw_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
+    transfer_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
+    repayment_total = models.DecimalField(
+        default=0, max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.account.account_no} - {self.date} - {self.closing_balance}"
+
+    @property
+    def total_credit(self):
+        return self.deposit_total + self.receive_total + self.loan_total
+
+    @property
+    def total_debit(self):
+        return self.withdraw_total + self.transfer_total + self.repayment_total
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'date'], name='daily_balance_account_date_unique'),
+        ]
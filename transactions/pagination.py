@@ -0,0 +1,102 @@
+from datetime import datetime
+
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+def encode_cursor(row):
+    return urlsafe_base64_encode(f'{row.timestamp.isoformat()}|{row.pk}'.encode())
+
+
+def decode_cursor(cursor):
+    # a cursor is "<timestamp>|<id>" of the last row the user saw. anything we can't parse just means "first page".
+    try:
+        timestamp, pk = force_str(urlsafe_base64_decode(cursor)).split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_older, has_newer):
+        self.object_list = object_list
+        self.has_older = has_older
+        self.has_newer = has_newer
+
+    @property
+    def older_cursor(self):
+        if self.has_older and self.object_list:
+            return encode_cursor(self.object_list[-1])
+
+    @property
+    def newer_cursor(self):
+        if self.has_newer and self.object_list:
+            return encode_cursor(self.object_list[0])
+
+    def has_other_pages(self):
+        return self.has_older or self.has_newer
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset newest first by (timestamp, id) without OFFSET.
+
+    Every page is one index range read of ``page_size + 1`` rows, so page 10,000
+    costs the same as page 1. The extra row only tells us whether there is
+    another page in that direction.
+
+    With a ``row_class`` (a namedtuple with ``timestamp`` and ``pk``) only its
+    fields are fetched and the page holds row_class tuples instead of model
+    instances.
+    """
+
+    def __init__(self, queryset, page_size, row_class=None):
+        self.queryset = queryset
+        self.page_size = page_size
+        self.row_class = row_class
+
+    def fetch(self, queryset):
+        if self.row_class is None:
+            return list(queryset)
+        return [self.row_class._make(row) for row in queryset.values_list(*self.row_class._fields)]
+
+    async def afetch(self, queryset):
+        if self.row_class is None:
+            return [obj async for obj in queryset]
+        return [self.row_class._make(row) async for row in queryset.values_list(*self.row_class._fields)]
+
+    def query(self, older=None, newer=None):
+        # the queryset of the page (plus the one extra row) and which way it reads from the cursor.
+        if older and decode_cursor(older):
+            timestamp, pk = decode_cursor(older)
+            # (timestamp, id) < cursor. the timestamp bound is an index range, the exclude only trims ties.
+            return self.queryset.filter(timestamp__lte=timestamp).exclude(
+                timestamp=timestamp, pk__gte=pk).order_by('-timestamp', '-pk')[:self.page_size + 1], 'older'
+
+        if newer and decode_cursor(newer):
+            timestamp, pk = decode_cursor(newer)
+            # walk the other way from the cursor, the rows are flipped back to newest first in make_page.
+            return self.queryset.filter(timestamp__gte=timestamp).exclude(
+                timestamp=timestamp, pk__lte=pk).order_by('timestamp', 'pk')[:self.page_size + 1], 'newer'
+
+        return self.queryset.order_by('-timestamp', '-pk')[:self.page_size + 1], None
+
+    def make_page(self, rows, direction):
+        if direction == 'newer':
+            return KeysetPage(rows[:self.page_size][::-1], True, len(rows) > self.page_size)
+        return KeysetPage(rows[:self.page_size], len(rows) > self.page_size, direction == 'older')
+
+    def page(self, older=None, newer=None):
+        queryset, direction = self.query(older, newer)
+        return self.make_page(self.fetch(queryset), direction)
+
+    async def apage(self, older=None, newer=None):
+        # page() for async views, the rows are fetched with the async ORM.
+        queryset, direction = self.query(older, newer)
+        return self.make_page(await self.afetch(queryset), direction)
@@ -0,0 +1,116 @@
+import time
+from collections import namedtuple
+from decimal import Decimal
+from itertools import groupby
+
+from accounts.models import UserBankAccount
+from .models import Transaction
+from .rollups import signed_amount
+
+# checks that every account's balance and balance_after_transaction chain agree with its postings, see the reconcile_ledger command. imported by the pool workers after django.setup().
+
+Mismatch = namedtuple(
+    'Mismatch', 'account_id account_no balance ledger_balance transaction_id recorded expected')
+
+
+def replay(postings):
+    """
+    Replay one account's ``(id, transaction_type, amount, balance_after,
+    loan_approved)`` postings in (timestamp, id) order. Returns the balance
+    they add up to and the first posting whose balance_after doesn't follow
+    from the ones before it, as ``(id, recorded, expected)``, or None.
+
+    A loan is credited when it's approved, which can be after postings with a
+    later timestamp, so an approved loan is held back until the chain shows
+    where it went in: the first posting that only adds up with it.
+    """
+    total = Decimal(0)
+    balance = Decimal(0)
+    first_bad = None
+    # approved loans that aren't placed in the chain yet, as (id, amount, balance_after).
+    floating = []
+
+    def credit_next_loan():
+        # the held back loan that fits next in the chain, if any.
+        nonlocal balance
+        loan = next((loan for loan in floating if loan[2] == balance + loan[1]), None)
+        if loan is not None:
+            floating.remove(loan)
+            balance += loan[1]
+        return loan
+
+    for txn_id, transaction_type, amount, balance_after, loan_approved in postings:
+        if transaction_type is None:
+            continue
+        if transaction_type == 'Loan' and loan_approved:
+            total += amount
+            floating.append((txn_id, amount, balance_after))
+            continue
+        # a pending loan hasn't moved money, its balance_after is the balance when it was requested.
+        delta = Decimal(0) if transaction_type == 'Loan' else signed_amount(transaction_type, amount)
+        total += delta
+        if first_bad is None:
+            while balance + delta != balance_after and credit_next_loan():
+                pass
+            if balance + delta == balance_after:
+                balance = balance_after
+            else:
+                first_bad = (txn_id, balance_after, balance + delta)
+
+    # the loans approved after the last posting.
+    while first_bad is None and floating:
+        if not credit_next_loan():
+            first_bad = (floating[0][0], floating[0][2], balance + floating[0][1])
+    return total, first_bad
+
+
+def reconcile_range(low, high, account_ids=None, batch_size=1000, chunk_size=2000, limit=20):
+    """
+    Reconcile the accounts with ``low <= id < high`` (or only ``account_ids``),
+    ``batch_size`` accounts at a time, streaming their postings ``chunk_size``
+    rows per round trip. Memory doesn't grow with the ledger.
+
+    Returns ``(accounts, transactions, mismatches, seconds)`` where mismatches
+    holds at most ``limit`` ``Mismatch`` rows plus the total count.
+    """
+    started = time.perf_counter()
+    checked = rows = 0
+    found = []
+    count = 0
+    accounts = UserBankAccount.objects.filter(pk__gte=low, pk__lt=high)
+    if account_ids is not None:
+        accounts = accounts.filter(pk__in=account_ids)
+    # newest accounts first: the ledger is read as (account desc, timestamp, id), which is txn_account_timestamp_idx walked backwards, so the database doesn't sort.
+    accounts = accounts.order_by('-pk').values_list('pk', 'account_no', 'balance')
+    last = high
+
+    def stream(queryset):
+        nonlocal rows
+        for row in queryset.iterator(chunk_size=chunk_size):
+            rows += 1
+            yield row
+
+    while True:
+        batch = list(accounts.filter(pk__lt=last)[:batch_size])
+        if not batch:
+            break
+        last = batch[-1][0]
+        balances = {pk: (account_no, balance) for pk, account_no, balance in batch}
+        if account_ids is None:
+            ledger = Transaction.objects.filter(account_id__lte=batch[0][0], account_id__gte=last)
+        else:
+            ledger = Transaction.objects.filter(account_id__in=balances)
+        ledger = ledger.order_by('-account_id', 'timestamp', 'id').values_list(
+            'account_id', 'id', 'transaction_type', 'amount', 'balance_after_transaction', 'loan_approved')
+
+        replayed = {}
+        for account_id, postings in groupby(stream(ledger), key=lambda row: row[0]):
+            replayed[account_id] = replay(row[1:] for row in postings)
+        for pk, (account_no, balance) in balances.items():
+            total, first_bad = replayed.get(pk, (Decimal(0), None))
+            if total != balance or first_bad is not None:
+                count += 1
+                if len(found) < limit:
+                    found.append(Mismatch(pk, account_no, balance, total, *(first_bad or (None, None, None))))
+        checked += len(batch)
+    return checked, rows, (found, count), time.perf_counter() - started
@@ -0,0 +1,191 @@
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from django_bank.constants import CREDIT_TRANSACTION_TYPES, TRANSACTION_TYPE
+from .models import DailyBalance, Transaction
+
+# DailyBalance field that holds the day's total for each transaction type.
+TOTAL_FIELDS = {
+    transaction_type: f'{transaction_type.lower()}_total' for transaction_type, _ in TRANSACTION_TYPE
+}
+
+
+def signed_amount(transaction_type, amount):
+    return amount if transaction_type in CREDIT_TRANSACTION_TYPES else -amount
+
+
+def record_postings(postings, day=None):
+    """
+    Fold postings into today's DailyBalance rows.
+
+    ``postings`` is an iterable of ``(account_id, transaction_type, amount,
+    balance_after)`` in posting order. Call it inside the posting's atomic
+    block: the balance UPDATE has already locked the account row, so postings
+    for one account reach this point one at a time.
+    """
+    day = day or timezone.localdate()
+    days = {}
+    for account_id, transaction_type, amount, balance_after in postings:
+        rollup = days.get(account_id)
+        if rollup is None:
+            # only used when this is the account's first posting of the day.
+            rollup = days[account_id] = DailyBalance(
+                account_id=account_id, date=day,
+                opening_balance=balance_after - signed_amount(transaction_type, amount))
+        rollup.closing_balance = balance_after
+        field = TOTAL_FIELDS[transaction_type]
+        setattr(rollup, field, getattr(rollup, field) + amount)
+
+    existing = DailyBalance.objects.filter(
+        account_id__in=list(days), date=day)
+    to_update = []
+    for row in existing:
+        rollup = days.pop(row.account_id)
+        row.closing_balance = rollup.closing_balance
+        for field in TOTAL_FIELDS.values():
+            setattr(row, field, getattr(row, field) + getattr(rollup, field))
+        to_update.append(row)
+
+    if to_update:
+        update_rows(to_update)
+    if days:
+        DailyBalance.objects.bulk_create(days.values())
+
+
+def update_rows(rows):
+    # one prepared UPDATE run through executemany. bulk_update would build a CASE per column per row, which is slow in python for big payroll chunks.
+    quote_name = connection.ops.quote_name
+    fields = ['closing_balance', *TOTAL_FIELDS.values()]
+    sql = 'UPDATE {table} SET {columns} WHERE {pk} = %s'.format(
+        table=quote_name(DailyBalance._meta.db_table),
+        columns=', '.join(f'{quote_name(field)} = %s' for field in fields),
+        pk=quote_name(DailyBalance._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [getattr(row, field) for field in fields] + [row.pk] for row in rows
+        ])
+
+
+def summarize(account, start_date, end_date):
+    """
+    Opening/closing balance and per-type totals for an inclusive date range,
+    read from at most one row per day (plus one row before the range).
+    """
+    rows = list(DailyBalance.objects.filter(
+        account=account, date__gte=start_date, date__lte=end_date))
+    totals = {field: sum((getattr(row, field) for row in rows), Decimal(0))
+              for field in TOTAL_FIELDS.values()}
+
+    if rows:
+        opening_balance = rows[0].opening_balance
+        closing_balance = rows[-1].closing_balance
+    else:
+        # nothing was posted in the range, so the balance is whatever it was at the end of the last active day.
+        previous = DailyBalance.objects.filter(
+            account=account, date__lt=start_date).order_by('-date').first()
+        opening_balance = closing_balance = previous.closing_balance if previous else Decimal(0)
+
+    total_credit = sum(
+        totals[TOTAL_FIELDS[t]] for t in CREDIT_TRANSACTION_TYPES)
+    return {
+        'opening_balance': opening_balance,
+        'closing_balance': closing_balance,
+        'total_credit': total_credit,
+        'total_debit': sum(totals.values()) - total_credit,
+        **totals,
+    }
+
+
+def fold_postings(postings):
+    """
+    Fold ``(account_id, timestamp, transaction_type, amount, balance_after)``
+    postings, in (account, timestamp, id) order, into DailyBalance rows. Each
+    row is yielded once its day is over.
+    """
+    current = None
+    for account_id, timestamp, transaction_type, amount, balance_after in postings:
+        day = timezone.localdate(timestamp)
+        if current is None or (current.account_id, current.date) != (account_id, day):
+            if current is not None:
+                yield current
+            current = DailyBalance(
+                account_id=account_id, date=day,
+                opening_balance=balance_after - signed_amount(transaction_type, amount))
+        current.closing_balance = balance_after
+        field = TOTAL_FIELDS[transaction_type]
+        setattr(current, field, getattr(current, field) + amount)
+    if current is not None:
+        yield current
+
+
+def place_loans(postings):
+    """
+    Turn ``(account_id, timestamp, transaction_type, amount, balance_after,
+    approved_at)`` rows, in (account, posting time, id) order, into the
+    postings ``fold_postings`` takes.
+
+    A loan approved before approved_at was recorded doesn't say when it was
+    credited. Like ``reconciliation.replay``, it's held back until the first
+    posting that only adds up with it and counts on that posting's day. The
+    ones credited after the account's last posting count on that day.
+    """
+    for account_id, rows in groupby(postings, key=itemgetter(0)):
+        balance = Decimal(0)
+        last = None
+        # (timestamp, amount, balance_after) of the loans that aren't placed yet.
+        floating = []
+        for _, timestamp, transaction_type, amount, balance_after, approved_at in rows:
+            if transaction_type == 'Loan' and approved_at is None:
+                floating.append((timestamp, amount, balance_after))
+                continue
+            delta = signed_amount(transaction_type, amount)
+            while floating and balance + delta != balance_after:
+                loan = next((loan for loan in floating if loan[2] == balance + loan[1]), None)
+                if loan is None:
+                    break
+                floating.remove(loan)
+                balance = loan[2]
+                yield account_id, timestamp, 'Loan', loan[1], loan[2]
+            yield account_id, timestamp, transaction_type, amount, balance_after
+            balance = balance_after
+            last = timestamp
+        for timestamp, amount, balance_after in floating:
+            yield account_id, max(timestamp, last or timestamp), 'Loan', amount, balance_after
+
+
+def rebuild(account_ids=None, chunk_size=2000):
+    """
+    Recreate DailyBalance rows from the ledger, streaming it in (account,
+    posting time, id) order. Pending loans haven't moved money and are skipped;
+    approved loans count on the day they were approved, like in
+    ``record_postings``. Returns the number of rows written.
+    """
+    ledger = Transaction.objects.exclude(
+        Q(transaction_type='Loan', loan_approved=False) | Q(transaction_type__isnull=True))
+    rollups = DailyBalance.objects.all()
+    if account_ids is not None:
+        ledger = ledger.filter(account_id__in=account_ids)
+        rollups = rollups.filter(account_id__in=account_ids)
+    rollups.delete()
+
+    batch = []
+    written = 0
+    rows = ledger.annotate(posted_at=Coalesce('approved_at', 'timestamp')).order_by(
+        'account_id', 'posted_at', 'id').values_list(
+        'account_id', 'posted_at', 'transaction_type', 'amount', 'balance_after_transaction', 'approved_at')
+    for rollup in fold_postings(place_loans(rows.iterator(chunk_size=chunk_size))):
+        batch.append(rollup)
+        if len(batch) >= chunk_size:
+            DailyBalance.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+
+    DailyBalance.objects.bulk_create(batch)
+    return written + len(batch)
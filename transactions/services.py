@@ -0,0 +1,446 @@
+import random
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, Count, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from django_bank.constants import DEBIT_TRANSACTION_TYPES, MAX_OPEN_LOANS
+from .models import Transaction
+from .rollups import record_postings, signed_amount
+
+CENT = Decimal('0.01')
+
+# postgres SQLSTATEs for serialization failure and deadlock. both mean "run the whole transaction again".
+RETRYABLE_SQLSTATES = ('40001', '40P01')
+TRANSFER_ATTEMPTS = 5
+TRANSFER_RETRY_DELAY = 0.01  # seconds, doubled after every attempt
+
+
+class InsufficientBalance(ValueError):
+    pass
+
+
+class AccountNotFound(ValueError):
+    pass
+
+
+class LoanLimitReached(ValueError):
+    pass
+
+
+FailedLoan = namedtuple('FailedLoan', 'loan_id reason')
+
+
+def can_update_returning():
+    # postgres and sqlite >= 3.35 understand UPDATE ... RETURNING (and UPDATE ... FROM). sqlite reports the same version check through can_return_columns_from_insert.
+    return connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert
+
+
+def change_balance(account_id, delta, minimum_balance=None):
+    """
+    Add ``delta`` to the account balance with a single conditional UPDATE and
+    return the new balance.
+
+    When ``minimum_balance`` is given the row is only updated if at least that
+    much is left afterwards, otherwise ``InsufficientBalance`` is raised. A
+    credit to an account that doesn't exist (anymore) raises
+    ``AccountNotFound``. The database does the arithmetic, so concurrent
+    postings can't lose updates.
+    """
+    delta = Decimal(delta)
+    threshold = None
+    if minimum_balance is not None:
+        # balance + delta >= minimum_balance  <=>  balance >= minimum_balance - delta
+        threshold = Decimal(minimum_balance) - delta
+
+    if can_update_returning():
+        quote_name = connection.ops.quote_name
+        sql = 'UPDATE {table} SET {balance} = {balance} + %s WHERE {pk} = %s'.format(
+            table=quote_name(UserBankAccount._meta.db_table),
+            balance=quote_name('balance'),
+            pk=quote_name(UserBankAccount._meta.pk.column),
+        )
+        params = [delta, account_id]
+        if threshold is not None:
+            sql += ' AND {balance} >= %s'.format(balance=quote_name('balance'))
+            params.append(threshold)
+        sql += ' RETURNING {balance}'.format(balance=quote_name('balance'))
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            raise balance_error(threshold)
+        # sqlite hands the value back as a float, so normalise it to the field's two decimal places.
+        return Decimal(str(row[0])).quantize(CENT)
+
+    # other backends: same conditional update, then read the row we just locked.
+    accounts = UserBankAccount.objects.filter(pk=account_id)
+    if threshold is not None:
+        accounts = accounts.filter(balance__gte=threshold)
+    with transaction.atomic():
+        if not accounts.update(balance=F('balance') + delta):
+            raise balance_error(threshold)
+        balance = UserBankAccount.objects.filter(
+            pk=account_id).values_list('balance', flat=True).get()
+    return Decimal(balance).quantize(CENT)
+
+
+def balance_error(threshold):
+    # the conditional UPDATE matched no row. without a threshold that can only mean the row is gone.
+    if threshold is None:
+        return AccountNotFound("Account doesn't exist.")
+    return InsufficientBalance('Insufficient account balance.')
+
+
+def credit_accounts(amounts):
+    """
+    Add ``amounts[account_id]`` to each account with one set-based UPDATE and
+    return ``{account_id: new balance}``. Must run inside an atomic block.
+    """
+    if connection.features.has_select_for_update:
+        # same lock order as transfer(), so a bulk credit and a transfer can't deadlock each other.
+        list(UserBankAccount.objects.select_for_update().filter(
+            pk__in=list(amounts)).order_by('account_no').values_list('pk', flat=True))
+
+    if can_update_returning():
+        # UPDATE ... FROM (VALUES ...) RETURNING joins the amounts in the database. building the same thing with Case/When costs seconds of python per thousand accounts.
+        quote_name = connection.ops.quote_name
+        table = quote_name(UserBankAccount._meta.db_table)
+        balance = quote_name('balance')
+        pk = quote_name(UserBankAccount._meta.pk.column)
+        sql = (
+            f'UPDATE {table} SET {balance} = {table}.{balance} + amounts.column2 '
+            f'FROM (VALUES {", ".join(["(%s, %s)"] * len(amounts))}) AS amounts '
+            f'WHERE {table}.{pk} = amounts.column1 RETURNING {table}.{pk}, {table}.{balance}'
+        )
+        params = [value for item in amounts.items() for value in item]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        return {account_id: Decimal(str(value)).quantize(CENT) for account_id, value in rows}
+
+    balance_field = DecimalField(max_digits=12, decimal_places=2)
+    UserBankAccount.objects.filter(pk__in=list(amounts)).update(balance=Case(
+        *[When(pk=pk, then=F('balance') + Value(amount, output_field=balance_field))
+          for pk, amount in amounts.items()],
+        output_field=balance_field,
+    ))
+    return {
+        pk: Decimal(balance).quantize(CENT)
+        for pk, balance in UserBankAccount.objects.filter(pk__in=list(amounts)).values_list('pk', 'balance')
+    }
+
+
+def post_transaction(txn, minimum_balance=None):
+    """
+    Apply an unsaved ``Transaction`` to its account and insert it, both in one
+    atomic block. ``balance_after_transaction`` is taken from the UPDATE itself.
+    """
+    if minimum_balance is None and txn.transaction_type in DEBIT_TRANSACTION_TYPES:
+        minimum_balance = 0
+
+    with transaction.atomic():
+        balance = change_balance(
+            txn.account_id, signed_amount(txn.transaction_type, txn.amount), minimum_balance)
+        txn.balance_after_transaction = balance
+        txn.save(force_insert=True)
+        record_postings([(txn.account_id, txn.transaction_type, txn.amount, balance)])
+
+    # keep the in-memory account (usually request.user.account) in sync for messages and emails.
+    txn.account.balance = balance
+    return txn
+
+
+def adjust_loan_counters(account_id, open_loans=0, outstanding=0):
+    UserBankAccount.objects.filter(pk=account_id).update(
+        open_loans=F('open_loans') + open_loans,
+        outstanding_loan_amount=F('outstanding_loan_amount') + outstanding,
+    )
+
+
+def request_loan(loan):
+    """
+    Insert an unsaved pending loan, unless the account already has
+    ``MAX_OPEN_LOANS`` loans that aren't repaid (``LoanLimitReached``).
+    """
+    with transaction.atomic():
+        # the limit check and the increment are one conditional UPDATE, so two requests at the same time can't both take the last slot.
+        opened = UserBankAccount.objects.filter(
+            pk=loan.account_id, open_loans__lt=MAX_OPEN_LOANS).update(open_loans=F('open_loans') + 1)
+        if not opened:
+            raise LoanLimitReached(
+                'You have reached the maximum limit of loan request')
+        loan.transaction_type = 'Loan'
+        loan.loan_approved = False
+        loan.balance_after_transaction = loan.account.balance
+        loan.save(force_insert=True)
+
+    loan.account.open_loans += 1
+    return loan
+
+
+def approve_loan(loan):
+    """
+    Approve a pending loan and credit its amount. Returns False if the loan was
+    already approved (for example by another admin at the same time).
+    """
+    approved_at = timezone.now()
+    with transaction.atomic():
+        approved = Transaction.objects.filter(
+            pk=loan.pk, transaction_type='Loan', loan_approved=False).update(loan_approved=True, approved_at=approved_at)
+        if not approved:
+            return False
+        balance = change_balance(loan.account_id, loan.amount)
+        Transaction.objects.filter(pk=loan.pk).update(
+            balance_after_transaction=balance)
+        adjust_loan_counters(loan.account_id, outstanding=loan.amount)
+        # the loan is credited today, whenever it was requested.
+        record_postings([(loan.account_id, 'Loan', loan.amount, balance)],
+                        day=timezone.localdate(approved_at))
+
+    loan.loan_approved = True
+    loan.approved_at = approved_at
+    loan.balance_after_transaction = balance
+    loan.account.balance = balance
+    return True
+
+
+def approve_loans(loan_ids):
+    """
+    Approve many pending loans in one transaction: the loans are flipped with one
+    conditional UPDATE, each account is credited once with the sum of its loans
+    and the rollups and loan counters are written in batches.
+
+    Returns ``(approved, failed)``: the approved loans (with ``account.user``
+    loaded, ``account.balance`` is the balance after that loan) and a
+    ``FailedLoan`` for every id that couldn't be approved.
+    """
+    loan_ids = set(loan_ids)
+    if not loan_ids:
+        return [], []
+
+    approved_at = timezone.now()
+    with transaction.atomic():
+        flipped = flip_pending_loans(loan_ids, approved_at)
+
+        amounts = defaultdict(Decimal)
+        for _, account_id, amount in flipped:
+            amounts[account_id] += amount
+        balances = credit_accounts(amounts) if amounts else {}
+
+        failed = []
+        # an account deleted since the loan was selected can't be credited, so those loans go back to pending.
+        orphans = [loan_id for loan_id, account_id,
+                   _ in flipped if account_id not in balances]
+        if orphans:
+            Transaction.objects.filter(
+                pk__in=orphans).update(loan_approved=False, approved_at=None)
+            failed += [FailedLoan(loan_id, "Account doesn't exist")
+                       for loan_id in orphans]
+        flipped = [row for row in flipped if row[1] in balances]
+
+        # several loans of one account: each one's balance_after_transaction is the final balance minus the loans approved after it.
+        flipped.sort()
+        running = {account_id: balances[account_id] - total for account_id, total in amounts.items()
+                   if account_id in balances}
+        postings = []
+        for loan_id, account_id, amount in flipped:
+            running[account_id] += amount
+            postings.append((account_id, 'Loan', amount, running[account_id]))
+        set_balances_after(
+            [(posting[3], loan_id) for posting, (loan_id, _, _) in zip(postings, flipped)])
+        record_postings(postings, day=timezone.localdate(approved_at))
+        add_outstanding_loans(
+            {account_id: amounts[account_id] for account_id in running})
+
+        approved = list(Transaction.objects.select_related(
+            'account__user').filter(pk__in=[row[0] for row in flipped]).order_by('pk'))
+        for loan in approved:
+            loan.account.balance = loan.balance_after_transaction
+
+        # whatever is left was not a pending loan when the UPDATE got to it.
+        left = loan_ids - {row[0] for row in flipped} - set(orphans)
+        types = dict(Transaction.objects.filter(
+            pk__in=left).values_list('pk', 'transaction_type'))
+        for loan_id in left:
+            if loan_id not in types:
+                failed.append(FailedLoan(loan_id, "Loan doesn't exist"))
+            elif types[loan_id] != 'Loan':
+                failed.append(FailedLoan(loan_id, 'Not a loan'))
+            else:
+                failed.append(FailedLoan(loan_id, 'Already approved'))
+
+    return approved, sorted(failed)
+
+
+def flip_pending_loans(loan_ids, approved_at):
+    # sets loan_approved and approved_at on the pending loans among loan_ids and returns their (id, account_id, amount).
+    if can_update_returning():
+        quote_name = connection.ops.quote_name
+        table = quote_name(Transaction._meta.db_table)
+        sql = (
+            f'UPDATE {table} SET {quote_name("loan_approved")} = %s, {quote_name("approved_at")} = %s '
+            f'WHERE {quote_name("id")} IN ({", ".join(["%s"] * len(loan_ids))}) '
+            f'AND {quote_name("transaction_type")} = %s AND {quote_name("loan_approved")} = %s '
+            f'RETURNING {quote_name("id")}, {quote_name("account_id")}, {quote_name("amount")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [True, connection.ops.adapt_datetimefield_value(approved_at), *loan_ids, 'Loan', False])
+            rows = cursor.fetchall()
+        return [(loan_id, account_id, Decimal(str(amount)).quantize(CENT)) for loan_id, account_id, amount in rows]
+
+    pending = Transaction.objects.filter(
+        pk__in=loan_ids, transaction_type='Loan', loan_approved=False)
+    rows = list(pending.select_for_update().values_list(
+        'pk', 'account_id', 'amount'))
+    Transaction.objects.filter(
+        pk__in=[row[0] for row in rows]).update(loan_approved=True, approved_at=approved_at)
+    return rows
+
+
+def set_balances_after(rows):
+    # rows of (balance_after_transaction, transaction id), written with one executemany like rollups.update_rows.
+    quote_name = connection.ops.quote_name
+    sql = 'UPDATE {table} SET {balance} = %s WHERE {pk} = %s'.format(
+        table=quote_name(Transaction._meta.db_table),
+        balance=quote_name('balance_after_transaction'),
+        pk=quote_name(Transaction._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def add_outstanding_loans(amounts):
+    quote_name = connection.ops.quote_name
+    sql = 'UPDATE {table} SET {outstanding} = {outstanding} + %s WHERE {pk} = %s'.format(
+        table=quote_name(UserBankAccount._meta.db_table),
+        outstanding=quote_name('outstanding_loan_amount'),
+        pk=quote_name(UserBankAccount._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(amount, account_id)
+                           for account_id, amount in amounts.items()])
+
+
+def repay_loan(loan):
+    """
+    Mark an approved loan as repaid and post the matching Repayment. Returns the
+    Repayment transaction, or None if the loan is not open for repayment.
+    """
+    with transaction.atomic():
+        # the flag flips only once, so two clicks on "Pay" can't repay the same loan twice.
+        repaid = Transaction.objects.filter(
+            pk=loan.pk, loan_approved=True, loan_repayment=False).update(loan_repayment=True)
+        if not repaid:
+            return None
+        repayment = post_transaction(Transaction(
+            account=loan.account,
+            amount=loan.amount,
+            transaction_type='Repayment'
+        ))
+        adjust_loan_counters(
+            loan.account_id, open_loans=-1, outstanding=-loan.amount)
+
+    loan.loan_repayment = True
+    return repayment
+
+
+def rebuild_loan_counters(account_ids=None):
+    """
+    Recount ``open_loans`` and ``outstanding_loan_amount`` from the ledger and
+    fix the accounts where they drifted (e.g. a loan deleted in the admin).
+    Returns the number of accounts that were updated.
+    """
+    open_loans = Transaction.objects.filter(
+        account=OuterRef('pk'), transaction_type='Loan', loan_repayment=False).order_by().values('account')
+    counters = {
+        'open_loans': Coalesce(Subquery(open_loans.annotate(
+            count=Count('pk')).values('count')), 0),
+        # rounded, because sqlite sums decimals as floats and 0.1 + 0.2 wouldn't equal a stored 0.3.
+        'outstanding_loan_amount': Coalesce(
+            Subquery(open_loans.filter(loan_approved=True).annotate(
+                total=Round(Sum('amount'), 2)).values('total')),
+            Value(Decimal(0)), output_field=DecimalField(max_digits=12, decimal_places=2)),
+    }
+
+    accounts = UserBankAccount.objects.all()
+    if account_ids is not None:
+        accounts = accounts.filter(pk__in=account_ids)
+    drifted = list(accounts.annotate(
+        expected_open_loans=counters['open_loans'],
+        expected_outstanding=counters['outstanding_loan_amount'],
+    ).exclude(
+        open_loans=F('expected_open_loans'), outstanding_loan_amount=F('expected_outstanding'),
+    ).values_list('pk', flat=True))
+
+    if drifted:
+        # recomputed in the UPDATE itself, so postings between the two queries aren't overwritten with stale numbers.
+        UserBankAccount.objects.filter(pk__in=drifted).update(**counters)
+    return len(drifted)
+
+
+def is_retryable(error):
+    cause = error.__cause__
+    sqlstate = getattr(cause, 'pgcode', None) or getattr(
+        getattr(cause, 'diag', None), 'sqlstate', None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    # sqlite reports a busy writer as "database is locked", mysql as "Deadlock found".
+    message = str(error).lower()
+    return 'database is locked' in message or 'deadlock' in message
+
+
+def transfer(sender, receiver, amount, on_posted=None):
+    """
+    Move ``amount`` from ``sender`` to ``receiver`` and insert the Transfer and
+    Receive rows, all in one database transaction.
+
+    Both account rows are locked in account_no order, so two transfers crossing
+    between the same accounts queue up instead of deadlocking. Serialization
+    failures and deadlocks are retried with backoff. ``on_posted`` is called
+    inside the transaction (e.g. to queue the notification emails). Returns the
+    ``(transfer, receive)`` transactions.
+    """
+    # a retry has to restart the whole transaction, which isn't possible from inside someone else's atomic block.
+    attempts = 1 if connection.in_atomic_block else TRANSFER_ATTEMPTS
+
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                # lock both rows in a fixed order. the conditional updates below do the actual balance checks.
+                # sqlite has no row locks (the whole database is locked by the first write), and a read here would only make it fail with "database is locked" when upgrading to a write.
+                if connection.features.has_select_for_update:
+                    list(UserBankAccount.objects.select_for_update().filter(
+                        pk__in=[sender.pk, receiver.pk]).order_by('account_no').values_list('pk', flat=True))
+
+                sender_balance = change_balance(
+                    sender.pk, -amount, minimum_balance=0)
+                receiver_balance = change_balance(receiver.pk, amount)
+
+                sent, received = Transaction.objects.bulk_create([
+                    Transaction(account=sender, amount=amount,
+                                balance_after_transaction=sender_balance, transaction_type='Transfer'),
+                    Transaction(account=receiver, amount=amount,
+                                balance_after_transaction=receiver_balance, transaction_type='Receive'),
+                ])
+                record_postings([
+                    (sender.pk, 'Transfer', amount, sender_balance),
+                    (receiver.pk, 'Receive', amount, receiver_balance),
+                ])
+                sender.balance = sender_balance
+                receiver.balance = receiver_balance
+
+                if on_posted is not None:
+                    on_posted(sent, received)
+            return sent, received
+        except OperationalError as error:
+            if attempt == attempts - 1 or not is_retryable(error):
+                raise
+            time.sleep(TRANSFER_RETRY_DELAY * 2 ** attempt *
+                       (1 + random.random()))
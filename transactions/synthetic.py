@@ -0,0 +1,246 @@
+import io
+import math
+import random
+import time
+from datetime import date, timedelta
+from decimal import ROUND_DOWN, Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, models, router, transaction
+
+from accounts.models import UserBankAccount
+from django_bank.constants import ACCOUNT_NO_START, GENDER_TYPE, MAX_OPEN_LOANS
+from .models import DailyBalance, Transaction
+from .rollups import TOTAL_FIELDS, fold_postings, signed_amount
+
+# synthetic customers and ledgers for benchmarks, see the generate_ledger command. this module is imported by the pool workers after django.setup().
+
+CENT = Decimal('0.01')
+MAX_AMOUNT = 1000000
+# median amount of each kind of posting. amounts are log-normal around it, so there is a long tail of big ones.
+MEDIAN_AMOUNTS = {'Deposit': 500, 'Withdraw': 200, 'Transfer': 150}
+# loans requested in the last days are still waiting for approval, older ones were approved right away.
+PENDING_LOAN_DAYS = 7
+
+TRANSACTION_FIELDS = ['account', 'amount', 'balance_after_transaction', 'transaction_type',
+                      'timestamp', 'loan_approved', 'loan_repayment', 'approved_at', 'reference']
+DAILY_BALANCE_FIELDS = ['account_id', 'date', 'opening_balance', 'closing_balance', *TOTAL_FIELDS.values()]
+ACCOUNT_FIELDS = ['user', 'account_type', 'account_no', 'birth_date', 'gender', 'balance',
+                  'initial_deposit_date', 'open_loans', 'outstanding_loan_amount']
+
+
+class SimulatedAccount:
+    def __init__(self, account_type, opened):
+        self.account_type = account_type
+        self.opened = opened
+        self.balance = Decimal(0)
+        # ledger rows of the loans that aren't repaid yet, oldest first.
+        self.loans = []
+
+
+def draw_amount(rng, median):
+    return Decimal(min(max(rng.lognormvariate(math.log(median), 1.0), 1), MAX_AMOUNT)).quantize(CENT)
+
+
+def share_of(balance, share):
+    return (balance * Decimal(share)).quantize(CENT, rounding=ROUND_DOWN)
+
+
+def activity(rng, mean, skew):
+    # pareto: most accounts only post a few times, a few post hundreds of times. the closer skew is to 1, the longer the tail.
+    scale = mean * (skew - 1) / skew
+    return max(1, min(int(scale * rng.paretovariate(skew)), mean * 100))
+
+
+def simulate(rng, count, spec):
+    """
+    Play the postings of ``count`` accounts in time order. Returns the accounts
+    and the ledger rows ``[account index, timestamp, type, amount,
+    balance_after, loan_approved, loan_repayment]`` in posting order.
+
+    Transfers go to another account of the same chunk, which gets the matching
+    Receive, so money is conserved within the chunk. A debit the account can't
+    afford (or a loan over the limit, a repayment without a loan) is posted as
+    a Deposit instead.
+    """
+    end = spec['end']
+    start = end - timedelta(days=spec['days'])
+    pending_after = end - timedelta(days=PENDING_LOAN_DAYS)
+    account_types, account_weights = zip(*spec['account_types'].items())
+    transaction_types, transaction_weights = zip(*spec['transaction_types'].items())
+
+    accounts = []
+    events = []
+    for index, account_type in enumerate(rng.choices(account_types, account_weights, k=count)):
+        # accounts open during the first half of the period, so every one of them has some history.
+        opened = start + (end - start) * rng.random() / 2
+        accounts.append(SimulatedAccount(account_type, opened))
+        events.append((opened, index, 'Deposit'))
+        postings = activity(rng, spec['transactions_per_account'], spec['skew']) - 1
+        for transaction_type in rng.choices(transaction_types, transaction_weights, k=postings):
+            events.append((opened + (end - opened) * rng.random(), index, transaction_type))
+    events.sort(key=lambda event: event[:2])
+
+    rows = []
+    seen = set()
+    open_accounts = []
+
+    def post(index, timestamp, transaction_type, amount, loan_approved=False):
+        account = accounts[index]
+        account.balance += signed_amount(transaction_type, amount)
+        row = [index, timestamp, transaction_type, amount, account.balance, loan_approved, False]
+        rows.append(row)
+        return row
+
+    def counterpart(index, minimum=Decimal(0)):
+        # another account that is already open (and has more than minimum), or None.
+        for _ in range(3):
+            other = rng.choice(open_accounts)
+            if other != index and accounts[other].balance > minimum:
+                return other
+        return None
+
+    for timestamp, index, transaction_type in events:
+        account = accounts[index]
+        if index not in seen:
+            # the first event of every account is its opening deposit.
+            seen.add(index)
+            open_accounts.append(index)
+
+        if transaction_type == 'Withdraw':
+            amount = min(draw_amount(rng, MEDIAN_AMOUNTS['Withdraw']), share_of(account.balance, 0.5))
+            if amount > 0:
+                post(index, timestamp, 'Withdraw', amount)
+                continue
+        elif transaction_type in ('Transfer', 'Receive'):
+            sender, receiver = index, None
+            if transaction_type == 'Receive':
+                sender, receiver = counterpart(index, minimum=Decimal(1)), index
+            else:
+                receiver = counterpart(index)
+            if sender is not None and receiver is not None:
+                amount = min(draw_amount(rng, MEDIAN_AMOUNTS['Transfer']), share_of(accounts[sender].balance, 0.5))
+                if amount > 0:
+                    post(sender, timestamp, 'Transfer', amount)
+                    post(receiver, timestamp, 'Receive', amount)
+                    continue
+        elif transaction_type == 'Loan':
+            # the loan form allows 10% to 50% of the balance.
+            amount = share_of(account.balance, rng.uniform(0.1, 0.5))
+            if len(account.loans) < MAX_OPEN_LOANS and amount > 0:
+                if timestamp > pending_after:
+                    row = [index, timestamp, 'Loan', amount, account.balance, False, False]
+                    rows.append(row)
+                else:
+                    row = post(index, timestamp, 'Loan', amount, loan_approved=True)
+                account.loans.append(row)
+                continue
+        elif transaction_type == 'Repayment':
+            loan = next((row for row in account.loans if row[5] and row[3] <= account.balance), None)
+            if loan is not None:
+                post(index, timestamp, 'Repayment', loan[3])
+                loan[6] = True
+                account.loans.remove(loan)
+                continue
+        post(index, timestamp, 'Deposit', draw_amount(rng, MEDIAN_AMOUNTS['Deposit']))
+
+    return accounts, rows
+
+
+def copy_value(value):
+    # postgres COPY text format.
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, date):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def insert_rows(model, field_names, rows):
+    """
+    Insert plain value rows into the model's table: with COPY on postgres, one
+    executemany INSERT elsewhere. Unlike bulk_create no model instances are
+    built and auto_now_add fields keep the given values.
+    """
+    # the connection itself rather than the django.db.connection proxy, which costs a lookup per attribute access and there are a few per value.
+    connection = connections[router.db_for_write(model)]
+    fields = [model._meta.get_field(name) for name in field_names]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ', '.join(quote_name(field.column) for field in fields)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            data = ''.join('\t'.join(copy_value(value) for value in row) + '\n' for row in rows)
+            sql = f'COPY {table} ({columns}) FROM STDIN'
+            if hasattr(cursor.cursor, 'copy_expert'):
+                # psycopg2
+                cursor.cursor.copy_expert(sql, io.StringIO(data))
+            else:
+                with cursor.cursor.copy(sql) as copy:
+                    copy.write(data)
+            return
+        # only dates and datetimes need converting (time zones), the drivers take numbers, decimals, strings and booleans as they are.
+        dates = [index for index, field in enumerate(fields) if isinstance(field, models.DateField)]
+        params = []
+        for row in rows:
+            row = list(row)
+            for index in dates:
+                row[index] = fields[index].get_db_prep_save(row[index], connection)
+            params.append(row)
+        cursor.executemany(
+            f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * len(fields))})', params)
+
+
+def generate_chunk(spec, chunk):
+    """
+    Create the customers of chunk number ``chunk`` with their ledgers, daily
+    balances and loan counters, in one transaction. The data only depends on
+    the spec and the chunk number, not on which worker runs it.
+
+    Returns ``(accounts, transactions, generate seconds, insert seconds)``.
+    """
+    started = time.perf_counter()
+    rng = random.Random(spec['seed'] * 1000003 + chunk)
+    first = chunk * spec['chunk_size']
+    count = min(spec['chunk_size'], spec['accounts'] - first)
+    accounts, rows = simulate(rng, count, spec)
+    genders = [value for value, _ in GENDER_TYPE]
+    users = [User(username=f'{spec["prefix"]}{first + i}', email=f'{spec["prefix"]}{first + i}@example.com',
+                  password=make_password(None), date_joined=account.opened)
+             for i, account in enumerate(accounts)]
+    generated = time.perf_counter()
+
+    with transaction.atomic():
+        users = User.objects.bulk_create(users)
+        if users[0].pk is None:
+            ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'pk'))
+            for user in users:
+                user.pk = ids[user.username]
+        insert_rows(UserBankAccount, ACCOUNT_FIELDS, [
+            (user.pk, account.account_type, ACCOUNT_NO_START + user.pk,
+             date(1950, 1, 1) + timedelta(days=rng.randrange(20000)), rng.choice(genders), account.balance,
+             account.opened.date(), len(account.loans), sum((row[3] for row in account.loans if row[5]), Decimal(0)))
+            for user, account in zip(users, accounts)
+        ])
+        account_ids = dict(UserBankAccount.objects.filter(
+            user__in=[user.pk for user in users]).values_list('user_id', 'pk'))
+        account_ids = [account_ids[user.pk] for user in users]
+        insert_rows(Transaction, TRANSACTION_FIELDS, [
+            (account_ids[index], amount, balance_after, transaction_type, timestamp, loan_approved, loan_repayment,
+             timestamp if loan_approved else None, '')
+            for index, timestamp, transaction_type, amount, balance_after, loan_approved, loan_repayment in rows
+        ])
+        # the daily balances come straight from the simulated postings, reading them back with rollups.rebuild would take longer than inserting them.
+        postings = sorted((row for row in rows if row[2] != 'Loan' or row[5]), key=lambda row: row[0])
+        insert_rows(DailyBalance, DAILY_BALANCE_FIELDS, [
+            [getattr(rollup, field) for field in DAILY_BALANCE_FIELDS]
+            for rollup in fold_postings(
+                (account_ids[index], timestamp, transaction_type, amount, balance_after)
+                for index, timestamp, transaction_type, amount, balance_after, _, _ in postings)
+        ])
+
+    return count, len(rows), generated - started, time.perf_counter() - generated
@@ -1,3 +1,1149 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from accounts import directory
+from accounts.models import UserAddress, UserBankAccount
+from core.models import OutboxEmail
+from core.views import AsyncHomePageView
+from core.pagination import CappedCountPaginator
+from django_bank.constants import ACCOUNT_NO_START
+from .models import CSS_CLASSES, PENDING_LOAN_CSS_CLASSES, DailyBalance, LedgerRow, Transaction
+from .rollups import rebuild, signed_amount, summarize
+from .bulk import ingest_credits
+from .pagination import KeysetPaginator
+from .views import AsyncLoanList, AsyncTransactionReport, get_timestamp_range
+from .services import FailedLoan, InsufficientBalance, LoanLimitReached, approve_loan, approve_loans, change_balance, credit_accounts, post_transaction, rebuild_loan_counters, repay_loan, request_loan, transfer
 
 # Create your tests here.
+
+
+def create_account(username, balance=0, account_no=None):
+    user = User.objects.create_user(
+        username=username, password='secret-pass-123', email=f'{username}@example.com')
+    return UserBankAccount.objects.create(
+        user=user,
+        account_no=account_no or 2024000 + user.id,
+        account_type='Saving',
+        gender='Male',
+        balance=Decimal(balance),
+    )
+
+
+class TransactionEmailTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.client.force_login(self.account.user)
+
+    def test_deposit_queues_email_instead_of_sending(self):
+        response = self.client.post(reverse('deposit'), {
+            'amount': '200', 'transaction_type': 'Deposit'})
+
+        self.assertRedirects(response, reverse('transaction-report'))
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, 'alice@example.com')
+        self.assertEqual(email.subject, 'Deposit Confirmation')
+        self.assertEqual(Transaction.objects.filter(
+            account=self.account).count(), 1)
+
+
+class PostingServiceTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+
+    def test_post_deposit_returns_new_balance(self):
+        txn = post_transaction(Transaction(
+            account=self.account, amount=Decimal('250.50'), transaction_type='Deposit'))
+
+        self.assertEqual(txn.balance_after_transaction, Decimal('1250.50'))
+        self.assertEqual(self.account.balance, Decimal('1250.50'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('1250.50'))
+
+    def test_withdraw_respects_minimum_balance(self):
+        with self.assertRaises(InsufficientBalance):
+            post_transaction(Transaction(
+                account=self.account, amount=Decimal('600'), transaction_type='Withdraw'), minimum_balance=500)
+
+        self.assertFalse(Transaction.objects.exists())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('1000'))
+
+    def test_change_balance_without_minimum_allows_credit(self):
+        self.assertEqual(change_balance(
+            self.account.pk, Decimal('0.10')), Decimal('1000.10'))
+
+    def test_loan_is_approved_and_repaid_once(self):
+        loan = request_loan(Transaction(account=self.account, amount=Decimal('300')))
+
+        self.assertTrue(approve_loan(loan))
+        self.assertFalse(approve_loan(loan))
+        self.assertEqual(loan.balance_after_transaction, Decimal('1300'))
+
+        repayment = repay_loan(loan)
+        self.assertEqual(repayment.balance_after_transaction, Decimal('1000'))
+        self.assertIsNone(repay_loan(loan))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('1000'))
+
+
+class LoanCounterTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+
+    def assertCounters(self, open_loans, outstanding):
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.open_loans, self.account.outstanding_loan_amount),
+                         (open_loans, Decimal(outstanding)))
+
+    def test_counters_follow_the_loan(self):
+        loan = request_loan(Transaction(account=self.account, amount=Decimal('300')))
+        self.assertCounters(1, 0)
+        approve_loan(loan)
+        self.assertCounters(1, 300)
+        repay_loan(loan)
+        self.assertCounters(0, 0)
+
+    def test_limit_is_enforced_by_the_counter(self):
+        self.client.force_login(self.account.user)
+        for _ in range(3):
+            self.client.post(reverse('loan-request'), {'amount': '100', 'transaction_type': 'Loan'})
+
+        response = self.client.post(reverse('loan-request'), {'amount': '100', 'transaction_type': 'Loan'})
+
+        self.assertContains(response, 'maximum limit of loan request')
+        self.assertEqual(Transaction.objects.filter(transaction_type='Loan').count(), 3)
+        with self.assertRaises(LoanLimitReached):
+            request_loan(Transaction(account=self.account, amount=Decimal('100')))
+        self.assertCounters(3, 0)
+
+    def test_rebuild_fixes_drifted_counters(self):
+        approve_loan(request_loan(Transaction(account=self.account, amount=Decimal('300'))))
+        request_loan(Transaction(account=self.account, amount=Decimal('50')))
+        UserBankAccount.objects.update(open_loans=0, outstanding_loan_amount=0)
+
+        self.assertEqual(rebuild_loan_counters(), 1)
+        self.assertCounters(2, 300)
+        self.assertEqual(rebuild_loan_counters(), 0)
+
+
+class TransactionAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'secret-pass-123'))
+        self.url = reverse('admin:transactions_transaction_changelist')
+
+    def add_transactions(self, count):
+        for i in range(count):
+            account = create_account(f'user{Transaction.objects.count()}', balance=1000)
+            post_transaction(Transaction(account=account, amount=Decimal('10'), transaction_type='Deposit'))
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_transactions(2)
+        few = self.count_queries(self.url)
+        self.add_transactions(10)
+        self.assertEqual(self.count_queries(self.url), few)
+        self.assertEqual(self.count_queries(self.url + '?transaction_type__exact=Deposit'), few)
+
+    def test_search_by_account_number_or_username(self):
+        self.add_transactions(3)
+        account = UserBankAccount.objects.get(user__username='user1')
+
+        response = self.client.get(self.url, {'q': str(account.account_no)})
+        self.assertEqual([t.account for t in response.context['cl'].result_list], [account])
+        response = self.client.get(self.url, {'q': 'user'})
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+        response = self.client.get(self.url, {'q': 'nobody'})
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_add_form_does_not_load_every_account(self):
+        self.add_transactions(2)
+        # the first admin form fills the content type cache.
+        self.count_queries(reverse('admin:transactions_transaction_add'))
+        few = self.count_queries(reverse('admin:transactions_transaction_add'))
+        self.add_transactions(10)
+        self.assertEqual(self.count_queries(reverse('admin:transactions_transaction_add')), few)
+        # the transaction itself, its account for the title and the selected account for the widget.
+        txn = Transaction.objects.first()
+        self.assertEqual(self.count_queries(reverse('admin:transactions_transaction_change', args=[txn.pk])), few + 3)
+
+    def test_account_autocomplete(self):
+        self.add_transactions(12)
+        account = UserBankAccount.objects.get(user__username='user3')
+        url = reverse('admin:autocomplete')
+        params = {'app_label': 'transactions', 'model_name': 'transaction', 'field_name': 'account'}
+
+        results = self.client.get(url, {**params, 'term': str(account.account_no)}).json()['results']
+        self.assertEqual(results, [{'id': str(account.pk), 'text': str(account)}])
+        with self.assertNumQueries(4):
+            page = self.client.get(url, {**params, 'term': 'user1'}).json()
+        self.assertEqual(len(page['results']), 3)
+        self.assertFalse(page['pagination']['more'])
+
+    def test_approved_loan_flags_are_read_only(self):
+        account = create_account('alice', balance=1000)
+        loan = request_loan(Transaction(account=account, amount=Decimal('300')))
+        change_url = reverse('admin:transactions_transaction_change', args=[loan.pk])
+        self.assertIn('loan_approved', self.client.get(change_url).context['adminform'].form.fields)
+
+        # repaying is done by the customer, repay_loan posts the Repayment.
+        self.assertNotIn('loan_repayment', self.client.get(change_url).context['adminform'].form.fields)
+        self.assertNotIn('loan_repayment', self.client.get(
+            reverse('admin:transactions_transaction_add')).context['adminform'].form.fields)
+
+        approve_loan(loan)
+        fields = self.client.get(change_url).context['adminform'].form.fields
+        self.assertNotIn('loan_approved', fields)
+
+    def test_posted_transaction_fields_are_read_only(self):
+        self.add_transactions(1)
+        txn = Transaction.objects.get()
+
+        fields = self.client.get(reverse('admin:transactions_transaction_change', args=[txn.pk])).context['adminform'].form.fields
+
+        for name in ('account', 'amount', 'transaction_type', 'balance_after_transaction', 'approved_at'):
+            self.assertNotIn(name, fields)
+
+    def test_rejected_postings_are_reported(self):
+        account = create_account('alice', balance=100)
+        add_url = reverse('admin:transactions_transaction_add')
+        data = {'account': account.pk, 'amount': '150', 'transaction_type': 'Withdraw', 'reference': ''}
+
+        response = self.client.post(add_url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Insufficient account balance. The balance is $100.00',
+                      response.context['adminform'].form.non_field_errors())
+
+        # the balance checked by the form was spent before the save.
+        data['amount'] = '50'
+        with mock.patch('transactions.admin.post_transaction', side_effect=InsufficientBalance('Insufficient account balance.')):
+            response = self.client.post(add_url, data, follow=True)
+        self.assertRedirects(response, add_url)
+        self.assertContains(response, 'Insufficient account balance.')
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_count_is_capped(self):
+        self.add_transactions(3)
+        paginator = CappedCountPaginator(Transaction.objects.all(), 2)
+        paginator.max_count = 2
+
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+
+class BulkLoanApprovalTests(TestCase):
+    def setUp(self):
+        self.alice = create_account('alice', balance=1000)
+        self.bob = create_account('bob', balance=0)
+        self.loans = [
+            request_loan(Transaction(account=self.alice, amount=Decimal('100'))),
+            request_loan(Transaction(account=self.bob, amount=Decimal('50'))),
+            request_loan(Transaction(account=self.alice, amount=Decimal('200'))),
+        ]
+
+    def test_approve_loans(self):
+        approve_loan(self.loans[1])
+        deposit = post_transaction(Transaction(
+            account=self.bob, amount=Decimal('10'), transaction_type='Deposit'))
+
+        approved, failed = approve_loans(
+            [loan.pk for loan in self.loans] + [deposit.pk, 999])
+
+        self.assertEqual([(loan.pk, loan.balance_after_transaction) for loan in approved],
+                         [(self.loans[0].pk, Decimal('1100')), (self.loans[2].pk, Decimal('1300'))])
+        self.assertEqual(failed, sorted([
+            FailedLoan(self.loans[1].pk, 'Already approved'),
+            FailedLoan(deposit.pk, 'Not a loan'),
+            FailedLoan(999, "Loan doesn't exist"),
+        ]))
+        self.alice.refresh_from_db()
+        self.assertEqual((self.alice.balance, self.alice.outstanding_loan_amount),
+                         (Decimal('1300'), Decimal('300')))
+        self.assertEqual(DailyBalance.objects.get(account=self.alice).loan_total, Decimal('300'))
+
+    def test_admin_action_queues_one_email_per_loan(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123')
+        self.client.force_login(admin_user)
+
+        response = self.client.post(reverse('admin:transactions_transaction_changelist'), {
+            'action': 'approve_selected_loans',
+            '_selected_action': [loan.pk for loan in self.loans],
+        }, follow=True)
+
+        self.assertContains(response, 'Approved 3 loan(s).')
+        self.assertEqual(Transaction.objects.filter(loan_approved=True).count(), 3)
+        self.assertEqual(sorted(OutboxEmail.objects.filter(subject='Loan Approval').values_list('to', flat=True)),
+                         ['alice@example.com', 'alice@example.com', 'bob@example.com'])
+
+
+class WithdrawViewTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.client.force_login(self.account.user)
+
+    def test_stale_balance_cannot_overdraw(self):
+        # another request took money out after this user's account was loaded.
+        change_balance(self.account.pk, Decimal('-300'))
+
+        response = self.client.post(reverse('withdraw'), {
+            'amount': '400', 'transaction_type': 'Withdraw'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Transaction.objects.exists())
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('700'))
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        # ids are reused after a test's rollback, so an account number could still be cached with another test's user.
+        cache.clear()
+        self.sender = create_account('alice', balance=1000)
+        self.receiver = create_account('bob', balance=200)
+
+    def test_transfer_posts_both_legs(self):
+        sent, received = transfer(self.sender, self.receiver, Decimal('300'))
+
+        self.assertEqual(sent.transaction_type, 'Transfer')
+        self.assertEqual(sent.balance_after_transaction, Decimal('700'))
+        self.assertEqual(received.transaction_type, 'Receive')
+        self.assertEqual(received.balance_after_transaction, Decimal('500'))
+
+    def test_failed_transfer_leaves_nothing_behind(self):
+        with self.assertRaises(InsufficientBalance):
+            transfer(self.sender, self.receiver, Decimal('1000.01'))
+
+        self.assertFalse(Transaction.objects.exists())
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.balance, Decimal('200'))
+
+    def test_transfer_view(self):
+        self.client.force_login(self.sender.user)
+
+        response = self.client.post(reverse('transfer'), {
+            'amount': '100', 'transaction_type': 'Transfer', 'receiver_account_no': self.receiver.account_no})
+
+        self.assertRedirects(response, reverse('transaction-report'))
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.balance, Decimal('300'))
+
+    def test_second_transfer_to_a_payee_skips_the_lookup(self):
+        self.client.force_login(self.sender.user)
+        data = {'amount': '100', 'transaction_type': 'Transfer', 'receiver_account_no': self.receiver.account_no}
+        with CaptureQueriesContext(connection) as first:
+            self.client.post(reverse('transfer'), data)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.post(reverse('transfer'), data)
+
+        # before assertRedirects: fetching the redirect target resets the query log both captures read from.
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertRedirects(response, reverse('transaction-report'))
+        email = OutboxEmail.objects.filter(to='bob@example.com').last()
+        self.assertIn('Your new balance is <strong>$400.00</strong>', email.html_body)
+
+    def test_receiver_deleted_behind_the_directory(self):
+        self.client.force_login(self.sender.user)
+        entry = directory.lookup(self.receiver.account_no)
+        self.receiver.delete()
+        # deleted by another process: this one's cache still has the entry.
+        cache.set(directory.cache_key(self.receiver.account_no), entry)
+
+        response = self.client.post(reverse('transfer'), {
+            'amount': '100', 'transaction_type': 'Transfer', 'receiver_account_no': self.receiver.account_no})
+
+        self.assertFormError(response.context['form'], 'receiver_account_no', "Account doesn't Exist!")
+        self.assertFalse(Transaction.objects.exists())
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal('1000'))
+        self.assertIsNone(cache.get(directory.cache_key(self.receiver.account_no)))
+
+
+class DateRangeTests(TestCase):
+    def test_end_date_is_inclusive(self):
+        start, end = get_timestamp_range(
+            {'start_date': '2024-02-01', 'end_date': '2024-02-29'})
+
+        self.assertEqual(start.date(), date(2024, 2, 1))
+        self.assertEqual(end.date(), date(2024, 3, 1))
+        self.assertEqual((start.hour, end.hour), (0, 0))
+
+    def test_missing_or_bad_dates_are_ignored(self):
+        self.assertIsNone(get_timestamp_range({'start_date': '2024-02-01'}))
+        self.assertIsNone(get_timestamp_range(
+            {'start_date': '2024-02-01', 'end_date': 'yesterday'}))
+
+    def test_report_filters_by_date(self):
+        account = create_account('alice', balance=1000)
+        txn = post_transaction(Transaction(
+            account=account, amount=Decimal('100'), transaction_type='Deposit'))
+        self.client.force_login(account.user)
+        today = txn.timestamp.date().isoformat()
+
+        response = self.client.get(reverse('transaction-report'), {
+            'start_date': today, 'end_date': today})
+        self.assertEqual([row.pk for row in response.context['transactions']], [txn.pk])
+
+        response = self.client.get(reverse('transaction-report'), {
+            'start_date': '2000-01-01', 'end_date': '2000-01-02'})
+        self.assertEqual(list(response.context['transactions']), [])
+
+
+class ReportFragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.account = create_account('alice', balance=1000)
+        self.client.force_login(self.account.user)
+
+    def test_rows_are_cached_per_page(self):
+        post_transaction(Transaction(
+            account=self.account, amount=Decimal('1234.5'), transaction_type='Deposit'))
+
+        response = self.client.get(reverse('transaction-report'))
+
+        key = make_template_fragment_key(
+            'transaction_report_rows', [self.account.pk, response.context['rows_key']])
+        self.assertIn('$1,234.50', cache.get(key))
+
+    def test_approval_renders_the_loan_again(self):
+        loan = request_loan(Transaction(
+            account=self.account, amount=Decimal('200'), transaction_type='Loan'))
+        self.assertContains(self.client.get(reverse('transaction-report')), PENDING_LOAN_CSS_CLASSES)
+
+        approve_loan(loan)
+
+        response = self.client.get(reverse('transaction-report'))
+        self.assertNotContains(response, PENDING_LOAN_CSS_CLASSES)
+        self.assertContains(response, CSS_CLASSES['Loan'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.client.force_login(self.account.user)
+
+    def revalidate(self, name):
+        etag = self.client.get(reverse(name))['ETag']
+        return etag, self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_report_is_not_modified(self):
+        post_transaction(Transaction(
+            account=self.account, amount=Decimal('100'), transaction_type='Deposit'))
+
+        etag, response = self.revalidate('transaction-report')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_posting_changes_the_etag(self):
+        etag = self.client.get(reverse('transaction-report'))['ETag']
+        post_transaction(Transaction(
+            account=self.account, amount=Decimal('100'), transaction_type='Deposit'))
+
+        response = self.client.get(reverse('transaction-report'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_loan_approval_changes_the_loan_list(self):
+        loan = request_loan(Transaction(
+            account=self.account, amount=Decimal('200'), transaction_type='Loan'))
+        etag, response = self.revalidate('loan-list')
+        self.assertEqual(response.status_code, 304)
+
+        approve_loan(loan)
+
+        response = self.client.get(reverse('loan-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_csrf_cookie_renders_the_page(self):
+        etag = self.client.get(reverse('transaction-report'))['ETag']
+        # what the browser has after logging in again.
+        self.client.cookies['csrftoken'] = 'a' * 32
+
+        response = self.client.get(reverse('transaction-report'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_with_a_message_is_rendered(self):
+        loan = request_loan(Transaction(
+            account=self.account, amount=Decimal('200'), transaction_type='Loan'))
+        etag = self.client.get(reverse('loan-list'))['ETag']
+        # the loan isn't approved, so this only queues an error message and redirects to the loan list.
+        self.client.get(reverse('loan-repayment', args=[loan.pk]))
+
+        response = self.client.get(reverse('loan-list'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+# the async views next to the site's own urls, whichever ASYNC_VIEWS picked there. see AsyncViewTests.
+urlpatterns = [
+    path('async/', AsyncHomePageView.as_view(), name='async-home'),
+    path('async/transaction-report/', AsyncTransactionReport.as_view(), name='async-transaction-report'),
+    path('async/loan-list/', AsyncLoanList.as_view(), name='async-loan-list'),
+    path('', include('django_bank.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='transactions.tests')
+class AsyncViewTests(TestCase):
+    # through the async client, so a query the views make outside the async ORM fails with SynchronousOnlyOperation.
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.deposit = post_transaction(Transaction(
+            account=self.account, amount=Decimal('250'), transaction_type='Deposit'))
+        self.loan = request_loan(Transaction(
+            account=self.account, amount=Decimal('200'), transaction_type='Loan'))
+        self.async_client.force_login(self.account.user)
+
+    async def test_report(self):
+        today = timezone.localdate().isoformat()
+
+        response = await self.async_client.get(reverse('async-transaction-report'), {
+            'start_date': today, 'end_date': today, 'page_size': 1})
+
+        self.assertEqual([row.pk for row in response.context['transactions']], [self.loan.pk])
+        self.assertEqual(response.context['summary']['closing_balance'], Decimal('1250'))
+        response = await self.async_client.get(
+            reverse('async-transaction-report') + '?' + response.context['older_query'])
+        self.assertEqual([row.pk for row in response.context['transactions']], [self.deposit.pk])
+
+    async def test_report_revalidates(self):
+        etag = (await self.async_client.get(reverse('async-transaction-report')))['ETag']
+
+        response = await self.async_client.get(reverse('async-transaction-report'), headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('private', response['Cache-Control'])
+
+    async def test_loan_list(self):
+        response = await self.async_client.get(reverse('async-loan-list'))
+
+        self.assertEqual([row.pk for row in response.context['loans']], [self.loan.pk])
+        self.assertContains(response, 'Loan Pending')
+
+    async def test_home_shows_the_balance(self):
+        response = await self.async_client.get(reverse('async-home'))
+
+        self.assertContains(response, '$1,250.00')
+
+    async def test_login_is_required(self):
+        await self.async_client.alogout()
+
+        response = await self.async_client.get(reverse('async-loan-list'))
+
+        self.assertEqual(response.status_code, 302)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.transactions = [post_transaction(Transaction(
+            account=self.account, amount=Decimal(i + 1), transaction_type='Deposit')) for i in range(7)]
+        # ties on timestamp must still be ordered by id.
+        Transaction.objects.filter(pk__in=[t.pk for t in self.transactions[2:5]]).update(
+            timestamp=self.transactions[2].timestamp)
+        self.newest_first = list(
+            Transaction.objects.order_by('-timestamp', '-pk'))
+
+    def test_walk_older_then_newer(self):
+        paginator = KeysetPaginator(Transaction.objects.all(), 3)
+
+        first = paginator.page()
+        second = paginator.page(older=first.older_cursor)
+        third = paginator.page(older=second.older_cursor)
+        self.assertEqual(first.object_list + second.object_list +
+                         third.object_list, self.newest_first)
+        self.assertFalse(first.has_newer)
+        self.assertFalse(third.has_older)
+
+        back = paginator.page(newer=third.newer_cursor)
+        self.assertEqual(back.object_list, second.object_list)
+        self.assertEqual(paginator.page(
+            newer=back.newer_cursor).object_list, first.object_list)
+
+    def test_row_class_pages_match_instances(self):
+        paginator = KeysetPaginator(Transaction.objects.all(), 3, row_class=LedgerRow)
+
+        first = paginator.page()
+        second = paginator.page(older=first.older_cursor)
+        self.assertEqual([row.pk for row in first.object_list + second.object_list],
+                         [t.pk for t in self.newest_first[:6]])
+        self.assertEqual(first.object_list[0].amount, self.newest_first[0].amount)
+        self.assertEqual(paginator.page(newer=second.newer_cursor).object_list, first.object_list)
+
+    def test_bad_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Transaction.objects.all(), 3)
+
+        self.assertEqual(paginator.page(older='garbage').object_list,
+                         self.newest_first[:3])
+
+    def test_report_view_pages_inside_date_filter(self):
+        self.client.force_login(self.account.user)
+        today = self.transactions[0].timestamp.date().isoformat()
+        params = {'start_date': today, 'end_date': today, 'page_size': 4}
+
+        response = self.client.get(reverse('transaction-report'), params)
+        self.assertEqual([row.pk for row in response.context['transactions']],
+                         [t.pk for t in self.newest_first[:4]])
+        self.assertFalse(response.context['newer_query'])
+        self.assertIn(f'start_date={today}', response.context['older_query'])
+
+        response = self.client.get(
+            reverse('transaction-report') + '?' + response.context['older_query'])
+        self.assertEqual([row.pk for row in response.context['transactions']],
+                         [t.pk for t in self.newest_first[4:]])
+        self.assertFalse(response.context['older_query'])
+
+
+class DailyBalanceTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.other = create_account('bob', balance=1000)
+
+    def post(self, account, amount, transaction_type):
+        return post_transaction(Transaction(
+            account=account, amount=Decimal(amount), transaction_type=transaction_type))
+
+    def test_postings_update_todays_rollup(self):
+        self.post(self.account, '200', 'Deposit')
+        self.post(self.account, '50', 'Withdraw')
+        transfer(self.account, self.other, Decimal('100'))
+
+        rollup = DailyBalance.objects.get(account=self.account)
+        self.assertEqual(rollup.opening_balance, Decimal('1000'))
+        self.assertEqual(rollup.closing_balance, Decimal('1050'))
+        self.assertEqual(rollup.deposit_total, Decimal('200'))
+        self.assertEqual(rollup.total_debit, Decimal('150'))
+        self.assertEqual(DailyBalance.objects.get(
+            account=self.other).receive_total, Decimal('100'))
+
+    def test_summary_is_scoped_to_the_account(self):
+        self.post(self.account, '200', 'Deposit')
+        self.post(self.other, '5000', 'Deposit')
+        today = timezone.localdate()
+
+        summary = summarize(self.account, today, today)
+
+        self.assertEqual(summary['opening_balance'], Decimal('1000'))
+        self.assertEqual(summary['closing_balance'], Decimal('1200'))
+        self.assertEqual(summary['total_credit'], Decimal('200'))
+        self.assertEqual(summary['total_debit'], Decimal('0'))
+
+    def test_report_shows_range_summary(self):
+        self.post(self.account, '200', 'Deposit')
+        self.client.force_login(self.account.user)
+        today = timezone.localdate().isoformat()
+
+        response = self.client.get(reverse('transaction-report'), {
+            'start_date': today, 'end_date': today})
+
+        self.assertEqual(response.context['summary']['closing_balance'], Decimal('1200'))
+        self.assertContains(response, 'Closing Balance')
+
+    def test_summary_for_a_quiet_range_carries_the_last_balance(self):
+        self.post(self.account, '200', 'Deposit')
+        later = timezone.localdate() + timedelta(days=3)
+
+        summary = summarize(self.account, later, later)
+
+        self.assertEqual(summary['opening_balance'], Decimal('1200'))
+        self.assertEqual(summary['closing_balance'], Decimal('1200'))
+
+    def test_rebuild_matches_incremental_rollup(self):
+        self.post(self.account, '200', 'Deposit')
+        self.post(self.account, '300', 'Withdraw')
+        loan = Transaction.objects.create(
+            account=self.account, amount=Decimal('100'), balance_after_transaction=Decimal('900'), transaction_type='Loan')
+        approve_loan(loan)
+        self.post(self.other, '10', 'Deposit')
+        expected = list(DailyBalance.objects.order_by('account_id').values())
+
+        self.assertEqual(rebuild(chunk_size=1), 2)
+        rebuilt = list(DailyBalance.objects.order_by('account_id').values())
+        for row in expected + rebuilt:
+            row.pop('id')
+        self.assertEqual(rebuilt, expected)
+
+    def test_rebuild_counts_loans_on_the_approval_day(self):
+        requested = timezone.now() - timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=requested):
+            loan = request_loan(Transaction(account=self.account, amount=Decimal('300')))
+        with mock.patch('django.utils.timezone.now', return_value=requested + timedelta(days=1)):
+            self.post(self.account, '100', 'Withdraw')
+        approve_loan(loan)
+        expected = list(DailyBalance.objects.order_by('date').values())
+
+        rebuild()
+        rebuilt = list(DailyBalance.objects.order_by('date').values())
+        for row in expected + rebuilt:
+            row.pop('id')
+        self.assertEqual(rebuilt, expected)
+        today = timezone.localdate()
+        self.assertEqual([(row['date'], row['opening_balance'], row['closing_balance']) for row in rebuilt], [
+            (today - timedelta(days=1), Decimal('1000'), Decimal('900')),
+            (today, Decimal('900'), Decimal('1200')),
+        ])
+        self.assertEqual(summarize(self.account, today, today)['loan_total'], Decimal('300'))
+
+    def test_rebuild_places_loans_without_approval_time_by_balance(self):
+        account = create_account('carol')
+        start = timezone.now() - timedelta(days=2)
+        with mock.patch('django.utils.timezone.now', return_value=start):
+            self.post(account, '1000', 'Deposit')
+            approve_loan(request_loan(Transaction(account=account, amount=Decimal('300'))))
+        self.post(account, '100', 'Withdraw')
+        # approved before approved_at was recorded: the loan fits in the chain before the withdrawal.
+        Transaction.objects.filter(transaction_type='Loan').update(approved_at=None)
+
+        rebuild(account_ids=[account.pk])
+
+        rows = DailyBalance.objects.filter(account=account).order_by('date')
+        self.assertEqual([(row.opening_balance, row.closing_balance, row.loan_total) for row in rows], [
+            (Decimal('0'), Decimal('1000'), Decimal('0')),
+            (Decimal('1000'), Decimal('1200'), Decimal('300')),
+        ])
+
+
+class StatementExportTests(TestCase):
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        self.deposit = post_transaction(Transaction(
+            account=self.account, amount=Decimal('200'), transaction_type='Deposit'))
+        post_transaction(Transaction(
+            account=self.account, amount=Decimal('50'), transaction_type='Withdraw'))
+        self.client.force_login(self.account.user)
+
+    def get_lines(self, **params):
+        response = self.client.get(reverse('transaction-export'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode().splitlines()
+
+    def test_csv_is_oldest_first(self):
+        response, lines = self.get_lines(format='csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn(f'statement-{self.account.account_no}.csv', response['Content-Disposition'])
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'timestamp', 'transaction_type', 'amount'])
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ['Deposit', 'Withdraw'])
+
+    def test_ndjson(self):
+        response, lines = self.get_lines(format='ndjson')
+
+        first = json.loads(lines[0])
+        self.assertEqual(first['id'], self.deposit.pk)
+        self.assertEqual(first['balance_after_transaction'], '1200.00')
+        self.assertEqual(len(lines), 2)
+
+    def test_date_filter_and_bad_format(self):
+        response, lines = self.get_lines(
+            format='ndjson', start_date='2000-01-01', end_date='2000-01-02')
+        self.assertEqual(lines, [])
+
+        response = self.client.get(reverse('transaction-export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkCreditTests(TestCase):
+    def setUp(self):
+        self.alice = create_account('alice', balance=1000)
+        self.bob = create_account('bob', balance=0)
+
+    def test_credit_accounts_is_one_update(self):
+        with self.assertNumQueries(1):
+            balances = credit_accounts(
+                {self.alice.pk: Decimal('10.25'), self.bob.pk: Decimal('5')})
+
+        self.assertEqual(balances, {self.alice.pk: Decimal(
+            '1010.25'), self.bob.pk: Decimal('5.00')})
+
+    def test_ingest_credits(self):
+        lines = [
+            'account_no,amount,reference',
+            f'{self.alice.account_no},100.50,PAY-1',
+            f'{self.bob.account_no},200',
+            f'{self.alice.account_no},10,PAY-3',
+            '999,10,PAY-4',
+            f'{self.bob.account_no},-5,PAY-5',
+            f'{self.bob.account_no},1.001,PAY-6',
+            'abc,10',
+        ]
+
+        credited, total, rejected = ingest_credits(lines, chunk_size=2)
+
+        self.assertEqual((credited, total), (3, Decimal('310.50')))
+        self.assertEqual([line.line_no for line in rejected], [5, 6, 7, 8])
+        self.assertEqual(rejected[0].reason, "Account doesn't exist")
+        alice_rows = Transaction.objects.filter(
+            account=self.alice).order_by('id')
+        self.assertEqual([(t.balance_after_transaction, t.reference) for t in alice_rows],
+                         [(Decimal('1100.50'), 'PAY-1'), (Decimal('1110.50'), 'PAY-3')])
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal('1110.50'))
+        self.assertEqual(DailyBalance.objects.get(
+            account=self.alice).deposit_total, Decimal('110.50'))
+
+    def test_upload_is_staff_only(self):
+        self.client.force_login(self.alice.user)
+        self.assertEqual(self.client.get(
+            reverse('bulk-credit')).status_code, 403)
+
+        staff = User.objects.create_user(username='clerk', is_staff=True)
+        self.client.force_login(staff)
+        upload = SimpleUploadedFile(
+            'payroll.csv', f'{self.bob.account_no},50,PAY-1\n999,1\n'.encode())
+        response = self.client.post(
+            reverse('bulk-credit'), {'credit_file': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([line.line_no for line in response.context['rejected']], [2])
+        self.bob.refresh_from_db()
+        self.assertEqual(self.bob.balance, Decimal('50'))
+
+    def test_unreadable_file_credits_nothing(self):
+        self.client.force_login(User.objects.create_user(username='clerk', is_staff=True))
+        # the bad byte is past the first chunk, which would already have been committed.
+        upload = SimpleUploadedFile(
+            'payroll.csv', f'{self.bob.account_no},50\n{self.alice.account_no},20\n'.encode() + b'\xff,1\n')
+
+        with mock.patch('transactions.bulk.apply_chunk') as apply_chunk:
+            response = self.client.post(reverse('bulk-credit'), {'credit_file': upload})
+
+        self.assertFormError(response.context['form'], 'credit_file',
+                             'Line 3 is not UTF-8 encoded text. Nothing was credited.')
+        apply_chunk.assert_not_called()
+
+    def test_account_deleted_during_ingest_is_rejected(self):
+        def delete_bob_first(amounts):
+            UserBankAccount.objects.filter(pk=self.bob.pk).delete()
+            return credit_accounts(amounts)
+
+        with mock.patch('transactions.bulk.credit_accounts', side_effect=delete_bob_first):
+            credited, total, rejected = ingest_credits(
+                [f'{self.alice.account_no},10', f'{self.bob.account_no},20'])
+
+        self.assertEqual((credited, total), (1, Decimal('10')))
+        self.assertEqual([(line.line_no, line.reason) for line in rejected], [(2, "Account doesn't exist")])
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal('1010'))
+
+
+class QueryCountTests(TestCase):
+    # session + user (with account and address joined) + what the page itself needs. a jump here usually means a lazy relation crept back in.
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+        UserAddress.objects.create(user=self.account.user, street_address='1 Road',
+                                   city='Dhaka', postal_code=1200, country='Bangladesh')
+        post_transaction(Transaction(account=self.account, amount=Decimal('10'), transaction_type='Deposit'))
+        self.loan = request_loan(Transaction(account=self.account, amount=Decimal('100')))
+        approve_loan(self.loan)
+        self.client.force_login(self.account.user)
+
+    def assertQueries(self, url, num, status_code=200, **headers):
+        with self.assertNumQueries(num):
+            response = self.client.get(url, headers=headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status_code)
+
+    def test_transaction_pages(self):
+        self.assertQueries(reverse('deposit'), 2)
+        self.assertQueries(reverse('withdraw'), 2)
+        self.assertQueries(reverse('transfer'), 2)
+        self.assertQueries(reverse('loan-request'), 2)
+        # the report and the loan list look up their ETag first, a repeat load stops there.
+        self.assertQueries(reverse('transaction-report'), 4)
+        etag = self.client.get(reverse('transaction-report'))['ETag']
+        self.assertQueries(reverse('transaction-report'), 3, status_code=304, if_none_match=etag)
+        self.assertQueries(reverse('transaction-report') + '?start_date=2024-01-01&end_date=2024-01-31', 6)
+        self.assertQueries(reverse('transaction-export'), 3)
+        self.assertQueries(reverse('loan-list'), 4)
+        self.assertQueries(reverse('loan-repayment', args=[self.loan.pk]), 16, status_code=302)
+
+    def test_staff_pages(self):
+        self.client.force_login(User.objects.create_user(username='clerk', is_staff=True))
+        self.assertQueries(reverse('bulk-credit'), 2)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'query plans are checked against sqlite')
+class LedgerIndexTests(TestCase):
+    # on tiny tables postgres prefers sequential scans, so the plans are only asserted on sqlite.
+    def setUp(self):
+        self.account = create_account('alice', balance=1000)
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan.replace('COVERING ', ''))
+
+    def test_report_date_range_uses_account_timestamp_index(self):
+        start, end = get_timestamp_range(
+            {'start_date': '2024-01-01', 'end_date': '2024-01-31'})
+        queryset = Transaction.objects.filter(
+            account=self.account, timestamp__gte=start, timestamp__lt=end)
+
+        plan = queryset.explain()
+        self.assertIn('USING INDEX txn_account_timestamp_idx', plan)
+        # both timestamp bounds are part of the index search, not a filter applied afterwards.
+        self.assertIn('timestamp>? AND timestamp<?', plan)
+
+    def test_keyset_page_reads_the_index_in_order(self):
+        txn = post_transaction(Transaction(
+            account=self.account, amount=Decimal('1'), transaction_type='Deposit'))
+        # the query KeysetPaginator runs for an "older" cursor.
+        queryset = Transaction.objects.filter(account=self.account, timestamp__lte=txn.timestamp).exclude(
+            timestamp=txn.timestamp, pk__gte=txn.pk).order_by('-timestamp', '-pk')
+
+        plan = queryset.explain()
+        self.assertIn('USING INDEX txn_account_timestamp_idx', plan)
+        # no separate sort step: the rows come out of the index already ordered.
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_open_loan_count_uses_type_index(self):
+        queryset = Transaction.objects.filter(
+            account=self.account, transaction_type='Loan', loan_repayment=False).order_by()
+
+        self.assertUsesIndex(queryset, 'txn_account_type_repaid_idx')
+
+    def test_loan_list_is_an_index_search(self):
+        queryset = Transaction.objects.filter(
+            account=self.account, transaction_type='Loan')
+
+        self.assertIn('SEARCH transactions_transaction USING', queryset.explain())
+        self.assertNotIn('SCAN transactions_transaction', queryset.explain())
+
+
+class ConcurrentPostingTests(TransactionTestCase):
+    threads = 8
+    postings_per_thread = 25
+
+    def run_threads(self, target, count):
+        def run():
+            try:
+                target()
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=run) for _ in range(count)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def test_concurrent_deposits_and_withdrawals_do_not_lose_updates(self):
+        account = create_account('alice', balance=1000)
+        errors = []
+        counter = iter(range(self.threads))
+
+        def worker():
+            transaction_type = 'Deposit' if next(counter) % 2 else 'Withdraw'
+            for _ in range(self.postings_per_thread):
+                try:
+                    post_transaction(Transaction(
+                        account_id=account.pk, amount=Decimal('10'), transaction_type=transaction_type))
+                except Exception as error:
+                    errors.append(error)
+
+        self.run_threads(worker, self.threads)
+
+        self.assertEqual(errors, [])
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('1000'))
+        self.assertEqual(Transaction.objects.count(),
+                         self.threads * self.postings_per_thread)
+        # balance_after_transaction forms an unbroken chain, i.e. no posting was computed from a stale read.
+        running = Decimal('1000')
+        for txn in Transaction.objects.order_by('id'):
+            running += txn.amount if txn.transaction_type == 'Deposit' else -txn.amount
+            self.assertEqual(txn.balance_after_transaction, running)
+
+    def test_concurrent_withdrawals_never_go_below_minimum(self):
+        account = create_account('bob', balance=1000)
+        results = []
+
+        def worker():
+            try:
+                post_transaction(Transaction(
+                    account_id=account.pk, amount=Decimal('100'), transaction_type='Withdraw'), minimum_balance=500)
+                results.append(True)
+            except InsufficientBalance:
+                results.append(False)
+
+        self.run_threads(worker, 10)
+
+        account.refresh_from_db()
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(account.balance, Decimal('500'))
+
+    def test_crossing_transfers_keep_money_conserved(self):
+        alice = create_account('alice', balance=1000)
+        bob = create_account('bob', balance=1000)
+        errors = []
+        counter = iter(range(self.threads))
+
+        def worker():
+            # half of the threads send alice -> bob, the other half bob -> alice.
+            if next(counter) % 2:
+                sender, receiver = alice, bob
+            else:
+                sender, receiver = bob, alice
+            for _ in range(self.postings_per_thread):
+                try:
+                    transfer(UserBankAccount(pk=sender.pk, account_no=sender.account_no),
+                             UserBankAccount(pk=receiver.pk, account_no=receiver.account_no), Decimal('10'))
+                except Exception as error:
+                    errors.append(error)
+
+        self.run_threads(worker, self.threads)
+
+        self.assertEqual(errors, [])
+        alice.refresh_from_db()
+        bob.refresh_from_db()
+        self.assertEqual(alice.balance + bob.balance, Decimal('2000'))
+        self.assertEqual(Transaction.objects.count(),
+                         2 * self.threads * self.postings_per_thread)
+
+
+class GenerateLedgerTests(TestCase):
+    def test_ledgers_are_consistent(self):
+        call_command('generate_ledger', accounts=25, transactions_per_account=30, chunk_size=10,
+                     workers=1, stdout=StringIO())
+        accounts = UserBankAccount.objects.filter(user__username__startswith='synthetic_')
+        self.assertEqual(accounts.count(), 25)
+
+        running = {}
+        for account_id, transaction_type, amount, balance_after, loan_approved in Transaction.objects.order_by(
+                'account_id', 'timestamp', 'id').values_list(
+                'account_id', 'transaction_type', 'amount', 'balance_after_transaction', 'loan_approved'):
+            balance = running.get(account_id, Decimal(0))
+            if transaction_type != 'Loan' or loan_approved:
+                balance += signed_amount(transaction_type, amount)
+            self.assertEqual(balance_after, balance)
+            running[account_id] = balance
+        for account in accounts:
+            self.assertEqual(account.balance, running[account.pk])
+            self.assertEqual(account.account_no, ACCOUNT_NO_START + account.user_id)
+        self.assertEqual(set(Transaction.objects.values_list('transaction_type', flat=True)),
+                         {'Deposit', 'Withdraw', 'Transfer', 'Receive', 'Loan', 'Repayment'})
+        # money only moves between the generated accounts, apart from deposits, withdrawals and loans.
+        self.assertEqual(
+            sorted(Transaction.objects.filter(transaction_type='Transfer').values_list('timestamp', 'amount')),
+            sorted(Transaction.objects.filter(transaction_type='Receive').values_list('timestamp', 'amount')))
+
+        self.assertEqual(rebuild_loan_counters(), 0)
+        rollups = list(DailyBalance.objects.order_by('account_id', 'date').values_list(
+            'account_id', 'date', 'opening_balance', 'closing_balance', 'deposit_total', 'loan_total'))
+        rebuild()
+        self.assertEqual(rollups, list(DailyBalance.objects.order_by('account_id', 'date').values_list(
+            'account_id', 'date', 'opening_balance', 'closing_balance', 'deposit_total', 'loan_total')))
+
+    def test_refuses_a_prefix_in_use(self):
+        create_account('synthetic_0')
+        with self.assertRaisesMessage(CommandError, 'pick another --prefix'):
+            call_command('generate_ledger', accounts=1, workers=1, stdout=StringIO())
+
+
+class ReconcileLedgerTests(TestCase):
+    def reconcile(self, out=None):
+        out = out or StringIO()
+        call_command('reconcile_ledger', workers=1, shards=3, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def post(self, account, transaction_type, amount):
+        return post_transaction(Transaction(
+            account_id=account.pk, amount=Decimal(amount), transaction_type=transaction_type))
+
+    def test_loans_approved_later_still_reconcile(self):
+        alice = create_account('alice')
+        create_account('bob')
+        self.post(alice, 'Deposit', '1000')
+        later = request_loan(Transaction(account=alice, amount=Decimal('300')))
+        self.post(alice, 'Withdraw', '100')
+        # approved after the withdrawal, so its balance_after includes it although it is older.
+        approve_loan(later)
+        now = request_loan(Transaction(account=UserBankAccount.objects.get(pk=alice.pk), amount=Decimal('200')))
+        approve_loan(now)
+        request_loan(Transaction(account=UserBankAccount.objects.get(pk=alice.pk), amount=Decimal('150')))
+        self.post(alice, 'Deposit', '50')
+
+        self.assertIn('Checked 2 account(s) and 6 transaction(s)', self.reconcile())
+
+    def test_reports_the_first_bad_transaction(self):
+        alice = create_account('alice')
+        bob = create_account('bob')
+        self.post(alice, 'Deposit', '1000')
+        bad = self.post(alice, 'Withdraw', '100')
+        self.post(alice, 'Deposit', '10')
+        self.post(bob, 'Deposit', '500')
+        Transaction.objects.filter(pk=bad.pk).update(balance_after_transaction=Decimal('950'))
+        UserBankAccount.objects.filter(pk=bob.pk).update(balance=Decimal('400'))
+
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, "2 account(s) don't reconcile"):
+            self.reconcile(out)
+        self.assertIn(f'first bad transaction {bad.pk}: balance_after_transaction 950.00, expected 900.00',
+                      out.getvalue())
+        self.assertIn(f'account {bob.account_no} (id {bob.pk}): balance 400.00, the postings add up to 500.00',
+                      out.getvalue())
+
+    def test_generated_ledgers_reconcile(self):
+        call_command('generate_ledger', accounts=20, chunk_size=7, workers=1, stdout=StringIO())
+        self.assertIn('Every account reconciles.', self.reconcile())
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    # a TransactionTestCase: the worker threads have their own connections and must see the seeded accounts.
+    # the report flow reads from the replica when one is configured.
+    databases = '__all__'
+
+    def test_runs_every_flow_and_compares_with_a_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('loadtest', accounts=3, workers=2, requests=15, output=output, stdout=StringIO())
+            with open(output) as results_file:
+                results = json.load(results_file)
+            self.assertEqual(results['failures'], [])
+            self.assertTrue(results['flows'])
+            for stats in results['flows'].values():
+                self.assertEqual(stats['errors'], 0)
+                self.assertGreater(stats['queries_per_request'], 0)
+            self.assertFalse(User.objects.filter(username__startswith='loadtest_').exists())
+            self.assertFalse(OutboxEmail.objects.filter(to__startswith='loadtest_').exists())
+
+            # a baseline that made fewer queries per request makes the comparison fail.
+            for stats in results['flows'].values():
+                stats['queries_per_request'] -= 2
+            results['throughput_rps'] = 0
+            with open(output, 'w') as results_file:
+                json.dump(results, results_file)
+            with self.assertRaisesMessage(CommandError, 'queries/request'):
+                call_command('loadtest', accounts=3, workers=2, requests=15, baseline=output,
+                             max_regression=1000, stdout=StringIO())
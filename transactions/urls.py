@@ -1,5 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from .views import DepositMoney, TransferMoney, WithdrawMoney, LoanRequest, LoanRepayment, TransactionReport, LoanList
+from .views import DepositMoney, TransferMoney, WithdrawMoney, LoanRequest, LoanRepayment, TransactionReport, LoanList, StatementExport, BulkCreditUpload
+from .views import AsyncLoanList, AsyncTransactionReport
+
+# the async versions only pay off under an ASGI server, see ASYNC_VIEWS in the settings.
+ReportView = AsyncTransactionReport if settings.ASYNC_VIEWS else TransactionReport
+LoanListView = AsyncLoanList if settings.ASYNC_VIEWS else LoanList
 
 urlpatterns = [
     path('deposit/', DepositMoney.as_view(), name='deposit'),
@@ -8,7 +14,10 @@ urlpatterns = [
     path('loan-request/', LoanRequest.as_view(), name='loan-request'),
     path('loan-repayment/<int:loan_id>/',
          LoanRepayment.as_view(), name='loan-repayment'),
-    path('transaction-report/', TransactionReport.as_view(),
+    path('transaction-report/', ReportView.as_view(),
          name='transaction-report'),
-    path('loan-list/', LoanList.as_view(), name='loan-list'),
+    path('transaction-export/', StatementExport.as_view(),
+         name='transaction-export'),
+    path('loan-list/', LoanListView.as_view(), name='loan-list'),
+    path('bulk-credit/', BulkCreditUpload.as_view(), name='bulk-credit'),
 ]
@@ -1,30 +1,163 @@
-from django.views.generic import CreateView, ListView
+from django.conf import settings
+from django.views.generic import CreateView, FormView, ListView
 from django.views import View
 from django.urls import reverse_lazy
-from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Transaction
-from .forms import DepositForm, TransferForm, WithdrawForm, LoanRequestForm
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from .models import LedgerRow, Transaction
+from .forms import DepositForm, TransferForm, WithdrawForm, LoanRequestForm, BulkCreditForm
 from django.contrib import messages
-from django.http import HttpResponse
-from datetime import datetime
-from django.db.models import Sum
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+import codecs
+import csv
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+from functools import wraps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from django.shortcuts import get_object_or_404, redirect
-from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.decorators import method_decorator
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from asgiref.sync import sync_to_async
+from core import metrics
+from core.outbox import queue_email
+from accounts import directory
+from core.views import AsyncUserMixin
+from django_bank.routers import read_from_replica
+from .bulk import UnreadableFile, check_file, ingest_credits
+from .pagination import KeysetPaginator
+from .rollups import summarize
+from .services import AccountNotFound, InsufficientBalance, LoanLimitReached, post_transaction, repay_loan, request_loan, transfer
 # Create your views here.
 
 # we will inherit this view for all transaction such as deposit, withdrawal, transfer, loan request, etc.
 
 
-def send_transaction_email(user, receiver, email, amount, mail_subject, html_template):
-    message = render_to_string(html_template, {
+def get_date_range(params):
+    # the inclusive (start_date, end_date) from the query parameters, or None when missing or malformed.
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    if not (start_date and end_date):
+        return None
+    try:
+        # converting string to date
+        return (datetime.strptime(start_date, '%Y-%m-%d').date(),
+                datetime.strptime(end_date, '%Y-%m-%d').date())
+    except ValueError:
+        return None
+
+
+def get_timestamp_range(params):
+    """
+    Turn the inclusive ``start_date``/``end_date`` query parameters into a
+    half-open ``(start, end)`` pair of aware datetimes, or None when the range
+    is missing or malformed.
+    """
+    date_range = get_date_range(params)
+    if date_range is None:
+        return None
+    start_date, end_date = date_range
+    # end_date is inclusive, so the range stops at the start of the next day.
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(
+        end_date + timedelta(days=1), time.min))
+    return start, end
+
+
+def render_transaction_email(user, receiver, amount, html_template):
+    return render_to_string(html_template, {
         'user': user,
         'receiver': receiver,
         'amount': amount
     })
-    send_email = EmailMultiAlternatives(mail_subject, '', to=[email])
-    send_email.attach_alternative(message, "text/html")
-    send_email.send()
+
+
+def send_transaction_email(user, receiver, email, amount, mail_subject, html_template):
+    with metrics.email_queue_duration.time():
+        message = render_transaction_email(
+            user, receiver, amount, html_template)
+        # the email is only written to the outbox here. the send_outbox command delivers it, so the request doesn't wait for the mail server.
+        queue_email(mail_subject, email, html_body=message)
+
+
+def csrf_secret(request):
+    # the page renders a token anyway. getting it first makes sure the secret exists before it goes into the ETag, otherwise the first load of a new visitor would have a different ETag than the second.
+    get_token(request)
+    return request.META['CSRF_COOKIE']
+
+
+def account_etag(request, *args, **kwargs):
+    """
+    ETag of the pages that only show the account's own ledger: the report and
+    the loan list. One indexed lookup of the latest posting, the rest is on the
+    account row the view loads anyway.
+    """
+    # a page with a flash message waiting must be rendered, a 304 would leave the message unseen.
+    if len(messages.get_messages(request)):
+        return None
+    return hash_account_page(request, latest_posting(request).first())
+
+
+async def aaccount_etag(request):
+    # account_etag for the async views.
+    if len(messages.get_messages(request)):
+        return None
+    return hash_account_page(request, await latest_posting(request).afirst())
+
+
+def latest_posting(request):
+    return Transaction.objects.filter(account=request.user.account).order_by(
+        '-timestamp', '-id').values_list('id', 'timestamp')
+
+
+def hash_account_page(request, latest):
+    account = request.user.account
+    # a loan approval updates an old row instead of adding one, but it always changes the balance and the loan counters. the first name is in the navbar, and so is the logout form, whose csrf token is only valid with the csrf cookie it was rendered for (a new login rotates it).
+    validator = (account.pk, latest, account.balance, account.open_loans,
+                 account.outstanding_loan_amount, request.user.first_name, csrf_secret(request))
+    return hashlib.md5(repr(validator).encode(), usedforsecurity=False).hexdigest()
+
+
+def report_rows_key(transactions):
+    """
+    Cache key part of a page of report rows. It covers every field the rows
+    show, so a cached page is reused for as long as its rows are unchanged and
+    an approval or an admin edit renders it again.
+    """
+    # keyset pages older than the first one keep their id range when new postings arrive, so only the newest page is rendered again.
+    rows = [(t.pk, t.timestamp, t.transaction_type, t.amount, t.balance_after_transaction, t.loan_approved)
+            for t in transactions]
+    return hashlib.md5(repr(rows).encode(), usedforsecurity=False).hexdigest()
+
+
+def account_condition(view):
+    """
+    ``condition(etag_func=account_etag)`` for async views. django's condition
+    calls the etag function synchronously, which can't query from the event
+    loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        etag = await aaccount_etag(request)
+        etag = etag and quote_etag(etag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        if etag and request.method in ('GET', 'HEAD'):
+            response.headers.setdefault('ETag', etag)
+        return response
+    return wrapper
+
+
+# browsers keep the page but always revalidate it (no-cache), so a repeat load is a 304 until something changes. private: it's one customer's ledger, shared caches must not keep it.
+account_page = [cache_control(private=True, no_cache=True), condition(etag_func=account_etag)]
+async_account_page = [cache_control(private=True, no_cache=True), account_condition]
 
 
 class CreateTransactionView(LoginRequiredMixin, CreateView):
@@ -59,13 +192,12 @@ class DepositMoney(CreateTransactionView):
         initial = {'transaction_type': 'Deposit'}
         return initial
 
+    @transaction.atomic
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        account = self.request.user.account
-        account.balance += amount
-        account.save(
-            update_fields=['balance']
-        )
+        form.instance.account = self.request.user.account
+        # the balance is changed by one UPDATE in the database and the transaction row is inserted in the same atomic block.
+        self.object = post_transaction(form.instance)
 
         messages.success(
             self.request, f'You have successfully deposited ${amount:,.2f}')
@@ -74,7 +206,7 @@ class DepositMoney(CreateTransactionView):
             self.request.user, None, self.request.user.email, amount, 'Deposit Confirmation', 'email/deposit_email.html'
         )
 
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class WithdrawMoney(CreateTransactionView):
@@ -85,13 +217,18 @@ class WithdrawMoney(CreateTransactionView):
         initial = {'transaction_type': 'Withdraw'}
         return initial
 
+    @transaction.atomic
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        account = self.request.user.account
-        account.balance -= amount
-        account.save(
-            update_fields=['balance']
-        )
+        form.instance.account = self.request.user.account
+        try:
+            # the form checked the balance we loaded, but only this conditional update is safe against concurrent withdrawals.
+            self.object = post_transaction(
+                form.instance, minimum_balance=form.required_balance)
+        except InsufficientBalance:
+            form.add_error(
+                'amount', "Our bank is in bankruptcy situation. You can't withdraw this amount.")
+            return self.form_invalid(form)
 
         messages.success(
             self.request, f'You have successfully withdrawn ${amount:,.2f}')
@@ -100,63 +237,50 @@ class WithdrawMoney(CreateTransactionView):
             self.request.user, None, self.request.user.email, amount, 'Withdrawal Confirmation', 'email/withdraw_email.html'
         )
 
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
-class TransferMoney(CreateView):
+class TransferMoney(CreateTransactionView):
     form_class = TransferForm
-    template_name = 'transactions/transaction_form.html'
-    success_url = reverse_lazy('transaction-report')
     title = 'Transfer Money'
 
     def get_initial(self):
         initial = {'transaction_type': 'Transfer'}
         return initial
 
-    def get_form_kwargs(self):
-        kwargs = super().get_form_kwargs()
-        kwargs['account'] = self.request.user.account
-        return kwargs
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['title'] = self.title
-        return context
-
     def form_valid(self, form):
         sender_account = self.request.user.account
         receiver_account = form.cleaned_data.get('receiver_account_no')
         amount = form.cleaned_data.get('amount')
 
-        sender_account.balance -= amount
-        sender_account.save(
-            update_fields=['balance']
-        )
-
-        receiver_account.balance += amount
-        receiver_account.save(
-            update_fields=['balance']
-        )
-
-        Transaction.objects.create(
-            account=receiver_account,
-            amount=amount,
-            balance_after_transaction=receiver_account.balance,
-            transaction_type='Receive'
-        )
+        def queue_emails(sent, received):
+            # called inside the transfer's transaction, so the emails are committed together with both legs.
+            send_transaction_email(
+                self.request.user, receiver_account, self.request.user.email, amount, 'Transfer Confirmation', 'email/sender_email.html'
+            )
+
+            send_transaction_email(
+                self.request.user, receiver_account, receiver_account.user.email, amount, 'Transfer Confirmation', 'email/receiver_email.html'
+            )
+
+        try:
+            # both balances, the Transfer row and the Receive row are written in one transaction (retried on deadlock).
+            self.object, received = transfer(
+                sender_account, receiver_account, amount, on_posted=queue_emails)
+        except InsufficientBalance:
+            form.add_error(
+                'amount', f"Insufficient balance. Your balance is ${sender_account.balance:,.2f}")
+            return self.form_invalid(form)
+        except AccountNotFound:
+            # the receiver came from the cached directory and was deleted since, possibly by another process.
+            directory.invalidate(receiver_account.account_no)
+            form.add_error('receiver_account_no', "Account doesn't Exist!")
+            return self.form_invalid(form)
 
         messages.success(
             self.request, f'You have successfully transferred ${amount:,.2f} to {receiver_account.user.username}')
 
-        send_transaction_email(
-            self.request.user, receiver_account, self.request.user.email, amount, 'Transfer Confirmation', 'email/sender_email.html'
-        )
-
-        send_transaction_email(
-            self.request.user, receiver_account, receiver_account.user.email, amount, 'Transfer Confirmation', 'email/receiver_email.html'
-        )
-
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class LoanRequest(CreateTransactionView):
@@ -167,13 +291,15 @@ class LoanRequest(CreateTransactionView):
         initial = {'transaction_type': 'Loan'}
         return initial
 
+    @transaction.atomic
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        loan_count = Transaction.objects.filter(
-            account=self.request.user.account, transaction_type='Loan', loan_repayment=False).count()
-
-        if loan_count >= 3:
-            return HttpResponse('You have reached the maximum limit of loan request')
+        form.instance.account = self.request.user.account
+        try:
+            # open_loans on the account replaces counting the loans on every request.
+            self.object = request_loan(form.instance)
+        except LoanLimitReached as error:
+            return HttpResponse(str(error))
 
         messages.success(
             self.request, f'You have successfully requested ${amount:,.2f} loan and awaiting for admin approval')
@@ -182,97 +308,234 @@ class LoanRequest(CreateTransactionView):
             self.request.user, None, self.request.user.email, amount, 'Loan Request', 'email/loan_request_email.html'
         )
 
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
+# the report, the loan list and the export only read, so they can use the replica. LoginRequiredMixin.dispatch runs first, so the session and user come from the primary. the ETag is read from the same database as the page.
+@method_decorator([read_from_replica, *account_page], name='get')
 class TransactionReport(LoginRequiredMixin, ListView):
     template_name = 'transactions/transaction_report.html'
     model = Transaction
-    balance = 0
+    summary = None
+    page = None
     # if i didn't use context_object_name, then i have to use object_list in the template.
     context_object_name = 'transactions'
 
+    def get_paginate_by(self, queryset):
+        # ?page_size= can change the page size, but only within the configured limit.
+        page_size = settings.TRANSACTION_REPORT_PAGE_SIZE
+        try:
+            page_size = int(self.request.GET.get('page_size', page_size))
+        except ValueError:
+            pass
+        return min(max(page_size, 1), settings.TRANSACTION_REPORT_MAX_PAGE_SIZE)
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        # keyset pagination instead of django's OFFSET based Paginator, so deep pages are as cheap as the first one. the rows are LedgerRow tuples with only the columns the template shows.
+        return KeysetPaginator(queryset, per_page, row_class=LedgerRow)
+
+    def get_cursors(self):
+        return {'older': self.request.GET.get('older'), 'newer': self.request.GET.get('newer')}
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_paginator(queryset, page_size)
+        page = self.page
+        if page is None:
+            # the async view has fetched its page already, the sync one fetches it here.
+            page = paginator.page(**self.get_cursors())
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_page_query(self, direction, cursor):
+        # keep the date filters and page size, replace the cursor.
+        params = self.request.GET.copy()
+        params.pop('older', None)
+        params.pop('newer', None)
+        params[direction] = cursor
+        return params.urlencode()
+
+    def get(self, request, *args, **kwargs):
+        self.summary = self.get_summary()
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         # by default all transactions will be shown
         queryset = super().get_queryset().filter(
             account=self.request.user.account)
 
-        start_date = self.request.GET.get('start_date')
-        end_date = self.request.GET.get('end_date')
+        date_range = get_timestamp_range(self.request.GET)
 
-        if start_date and end_date:
-            # converting string to date
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            # transactions will be filtered based on the date range
-            # queryset = queryset.filter(
-            #     transaction_date__date__range=[start_date, end_date])
+        if date_range:
+            # transactions will be filtered based on the date range. comparing the raw timestamp column (instead of timestamp__date) lets the database use the (account, timestamp) index.
             queryset = queryset.filter(
-                timestamp__date__gte=start_date, timestamp__date__lte=end_date)
-
-            # calculating the filtered transactions balance
-            self.balance = Transaction.objects.filter(timestamp__date__gte=start_date, timestamp__date__lte=end_date).aggregate(
-                # amount__sum is the key of the dictionary returned by aggregate method. we can also use balance=Sum('amount') but then we have to use balance.balance to access the balance in the template. so we use amount__sum (Note: comment will be updated later!)
-                Sum('amount'))['amount__sum']
-        else:
-            # by default calculating the balance of all transactions
-            self.balance = self.request.user.account.balance
+                timestamp__gte=date_range[0], timestamp__lt=date_range[1])
 
         # return queryset.distinct()
         return queryset
 
+    def get_summary(self):
+        date_range = get_date_range(self.request.GET)
+        if date_range:
+            # the range summary (opening/closing balance, credits, debits) comes from the daily rollup rows, one per active day, instead of summing the ledger.
+            return summarize(self.request.user.account, *date_range)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        page = context['page_obj']
         context.update({
             'account': self.request.user.account,
+            'summary': self.summary,
+            'rows_key': report_rows_key(page.object_list),
+            'rows_timeout': settings.TRANSACTION_REPORT_CACHE_TIMEOUT,
+            'older_query': page.has_older and self.get_page_query('older', page.older_cursor),
+            'newer_query': page.has_newer and self.get_page_query('newer', page.newer_cursor),
         })
         return context
 
 
+@method_decorator([read_from_replica, *async_account_page], name='get')
+class AsyncTransactionReport(AsyncUserMixin, TransactionReport):
+    # the report for ASGI (ASYNC_VIEWS): the queries go through the async ORM, the rendering happens in the handler's thread like for every TemplateResponse.
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        paginator = self.get_paginator(self.object_list, self.get_paginate_by(self.object_list))
+        self.page = await paginator.apage(**self.get_cursors())
+        self.summary = await sync_to_async(self.get_summary)()
+        return self.render_to_response(self.get_context_data())
+
+
 class LoanRepayment(LoginRequiredMixin, View):
+    @transaction.atomic
     def get(self, request, loan_id):
-        loan = get_object_or_404(Transaction, id=loan_id)
-        if loan.loan_approved:
-            customer = loan.account
-            if loan.amount <= customer.balance:
-                customer.balance -= loan.amount
-                # loan.balance_after_transaction = customer.balance (this line is not needed because we are creating new transaction instead of updating the loan transaction)
-                customer.save()
-                # loan.transaction_type = 'Repayment' (also not needed because we are creating new transaction instead of updating the loan transaction)
-                loan.loan_repayment = True
-                loan.save()
-
-                # creating the new repayment transaction instead of updating the loan transaction
-                Transaction.objects.create(
-                    account=loan.account,
-                    amount=loan.amount,
-                    balance_after_transaction=customer.balance,
-                    transaction_type='Repayment'
-                )
-
-                messages.success(
-                    request, f'You have successfully repaid ${loan.amount:,.2f}')
-
-                send_transaction_email(
-                    request.user, None, request.user.email, loan.amount, 'Loan Repayment Confirmation', 'email/loan_repayment_email.html'
-                )
-
-                return redirect('transaction-report')
-            else:
-                messages.error(
-                    request, f'You have insufficient balance to repay ${loan.amount:,.2f}')
-
-                return redirect('transaction-report')
+        loan = get_object_or_404(
+            Transaction, id=loan_id, account=request.user.account, transaction_type='Loan')
+        # the account is already loaded with the user, no need to fetch it again through the loan.
+        loan.account = request.user.account
+        if not loan.loan_approved or loan.loan_repayment:
+            messages.error(request, 'This loan is not open for repayment')
+            return redirect('loan-list')
+
+        try:
+            # creating the new repayment transaction instead of updating the loan transaction
+            repayment = repay_loan(loan)
+        except InsufficientBalance:
+            messages.error(
+                request, f'You have insufficient balance to repay ${loan.amount:,.2f}')
+            return redirect('transaction-report')
+
+        if repayment is None:
+            messages.error(request, 'This loan is not open for repayment')
+            return redirect('loan-list')
+
+        messages.success(
+            request, f'You have successfully repaid ${loan.amount:,.2f}')
+
+        send_transaction_email(
+            request.user, None, request.user.email, loan.amount, 'Loan Repayment Confirmation', 'email/loan_repayment_email.html'
+        )
 
+        return redirect('transaction-report')
 
+
+@method_decorator([read_from_replica, *account_page], name='get')
 class LoanList(LoginRequiredMixin, ListView):
     template_name = 'transactions/loan_lists.html'
     model = Transaction
     context_object_name = 'loans'
 
     def get_queryset(self):
+        # LedgerRow tuples instead of model instances, the list only shows a few columns.
+        return [LedgerRow._make(row) for row in self.get_loans()]
+
+    def get_loans(self):
         customer = self.request.user.account
         loan_queryset = Transaction.objects.filter(
             account=customer, transaction_type='Loan')
 
-        return loan_queryset
+        return loan_queryset.values_list(*LedgerRow._fields)
+
+
+@method_decorator([read_from_replica, *async_account_page], name='get')
+class AsyncLoanList(AsyncUserMixin, LoanList):
+    async def get(self, request, *args, **kwargs):
+        self.object_list = [LedgerRow._make(row) async for row in self.get_loans()]
+        return self.render_to_response(self.get_context_data())
+
+
+class Echo:
+    # csv.writer needs a file-like object. this one just hands the formatted line back so it can be streamed.
+    def write(self, value):
+        return value
+
+
+@method_decorator(read_from_replica, name='get')
+class StatementExport(LoginRequiredMixin, View):
+    # full statement download as CSV or NDJSON. rows are streamed from a server-side cursor, so memory use doesn't depend on the size of the account's history.
+    fields = ['id', 'timestamp', 'transaction_type', 'amount',
+              'balance_after_transaction', 'loan_approved', 'loan_repayment']
+    formats = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get_queryset(self):
+        queryset = Transaction.objects.filter(
+            account=self.request.user.account)
+        date_range = get_timestamp_range(self.request.GET)
+        if date_range:
+            queryset = queryset.filter(
+                timestamp__gte=date_range[0], timestamp__lt=date_range[1])
+        # a statement reads oldest first. values_list skips building model instances for every row.
+        return queryset.order_by('timestamp', 'id').values_list(*self.fields)
+
+    def get_rows(self):
+        return self.get_queryset().using(self.database).iterator(chunk_size=settings.STATEMENT_EXPORT_CHUNK_SIZE)
+
+    def stream_csv(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.fields)
+        for row in self.get_rows():
+            yield writer.writerow(row)
+
+    def stream_ndjson(self):
+        for row in self.get_rows():
+            yield json.dumps(dict(zip(self.fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in self.formats:
+            return HttpResponse('Unknown export format', status=400)
+
+        # the rows are read while the response streams, after get() returned, so the database is picked now.
+        self.database = Transaction.objects.db
+        stream = self.stream_csv() if export_format == 'csv' else self.stream_ndjson()
+        response = StreamingHttpResponse(
+            stream, content_type=self.formats[export_format])
+        account_no = request.user.account.account_no
+        response['Content-Disposition'] = f'attachment; filename="statement-{account_no}.{export_format}"'
+        return response
+
+
+class BulkCreditUpload(LoginRequiredMixin, UserPassesTestMixin, FormView):
+    # back office upload for payroll style files. every line becomes a Deposit on the given account.
+    template_name = 'transactions/bulk_credit.html'
+    form_class = BulkCreditForm
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def form_valid(self, form):
+        # the upload is decoded and parsed line by line, never read into memory as a whole. it's read twice: the chunks commit one by one, so a bad line has to be found before the first one does.
+        upload = form.cleaned_data['credit_file']
+        try:
+            check_file(codecs.iterdecode(upload, 'utf-8-sig'))
+        except UnreadableFile as error:
+            form.add_error('credit_file', f'{error} Nothing was credited.')
+            return self.form_invalid(form)
+        upload.seek(0)
+        credited, total, rejected = ingest_credits(codecs.iterdecode(upload, 'utf-8-sig'))
+
+        messages.success(
+            self.request, f'Credited {credited} line(s), ${total:,.2f} in total')
+        if rejected:
+            messages.error(self.request, f'Rejected {len(rejected)} line(s)')
+        return self.render_to_response(self.get_context_data(form=self.form_class(), rejected=rejected))